@@ -1,27 +1,45 @@
 import pandas as pd
 import numpy as np
-import yfinance as yf
 import time
+import random
 import os.path
+from market_benchmarks import benchmark_for, get_benchmark, market_correlation
+from data_sources import get_source
+from telemetry import default_telemetry, stage, count
+from universe import load_index_info
+# The rest of the tree (writers / pyarrow, constituents, pipeline, journal, price_store, metrics, indicators, scheduler)
+# is imported by the functions that use it, so a single symbol lookup only loads what it runs
 
 # Dictionary of indices, their Wikipedia URLs, and table indices (0-based) to fetch the list of stocks
-index_info = {
-    "S&P 500": {"url": "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies", "table_index": 0},
-    "Dow Jones": {"url": "https://en.wikipedia.org/wiki/Dow_Jones_Industrial_Average", "table_index": 2},
-    "NASDAQ 100": {"url": "https://en.wikipedia.org/wiki/NASDAQ-100", "table_index": 4},
-    "Russell 2000": {"url": "https://en.wikipedia.org/wiki/Russell_2000_Index", "table_index": 2}, #Wiki doesnt actually list all Russsel
-    "FTSE 100": {"url": "https://en.wikipedia.org/wiki/FTSE_100_Index", "table_index": 4},
-    "DAX": {"url": "https://en.wikipedia.org/wiki/DAX", "table_index": 4}
-}
+# Shared with the Flask app through server/indices.json (Wiki doesnt actually list all Russsel 2000 members)
+index_info = load_index_info()
+
+# Column order of the fetch_stock_data result dictionary
+RESULT_COLUMNS = ['Symbol', 'Total Volume', 'Average Yearly Volume', 'Sector/Industry', 'Correlation with Market', 'Beta',
+                'Dividend Pays', 'P/E Ratio', 'SMA 50', 'SMA 200', 'Max Drawdown', 'Sharpe Ratio', 'Incomplete Data',
+                'Data Range', 'First Trading Date', 'Historical Range']
+
+# Output type of the result columns that aren't numbers, every other one (metrics, indicators) is written as a float
+RESULT_DTYPES = {'Symbol': 'string', 'Sector/Industry': 'string', 'Dividend Pays': 'string', 'Incomplete Data': 'bool',
+                'Data Range': 'string', 'First Trading Date': 'string', 'Historical Range': 'string'}
+
+# Base delay (seconds) between YFinance requests, a random 0-1s is added on top
+delay = 1
+
+# yf.download sends one history request per ticker on its own threads, at most this many at once
+download_threads = 4
 
 def fetch_index_constituents(index_name):
     """pulls the information from the Index info dictionary
     scrapes the stock lists off Wikipedia and returns a dataframe of all of the wikitables contents
+    The page is read through the shared ConstituentService cache, so it is only downloaded / parsed again when it changed.
     
-    FTSE100 Stocks needed to have .L appended to be correctly collected aggreagted by YFinance (DAX doesnt have this problem Wiki already includes .DE)
-    Added a check to replace . to - for YFinance (Some wikitables have headers as Ticker or Symbol)
+    Tickers are normalized for YFinance by universe.normalize_constituents: . replaced by - (Some wikitables have headers
+    as Ticker or Symbol), then FTSE100 Stocks get .L appended (DAX doesnt have this problem Wiki already includes .DE)
     """
-    global index_info
+    from constituents import get_constituents
+    from universe import normalize_constituents
+
     index_data = index_info.get(index_name)
     if not index_data:
         print(f"Index '{index_name}' is not supported.")
@@ -30,149 +48,505 @@ def fetch_index_constituents(index_name):
     table_index = index_data["table_index"]
 
     try:
-        tables = pd.read_html(url)
-        constituents = tables[table_index]
-
-        # Check if the index name is FTSE 100, and append '.L' to the ticker symbols
-        if index_name == "FTSE 100":
-            constituents['Ticker'] = constituents['Ticker'].apply(lambda x: str(x) + '.L')
-
-        # Check for 'Ticker' or 'Symbol' column and replace '.' with '-'
-        if 'Ticker' in constituents.columns:
-            constituents['Ticker'] = constituents['Ticker'].apply(lambda x: str(x).replace('.', '-'))
-        elif 'Symbol' in constituents.columns:
-            constituents['Symbol'] = constituents['Symbol'].apply(lambda x: str(x).replace('.', '-'))
-
-        return constituents
+        return normalize_constituents(get_constituents(index_name, url, table_index), index_name)
 
     except Exception as e:
         print(f"Error fetching data for {index_name}: {e}")
         return None
 
+def yf_history(symbol, start=None, end=None):
+    """Download the history of one symbol, start=None meaning the whole history (period="max"). Returns a tz naive dataframe.
+    This is the fetch function handed to PriceCache.get_history. Goes through the current data source (data_sources.set_source).
+    """
+    with stage('history_probe' if start is None else 'range_fetch'):
+        return get_source().history(symbol, start, end)
+
+def direct_request(func, *args, weight=1, **kwargs):
+    """Default request function: just make the call (FetchScheduler.request adds rate limiting and retries).
+    weight is the number of requests func sends, e.g. one per ticker of a yf.download.
+    """
+    count('requests', weight)
+    return func(*args, **kwargs)
+
+def _timed_download(symbols, **download_args):
+    with stage('history_probe' if 'period' in download_args else 'range_fetch'):
+        return get_source().download(symbols, **download_args)
+
+def _chunk_histories(data, chunk, columns=None):
+    """Split a multi ticker download into symbol -> history, leaving out the symbols without a single row."""
+    histories = {}
+    if data is None or data.empty:
+        return histories
+    if data.index.tz is not None:
+        data.index = data.index.tz_localize(None)
+
+    for symbol in chunk:
+        if isinstance(data.columns, pd.MultiIndex):
+            if symbol not in data.columns.get_level_values(0):
+                continue
+            hist = data[symbol]
+        else:
+            hist = data
+        # The batched frame is aligned on the union of every symbol's dates, drop the days this one didn't trade
+        hist = hist.dropna(subset=['Close'])
+        if not hist.empty:
+            histories[symbol] = hist if columns is None else hist[columns].copy()
+    return histories
+
+def _download_chunks(symbols, chunk_size, request=None, columns=None, retries=1, on_chunk=None, **download_args):
+    """Run chunked multi ticker yf.download calls. Returns (symbol -> history dict, list of symbols whose chunk failed,
+    list of symbols that came back without rows).
+    columns keeps only those columns of every history (the chunk's full frame is dropped as soon as it's split).
+    yf.download doesn't raise for a ticker that failed (429, timeout), it's just missing or all NaN in the payload, so those
+    tickers are downloaded again up to retries times. Symbols still without rows after that are left out of the histories.
+    Every download takes one request per ticker from the budget (the weight of the request call).
+    on_chunk(histories) gets the histories of each download as soon as it's split, they aren't kept in the returned
+    dictionary then.
+    """
+    call = request or direct_request
+    histories = {}
+    failed = []
+    empty = []
+    for chunk_start in range(0, len(symbols), chunk_size):
+        chunk = symbols[chunk_start:chunk_start + chunk_size]
+        print(f"Downloading history for symbols {chunk_start + 1}-{chunk_start + len(chunk)} of {len(symbols)}...")
+        pending = chunk
+        for attempt in range(retries + 1):
+            if attempt:
+                print(f"Downloading {len(pending)} symbols missing from the payload again...")
+                count('download_retries', len(pending))
+            try:
+                data = call(_timed_download, pending, weight=len(pending), group_by='ticker', auto_adjust=True,
+                            actions=True, threads=min(len(pending), download_threads), progress=False, **download_args)
+            except Exception as e:
+                print(f"Error downloading chunk starting at {pending[0]}: {e}")
+                failed.extend(pending)
+                break
+            fetched = _chunk_histories(data, pending, columns)
+            del data
+            pending = [symbol for symbol in pending if symbol not in fetched]
+            if on_chunk is None:
+                histories.update(fetched)
+            else:
+                on_chunk(fetched)
+            del fetched
+            if not pending:
+                break
+        else:
+            empty.extend(pending)
+        if request is None:
+            with stage('sleep_backoff'):
+                time.sleep(random.uniform(delay, delay + 1))
+
+    return histories, failed, empty
+
+def download_history_batch(symbols, chunk_size=50, cache=None, end_date=None, request=None, columns=None, on_chunk=None):
+    """Download the full (period="max") daily history for a list of symbols using chunked multi ticker requests.
+    Returns a dictionary of symbol -> history dataframe (tz naive index, only the rows where the symbol actually traded).
+    Symbols that come back empty are left out, so callers can fall back to the single symbol path for them.
+
+    With a PriceCache only the missing head/tail segments are downloaded (symbols needing the same segment share requests)
+    and the histories are read back from the cache.
+    request is the function every download goes through (FetchScheduler.request to share its rate limit).
+    columns keeps only those columns of the histories, e.g. ['Close', 'Volume'] for a PriceStore.
+    on_chunk(histories) receives them chunk_size symbols at a time instead (the returned dictionary is empty), so they can
+    be copied into a PriceStoreBuilder and freed chunk by chunk rather than all held at once.
+    """
+    symbols = list(symbols)
+    if cache is None:
+        histories, _, _ = _download_chunks(symbols, chunk_size, request=request, columns=columns, on_chunk=on_chunk, period="max")
+        return histories
+
+    segments = {}
+    for symbol in symbols:
+        missing = cache.missing_segments(symbol, None, end_date)
+        default_telemetry.cache_result('prices', hit=not missing)
+        for segment in missing:
+            segments.setdefault(segment, []).append(symbol)
+
+    call = request or direct_request
+    for (seg_start, seg_end), group in segments.items():
+        download_args = {'period': "max"} if seg_start is None else {'start': seg_start, 'end': seg_end}
+        def store(fetched, seg_start=seg_start, seg_end=seg_end):
+            for symbol, hist in fetched.items():
+                cache.store(symbol, hist, seg_start, seg_end)
+
+        _, _, empty = _download_chunks(group, chunk_size, request=request, on_chunk=store, **download_args)
+        # A failed ticker looks the same as a segment with no bars (delisted / renamed ticker), see _download_chunks. A
+        # single symbol request does raise on a failure, so it tells them apart: an empty answer is stored and extends
+        # the coverage, a failure is retried next run
+        for symbol in empty:
+            try:
+                hist = call(yf_history, symbol, seg_start, seg_end)
+            except Exception as e:
+                print(f"Error downloading {symbol} {seg_start or 'max'} / {seg_end}: {e}")
+                continue
+            cache.store(symbol, hist, seg_start, seg_end)
+
+    histories = {}
+    for chunk_start in range(0, len(symbols), chunk_size):
+        chunk = {}
+        chunk_symbols = symbols[chunk_start:chunk_start + chunk_size]
+        for symbol in chunk_symbols:
+            hist = cache.load(symbol, None, end_date, touch=False)
+            if not hist.empty:
+                chunk[symbol] = hist if columns is None else hist[columns]
+        cache.touch(chunk_symbols)
+        if on_chunk is None:
+            histories.update(chunk)
+        else:
+            on_chunk(chunk)
+    return histories
+
+def _timed_info(symbol):
+    with stage('info_fetch'):
+        return get_source().info(symbol)
+
+def fetch_info(symbol, cache=None, request=None):
+    """stock.info of a symbol (one request), served from the PriceCache info table when it's recent enough."""
+    call = request or direct_request
+
+    fetch = lambda symbol: call(_timed_info, symbol)
+    if cache is None:
+        return fetch(symbol)
+    return cache.get_info(symbol, fetch)
+
+def load_market_returns(start_date, end_date, cache=None, market_index='^GSPC'):
+    """Daily returns of the market index used for the correlation column, read through the PriceCache when one is passed.
+    Returns the market_benchmarks.Benchmark itself: it comes from the process wide registry (downloaded once per process)
+    and its returns are already arrays on the benchmark calendar, so every symbol is lined up with an index lookup.
+    Use .returns for the series.
+    """
+    return get_benchmark(market_index, start_date, end_date, cache=cache, fetch=yf_history)
+
 def fetch_stock_data(symbol, 
                     market_returns, 
                     start_date, 
-                    end_date):
+                    end_date,
+                    max_hist=None,
+                    cache=None,
+                    request=None):
     """Fetch stock data for a given symbol. Used by upload symbol script and Single symbol functions. Takes a symbol (Make sure it works on YFinance), a dataframe of SP500 returns, and 2 time frame variables.
     Extracts various information from YFinance API with Delays added to avoid rate limiting, and returns a dictionary of this information.
+    Makes at most two requests: the full history (the range is sliced out of it locally) and stock.info.
+    If max_hist is passed (the full history from download_history_batch) the history request is skipped.
+    With a PriceCache the full history is read from the cache, only the missing bars are downloaded, and stock.info is reused
+    while it's younger than the cache's info_ttl_days.
+    request is the function every YFinance call goes through, pass FetchScheduler.request to use its shared rate limit and
+    retries instead of the fixed delay.
     """
     try:
-        print(f"Fetching data for {symbol}...")
-        stock = yf.Ticker(symbol)
-        
-        # Get the historical data with a broad date range to determine the first available date
-        hist = stock.history(period="max")
-        
-        if hist.empty:
-            print(f"No data for {symbol}. Skipping.")
-            return None
-        
-        # Get the first available trading date (this is the earliest date in the historical data)
-        first_trading_date = hist.index.min().strftime('%Y-%m-%d')
-        
-        # If the stock started trading after the specified start date, adjust the start date
-        if pd.to_datetime(first_trading_date) > pd.to_datetime(start_date):
-            print(f"Stock {symbol} started trading on {first_trading_date}. Adjusting start date.")
-            start_date = first_trading_date
-        
-        # Fetch historical data within the adjusted date range
-        hist = stock.history(start=start_date, end=end_date)
-
-        print(f"For {start_date} / {end_date}")
-        
-        if hist.empty:
-            print(f"No data for {symbol} in the given date range. Skipping.")
+        payload = fetch_symbol_payload(symbol, start_date, end_date, max_hist=max_hist, cache=cache, request=request)
+        if payload is None:
             return None
+        data = compute_payload_metrics(symbol, *payload, market_returns, end_date)
 
-        hist.index = hist.index.tz_localize(None)
-
-        total_volume = hist['Volume'].sum()
-        average_yearly_volume = hist['Volume'].mean() * 252
-        sector = stock.info.get('sector', 'N/A')
-        industry = stock.info.get('industry', 'N/A')
-        sector_industry = f"{sector} / {industry}"
-        dividend_status = 'Yes' if stock.info.get('dividendYield', 0) > 0 else 'No'
-        pe_ratio = stock.info.get('trailingPE', np.nan)
-        beta = stock.info.get('beta', np.nan)
-        pe_yearly = hist['Close'].pct_change().mean() * 252  # Use this to approximate yearly returns
-        sma_50 = hist['Close'].rolling(window=50).mean().iloc[-1]
-        sma_200 = hist['Close'].rolling(window=200).mean().iloc[-1]
-        rolling_max = hist['Close'].cummax()
-        drawdown = (hist['Close'] - rolling_max) / rolling_max
-        max_drawdown = drawdown.min()
-        risk_free_rate = 0.02
-
-        # Check if the provided start date is older than the first trade date, then the data is incomplete within the range.
-        is_data_incomplete = pd.to_datetime(start_date) > pd.to_datetime(first_trading_date)
-
-        # Calculate the historical range
-        first_trading_date_dt = pd.to_datetime(first_trading_date)
-        end_date_dt = pd.to_datetime(end_date)
-        start_date_dt = pd.to_datetime(start_date)
-        
-        # Calculate the number of years and months in the historical range 
-        years_diff = (end_date_dt - first_trading_date_dt).days // 365
-        months_diff = (end_date_dt - first_trading_date_dt).days % 365 // 30
-
-        data_years_diff = (end_date_dt - start_date_dt).days // 365
-        data_months_diff = (end_date_dt - start_date_dt).days % 365 // 30
-        
-        historical_range = f"{years_diff} years, {months_diff} months" if years_diff > 0 else f"{months_diff} months"
-        data_range = f"{data_years_diff} years, {data_months_diff} months" if years_diff > 0 else f"{data_months_diff} months"
-        
-        stock_returns = hist['Close'].pct_change().dropna()
-        combined = pd.DataFrame({
-            'Stock': stock_returns.squeeze(),
-            'Market': market_returns.squeeze()
-        }).dropna()
-
-        excess_returns = stock_returns - risk_free_rate / 252  # Convert yearly risk-free rate to daily
-        sharpe_ratio = excess_returns.mean() / excess_returns.std() * np.sqrt(252)  # Annualized Sharpe Ratio
-
-        correlation = combined['Stock'].corr(combined['Market'])
-
-        time.sleep(random.uniform(delay, delay + 1))  # Random delay between 1-2 seconds
+        if request is None:
+            with stage('sleep_backoff'):
+                time.sleep(random.uniform(delay, delay + 1))  # Random delay between 1-2 seconds
 
         print(f"Data fetched for {symbol}.")
-        return {
-            'Symbol': symbol,
-            'Total Volume': total_volume,
-            'Average Yearly Volume': average_yearly_volume,
-            'Sector/Industry': sector_industry,
-            'Correlation with Market': correlation,
-            'Beta': beta,
-            'Dividend Pays': dividend_status,
-            'P/E Ratio': pe_ratio,
-            'SMA 50': sma_50,
-            'SMA 200': sma_200,
-            'Max Drawdown': max_drawdown,
-            'Sharpe Ratio': sharpe_ratio,
-            'Incomplete Data': is_data_incomplete,
-            'Data Range': data_range,
-            'First Trading Date': first_trading_date,
-            'Historical Range': historical_range
-        }
+        return data
     except Exception as e:
         print(f"Error fetching data for {symbol}: {e}")
         return None
+
+def fetch_symbol_payload(symbol,
+                        start_date,
+                        end_date,
+                        max_hist=None,
+                        cache=None,
+                        request=None):
+    """The network half of fetch_stock_data: history + info of a symbol, no metrics computed.
+    Returns (history within the adjusted range, info, adjusted start date, first trading date) or None if there is nothing to score.
+    """
+    call = request or direct_request
+    print(f"Fetching data for {symbol}...")
+    # One history request for the whole history, the date range is sliced out of it locally
+    if max_hist is None and cache is not None:
+        max_hist = cache.get_history(symbol, None, end_date, fetch=lambda *args: call(yf_history, *args))
+    elif max_hist is None:
+        max_hist = call(yf_history, symbol)
+    
+    if max_hist.empty:
+        print(f"No data for {symbol}. Skipping.")
+        return None
+    
+    # Get the first available trading date (this is the earliest date in the historical data)
+    first_trading_date = max_hist.index.min().strftime('%Y-%m-%d')
     
+    # If the stock started trading after the specified start date, adjust the start date
+    if pd.to_datetime(first_trading_date) > pd.to_datetime(start_date):
+        print(f"Stock {symbol} started trading on {first_trading_date}. Adjusting start date.")
+        start_date = first_trading_date
+    
+    # Only the columns compute_stock_metrics reads, keeps what gets handed to the analytics processes small
+    hist = slice_history(max_hist, start_date, end_date)[['Close', 'Volume']]
+
+    print(f"For {start_date} / {end_date}")
+    
+    if hist.empty:
+        print(f"No data for {symbol} in the given date range. Skipping.")
+        return None
+
+    # One info request at most (none when the cache has a recent copy)
+    info = fetch_info(symbol, cache=cache, request=request)
+    return hist, info, start_date, first_trading_date
+
+def compute_payload_metrics(symbol, hist, info, start_date, first_trading_date, market_returns, end_date):
+    """The CPU half of fetch_stock_data, takes a fetch_symbol_payload payload. Module level so the process pool can pickle it."""
+    with stage('metrics_compute'):
+        return compute_stock_metrics(symbol, hist, info, market_returns, start_date, end_date, first_trading_date)
+
+def slice_history(hist, start_date, end_date):
+    """Slice a history dataframe down to [start_date, end_date), the same range stock.history(start, end) returns."""
+    index = hist.index.tz_localize(None) if hist.index.tz is not None else hist.index
+    mask = (index >= pd.to_datetime(start_date)) & (index < pd.to_datetime(end_date))
+    return hist[mask]
+
+def compute_stock_metrics(symbol,
+                        hist,
+                        info,
+                        market_returns,
+                        start_date,
+                        end_date,
+                        first_trading_date):
+    """Compute the metrics dictionary for one symbol from its history within the (already adjusted) date range and its stock.info dictionary.
+    No network calls are made here so it can be fed from either the single symbol path or the batched download.
+    """
+    if hist.index.tz is not None:
+        hist.index = hist.index.tz_localize(None)
+
+    total_volume = hist['Volume'].sum()
+    average_yearly_volume = hist['Volume'].mean() * 252
+    sector_industry, dividend_status, pe_ratio, beta = info_fields(info).values()
+    pe_yearly = hist['Close'].pct_change().mean() * 252  # Use this to approximate yearly returns
+    sma_50 = hist['Close'].rolling(window=50).mean().iloc[-1]
+    sma_200 = hist['Close'].rolling(window=200).mean().iloc[-1]
+    rolling_max = hist['Close'].cummax()
+    drawdown = (hist['Close'] - rolling_max) / rolling_max
+    max_drawdown = drawdown.min()
+    risk_free_rate = 0.02
+
+    # Check if the provided start date is older than the first trade date, then the data is incomplete within the range.
+    is_data_incomplete = pd.to_datetime(start_date) > pd.to_datetime(first_trading_date)
+
+    # Calculate the historical range
+    first_trading_date_dt = pd.to_datetime(first_trading_date)
+    end_date_dt = pd.to_datetime(end_date)
+    start_date_dt = pd.to_datetime(start_date)
+
+    # Calculate the number of years and months in the historical range 
+    years_diff = (end_date_dt - first_trading_date_dt).days // 365
+    months_diff = (end_date_dt - first_trading_date_dt).days % 365 // 30
+
+    data_years_diff = (end_date_dt - start_date_dt).days // 365
+    data_months_diff = (end_date_dt - start_date_dt).days % 365 // 30
+
+    historical_range = f"{years_diff} years, {months_diff} months" if years_diff > 0 else f"{months_diff} months"
+    data_range = f"{data_years_diff} years, {data_months_diff} months" if years_diff > 0 else f"{data_months_diff} months"
+
+    stock_returns = hist['Close'].pct_change().dropna()
+
+    excess_returns = stock_returns - risk_free_rate / 252  # Convert yearly risk-free rate to daily
+    sharpe_ratio = excess_returns.mean() / excess_returns.std() * np.sqrt(252)  # Annualized Sharpe Ratio
+
+    # Index lookup into the market returns + a dot product instead of building an aligned dataframe per symbol
+    correlation = market_correlation(stock_returns, market_returns)
+
+    return {
+        'Symbol': symbol,
+        'Total Volume': total_volume,
+        'Average Yearly Volume': average_yearly_volume,
+        'Sector/Industry': sector_industry,
+        'Correlation with Market': correlation,
+        'Beta': beta,
+        'Dividend Pays': dividend_status,
+        'P/E Ratio': pe_ratio,
+        'SMA 50': sma_50,
+        'SMA 200': sma_200,
+        'Max Drawdown': max_drawdown,
+        'Sharpe Ratio': sharpe_ratio,
+        'Incomplete Data': is_data_incomplete,
+        'Data Range': data_range,
+        'First Trading Date': first_trading_date,
+        'Historical Range': historical_range
+    }
+
+def info_fields(info):
+    """The result columns that come from stock.info rather than the price history."""
+    sector = info.get('sector', 'N/A')
+    industry = info.get('industry', 'N/A')
+    return {
+        'Sector/Industry': f"{sector} / {industry}",
+        'Dividend Pays': 'Yes' if info.get('dividendYield', 0) > 0 else 'No',
+        'P/E Ratio': info.get('trailingPE', np.nan),
+        'Beta': info.get('beta', np.nan)
+    }
+
+def score_store(store, market_returns, start_date, end_date):
+    """Score every symbol of a PriceStore with the vectorized metrics engine, a block of symbols at a time.
+    Returns a dataframe indexed by symbol with the price derived columns, symbols without data in the range are left out.
+    """
+    from metrics import compute_metrics_store
+
+    with stage('metrics_compute'):
+        return compute_metrics_store(store, market_returns, start_date, end_date)
+
+def batch_result(symbol, metrics_row, info):
+    """Combine a row of score_store with the stock.info columns into a fetch_stock_data style dictionary."""
+    row = dict(metrics_row)
+    row.update(info_fields(info))
+    return {'Symbol': symbol, **{column: row[column] for column in RESULT_COLUMNS[1:]}}
+
+def enrich_symbols(symbols,
+                start_date,
+                end_date,
+                market_returns=None,
+                chunk_size=50,
+                cache=None,
+                workers=8,
+                rate=2.0,
+                on_result=None,
+                on_error=None,
+                on_prices=None,
+                cpu_workers=None,
+                queue_size=32,
+                indicators=None,
+                market_index='^GSPC',
+                scheduler=None,
+                price_store_path=None,
+                store_dtypes=None):
+    """Fetch the fetch_stock_data metrics for a list of symbols. Used by upload symbol script, returns a list of result dictionaries.
+    Price history is pulled with download_history_batch (chunk_size symbols per request) instead of two history calls per symbol,
+    symbols missing from the batched payload fall back to the single symbol requests.
+    The batched closes / volumes of the date range go into one PriceStore (the business days of the range as calendar,
+    one array per field, memory mapped under price_store_path when it's given) and are scored a block of symbols at a
+    time (metrics.compute_metrics_store). store_dtypes overrides the field dtypes of the store (price_store.DEFAULT_DTYPES),
+    e.g. {'Close': 'float32', 'Volume': 'float32'} halves its memory.
+    Network work runs on a FetchScheduler with workers threads sharing a budget of rate requests per second.
+    on_result(symbol, data) / on_error(symbol, error) are called as soon as each symbol is done,
+    on_prices(store) gets the PriceStore of the batched symbols once it's downloaded.
+    With cpu_workers the single symbol fallback runs as a pipeline.run_pipeline: downloads on the scheduler threads feed a
+    bounded queue (queue_size) and the metrics are computed on a cpu_workers process pool. The batched symbols don't need
+    the pool: the whole store is scored with a few numpy passes per block (about 2s for 2000 symbols x 24 years on one
+    core) while their downloads take len(symbols) / rate seconds, so the rate budget is the bottleneck, not the CPU.
+    indicators is an indicators.IndicatorSet config (e.g. {'sma': (20, 50), 'beta': (60,)}), its values over the date range
+    are added to every result (see indicator_columns). With a PriceCache the indicator state is kept between runs so only
+    the new bars are processed.
+    market_index is the benchmark of the correlation column when market_returns isn't passed (see market_benchmarks.benchmark_for).
+    Pass a FetchScheduler as scheduler to read its request / latency statistics afterwards (workers and rate are then ignored).
+    """
+    from indicators import incremental_indicators
+    from pipeline import run_pipeline
+    from price_store import PriceStoreBuilder
+    from scheduler import FetchScheduler
+
+    symbols = list(symbols)
+    if market_returns is None:
+        market_returns = load_market_returns(start_date, end_date, cache=cache, market_index=market_index)
+
+    if scheduler is None:
+        scheduler = FetchScheduler(workers=workers, rate=rate)
+    # Every chunk is copied into the store as it's split, so only one chunk of per-symbol frames exists at a time. The
+    # calendar is fixed up front so the arrays are allocated once, whatever order the listings come in
+    calendar = pd.bdate_range(start_date, end_date, inclusive='left')
+    builder = PriceStoreBuilder(len(symbols), dtypes=store_dtypes, path=price_store_path, calendar=calendar)
+    download_history_batch(symbols, chunk_size=chunk_size, cache=cache, end_date=end_date, request=scheduler.request,
+                           columns=['Close', 'Volume'], on_chunk=builder.add)
+    store = builder.build()
+    del builder
+    if on_prices is not None:
+        on_prices(store)
+    metrics_df = score_store(store, market_returns, start_date, end_date)
+
+    for symbol in store.symbols:
+        if symbol not in metrics_df.index:
+            print(f"No data for {symbol} in the given date range. Skipping.")
+            if on_error is not None:
+                on_error(symbol, "No data in the given date range")
+    remaining = [symbol for symbol in symbols if symbol not in store]
+
+    # Indicator values are worked out in the I/O stage (cheap when the state is incremental) and added to the result
+    # dictionaries before they are reported
+    indicator_values = {}
+
+    def add_indicators(symbol, hist):
+        if indicators is not None:
+            indicator_values[symbol] = incremental_indicators(symbol, hist, market_returns, config=indicators,
+                                                            cache=cache, state_key=start_date)
+
+    def report(symbol, data):
+        data.update({column: value for column, value in indicator_values.pop(symbol, {}).items() if column not in data})
+        if on_result is not None:
+            on_result(symbol, data)
+
+    def enrich(symbol):
+        info = fetch_info(symbol, cache=cache, request=scheduler.request)
+        add_indicators(symbol, store.history(symbol, start_date, end_date))
+        print(f"Data fetched for {symbol}.")
+        return batch_result(symbol, metrics_df.loc[symbol], info)
+
+    def fetch_payload(symbol):
+        payload = fetch_symbol_payload(symbol, start_date, end_date, cache=cache, request=scheduler.request)
+        if payload is not None:
+            add_indicators(symbol, payload[0])
+        return payload
+
+    def fetch(symbol):
+        payload = fetch_payload(symbol)
+        if payload is None:
+            raise RuntimeError("No data returned")
+        print(f"Data fetched for {symbol}.")
+        return compute_payload_metrics(symbol, *payload, market_returns, end_date)
+
+    results = scheduler.run(list(metrics_df.index), enrich, on_result=report, on_error=on_error)
+    if cpu_workers and remaining:
+        results.update(run_pipeline(remaining,
+                                    fetch_payload,
+                                    compute_payload_metrics,
+                                    shared_args=(market_returns, end_date),
+                                    io_workers=scheduler.workers,
+                                    cpu_workers=cpu_workers,
+                                    queue_size=queue_size,
+                                    on_result=report,
+                                    on_error=on_error))
+    else:
+        results.update(scheduler.run(remaining, fetch, on_result=report, on_error=on_error))
+    scheduler.print_summary()
+    return [results[symbol] for symbol in symbols if symbol in results]
+
+def indicator_columns(indicators):
+    """Extra result columns enrich_symbols adds for an indicator config (the ones not already in RESULT_COLUMNS)."""
+    if indicators is None:
+        return []
+    from indicators import IndicatorSet
+    return [column for column in IndicatorSet(indicators).columns() if column not in RESULT_COLUMNS]
+
+def result_dtypes(columns):
+    """column -> output type (writers.column_kinds) of a list of result columns."""
+    return {column: RESULT_DTYPES.get(column, 'float') for column in columns}
 
 def scrape_indices(index_choice=None):
-    global index_info
     if index_choice is None:
         print("\nAvailable indices:")
         for i, name in enumerate(index_info.keys(), 1):
             print(f"{i}. {name}")
-        choice = input("\nEnter the number of the index you'd like to fetch (or 'q' to quit): ").strip()
+        choice = input("\nEnter the number of the index you'd like to fetch, several separated by commas for a combined universe (or 'q' to quit): ").strip()
     else:
         choice = str(index_choice)
 
     if choice.lower() == 'q':
         return
-    if not choice.isdigit() or int(choice) < 1 or int(choice) > len(index_info):
+    choices = [part.strip() for part in choice.split(',')]
+    if not all(part.isdigit() and 1 <= int(part) <= len(index_info) for part in choices):
         print("Invalid choice. Try again.")
         return
 
+    if len(choices) > 1:
+        scrape_universe([list(index_info.keys())[int(part) - 1] for part in choices])
+        return
+
     index_name = list(index_info.keys())[int(choice) - 1]
     constituents = fetch_index_constituents(index_name)
     if constituents is not None:
@@ -183,11 +557,54 @@ def scrape_indices(index_choice=None):
             constituents.to_csv(filename, index=False)
             print(f"Data saved to {filename}")
 
+def scrape_universe(index_names):
+    """Fetch several indices at once and save their merged membership (one row per unique symbol, a column per index)."""
+    from universe import fetch_universe
+
+    universe = fetch_universe(index_names, index_info=index_info)
+    overlap = ", ".join(f"{count} in {indices}" for indices, count in universe.overlap().items())
+    print(f"{len(universe.members)} memberships, {len(universe)} unique symbols ({overlap} indices).")
+    print(universe.membership.head())
+    save_choice = input("Save the universe to CSV? (y/n): ").strip().lower()
+    if save_choice == 'y':
+        filename = "_".join(index_name.replace(' ', '_') for index_name in universe.tables) + "_universe.csv"
+        universe.membership.rename_axis('Symbol').reset_index().to_csv(filename, index=False)
+        print(f"Data saved to {filename}")
+    return universe
+
 def upload_symbol_script(file_path=None,
                         sheetname="SP500", 
                         start_date="2001-01-01", 
                         end_date="2024-12-31", 
-                        output_file_path=None):
+                        output_file_path=None,
+                        chunk_size=50,
+                        cache=None,
+                        workers=8,
+                        rate=2.0,
+                        journal_path=None,
+                        retry_failed=True,
+                        output_format=None,
+                        price_matrix_path=None,
+                        cpu_workers=None,
+                        indicators=None,
+                        market_index='^GSPC',
+                        price_store_path=None,
+                        store_dtypes=None):
+    """Enrich every symbol of an Excel sheet with the fetch_stock_data metrics (see enrich_symbols) and save the merged sheet.
+    Pass a PriceCache to only download the bars added since the last run.
+    With a journal_path every finished symbol is appended to a RunJournal right away, re-running with the same journal
+    skips the symbols already done (and the failed ones too when retry_failed is False) and the workbook is built from the journal.
+    The journal records the file, sheet, dates, indicators and benchmark of its run, a journal of another run raises a ValueError.
+    The merged sheet is written in chunks while the run goes (writers.MergedSheetWriter), output_format is xlsx, csv,
+    parquet or arrow (defaults to the output file extension). price_matrix_path also saves the batched close price matrix
+    of the date range.
+    A run summary of the telemetry stage timings, request counts and cache hit rates is printed at the end.
+    cpu_workers moves the metrics of the single symbol fallback onto a process pool and indicators adds a set of rolling
+    indicator columns (see enrich_symbols). market_index is the benchmark the correlation column is computed against.
+    price_store_path / store_dtypes memory map the price store in that directory and set its field dtypes (see enrich_symbols).
+    """
+    from journal import RunJournal
+    from writers import MergedSheetWriter, write_price_matrix
 
     if file_path is None:
         file_path = input("Enter the Excel file path: ").strip()
@@ -199,34 +616,74 @@ def upload_symbol_script(file_path=None,
         end_date = input("Enter end date (YYYY-MM-DD): ").strip()
 
     new_sorting_df = pd.read_excel(file_path, sheet_name=sheetname)
-    symbols = new_sorting_df['Symbol'].dropna().unique()
+    symbols = list(new_sorting_df['Symbol'].dropna().unique())
 
-    market_index = '^GSPC'
-    market_data = yf.download(market_index, start=start_date, end=end_date)
-    market_data.index = market_data.index.tz_localize(None)
-    market_returns = market_data['Close'].pct_change().dropna()
-
-    results = []
-    for index, symbol in enumerate(symbols):
-        data = fetch_stock_data(symbol, market_returns, start_date, end_date)
-        if data:
-            results.append(data)
-        time.sleep(1)
-
-    results_df = pd.DataFrame(results)
-    updated_new_sorting_df = new_sorting_df.merge(results_df, on='Symbol', how='left')
+    if cache is not None:
+        cache.evict()
+    run_started = default_telemetry.snapshot()
 
     if output_file_path is None:
         output_file_path = input("Enter output Excel file path: ").strip()
-    with pd.ExcelWriter(output_file_path, engine='openpyxl') as writer:
-        updated_new_sorting_df.to_excel(writer, sheet_name=sheetname, index=False)
+
+    # Opened before the output so a journal of another run is refused before anything is overwritten
+    run = {'file': os.path.basename(file_path), 'sheet': sheetname, 'start_date': start_date, 'end_date': end_date,
+           'indicators': indicators, 'market_index': market_index}
+    journal = RunJournal(journal_path, run=run) if journal_path else None
+    result_columns = RESULT_COLUMNS + indicator_columns(indicators)
+    output = MergedSheetWriter(new_sorting_df, result_columns, output_file_path, file_format=output_format, sheet_name=sheetname,
+                            result_dtypes=result_dtypes(result_columns))
+
+    if journal is not None:
+        pending = journal.pending(symbols, retry_failed=retry_failed)
+        print(f"Journal {journal_path}: {len(symbols) - len(pending)} symbols already done, {len(pending)} to fetch.")
+        symbols = pending
+        for data in journal.results():
+            output.add_result(data['Symbol'], data)
+        # Failures that aren't retried don't hold back the rows below them
+        for symbol in set(journal.failed()) - set(pending):
+            output.add_failure(symbol)
+
+    def on_result(symbol, data):
+        if journal is not None:
+            journal.record_result(symbol, data)
+        output.add_result(symbol, data)
+
+    def on_error(symbol, error):
+        if journal is not None:
+            journal.record_failure(symbol, error)
+        output.add_failure(symbol)
+
+    def on_prices(store):
+        if price_matrix_path and len(store):
+            # The business day calendar has rows for the holidays nobody traded on
+            write_price_matrix(store.frame('Close').dropna(how='all'), price_matrix_path)
+            print(f"Price matrix saved to {price_matrix_path}")
+
+    try:
+        enrich_symbols(symbols, start_date, end_date, chunk_size=chunk_size, cache=cache, workers=workers, rate=rate,
+                    on_result=on_result, on_error=on_error, on_prices=on_prices,
+                    cpu_workers=cpu_workers, indicators=indicators, market_index=market_index,
+                    price_store_path=price_store_path, store_dtypes=store_dtypes)
+    finally:
+        output.close()
+
+    if journal is not None:
+        failed = journal.failed()
+        if failed:
+            print(f"{len(failed)} symbols failed: {', '.join(failed)} (re-run with the same journal to retry them)")
 
     print(f"Updated file saved to {output_file_path}")
+    default_telemetry.print_summary(since=run_started)
 
 def single_symbol(stock_symbol=None, 
                 start_date=None, 
-                end_date=None):
-                
+                end_date=None,
+                cache=None,
+                market_index=None):
+    """Fetch and print (or return as text when called with a symbol) the metrics of one symbol.
+    market_index defaults to the benchmark of the symbol's exchange (market_benchmarks.benchmark_for), the benchmark
+    returns are shared by every lookup of the process.
+    """
     og_symbol = stock_symbol
 
     if stock_symbol is None:
@@ -236,12 +693,9 @@ def single_symbol(stock_symbol=None,
     if end_date is None:
         end_date = input("Enter end date (YYYY-MM-DD): ").strip()
 
-    market_index = '^GSPC'
-    market_data = yf.download(market_index, start=start_date, end=end_date)
-    market_data.index = market_data.index.tz_localize(None)
-    market_returns = market_data['Close'].pct_change().dropna()
+    market_returns = load_market_returns(start_date, end_date, cache=cache, market_index=market_index or benchmark_for(stock_symbol))
 
-    stock_data = fetch_stock_data(stock_symbol, market_returns, start_date, end_date)
+    stock_data = fetch_stock_data(stock_symbol, market_returns, start_date, end_date, cache=cache)
     if stock_data and og_symbol is None :
         print("\nStock Data:")
         for key, value in stock_data.items():
@@ -1,9 +1,16 @@
-from flask import Flask, request, render_template_string, jsonify, render_template
-import pandas as pd
+from flask import Flask, request, render_template_string, jsonify, render_template, Response, stream_with_context
+from markupsafe import escape
+import json
 import traceback
-import certifi
-import urllib.request
-import ssl
+from constituents import default_service, get_constituents
+from jobs import JobManager
+from telemetry import default_telemetry
+from universe import load_index_info, normalize_constituents
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow output is optional
+    pa = None
 
 
 app = Flask(__name__)
@@ -12,13 +19,18 @@ def home():
     return render_template('index.html')
 
 # Dictionary of indices, their Wikipedia URLs, and table indices (0-based) to fetch the list of stocks
-index_info = {
-    "S&P 500": {"url": "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies", "table_index": 0},
-    "Dow Jones": {"url": "https://en.wikipedia.org/wiki/Dow_Jones_Industrial_Average", "table_index": 2},
-    "NASDAQ 100": {"url": "https://en.wikipedia.org/wiki/NASDAQ-100", "table_index": 4},
-    "FTSE 100": {"url": "https://en.wikipedia.org/wiki/FTSE_100_Index", "table_index": 4},
-    "DAX": {"url": "https://en.wikipedia.org/wiki/DAX", "table_index": 4}
-}
+index_info = load_index_info()
+
+# Keep the constituent tables warm from a background thread, set to False to turn it off (tests)
+app.config.setdefault('CONSTITUENT_REFRESH', True)
+
+@app.before_request
+def start_constituent_refresh():
+    """Start the constituents background refresh with the first request of the process, so it runs under a WSGI server
+    (gunicorn / waitress import the app, they never reach __main__) and in every forked worker.
+    """
+    if app.config['CONSTITUENT_REFRESH']:
+        default_service.start_background_refresh(index_info)
 
 def fetch_index_constituents(index_name):
     index_data = index_info.get(index_name)
@@ -26,27 +38,9 @@ def fetch_index_constituents(index_name):
         return None, f"Index '{index_name}' is not supported."
 
     try:
-        url = index_data["url"]
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-
-        # Fetch the raw HTML with urllib and the custom SSL context
-        with urllib.request.urlopen(url, context=ssl_context) as response:
-            html = response.read()
-
-        tables = pd.read_html(html)  # Fetch all tables
-        constituents = tables[index_data["table_index"]]  # Select the table by index
-
-        print(f"Fetching data from URL: {index_data['url']}, Table Index: {index_data['table_index']}")
-
-        if "Ticker" in constituents.columns:
-            constituents["Ticker"] = constituents["Ticker"].apply(lambda x: str(x).replace(".", "-") if pd.notnull(x) else x)
-        elif "Symbol" in constituents.columns:
-            constituents["Symbol"] = constituents["Symbol"].apply(lambda x: str(x).replace(".", "-") if pd.notnull(x) else x)
-
-        if index_name == "FTSE 100":
-            constituents["Ticker"] = constituents["Ticker"].apply(lambda x: str(x) + ".L" if pd.notnull(x) else x)
-
-        return constituents, None
+        # Served from the shared constituent cache, stale tables are refreshed in the background
+        constituents = get_constituents(index_name, index_data["url"], index_data["table_index"], block=False)
+        return normalize_constituents(constituents, index_name), None
     except Exception as e:
         print(f"Error fetching data for {index_name}: {str(e)}")
         return None, f"Error fetching data for {index_name}: {str(e)}"
@@ -72,43 +66,210 @@ def select_index():
     """
     return content
 
-@app.route('/scrape', methods=['POST'])
-def scrape():
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def table_params(params):
+    """Read the index / page / page_size / columns parameters shared by the table and data endpoints.
+    Raises ValueError when page or page_size isn't an integer (the endpoints answer 400).
+    """
+    index_name = params.get('index')
+    page = max(1, int_param(params, 'page', 1))
+    page_size = min(MAX_PAGE_SIZE, max(1, int_param(params, 'page_size', DEFAULT_PAGE_SIZE)))
+    columns = [col for col in params.get('columns', '').split(',') if col]
+    return index_name, page, page_size, columns
+
+def int_param(params, name, default):
+    value = params.get(name)
+    if value in (None, ''):
+        return default
     try:
-        # Retrieve the index from form data instead of JSON
-        index_name = request.form.get('index')  # HTMX sends form-encoded data
-        
-        if not index_name:
-            return jsonify({"output": "No index selected."})
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be an integer, got '{value}'.")
 
-        constituents, error = fetch_index_constituents(index_name)
-        if error:
-            return jsonify({"output": error})
+def select_page(constituents, page, page_size, columns):
+    """Column selection + slicing of one page, returns (page dataframe, whether there are more rows)."""
+    if columns:
+        constituents = constituents[[col for col in columns if col in constituents.columns]]
+    start = (page - 1) * page_size
+    return constituents.iloc[start:start + page_size], start + page_size < len(constituents)
 
-         # Create a Material3-styled table manually using HTML
-        table_headers = "".join(f"<th>{col}</th>" for col in constituents.columns)
-        table_rows = "".join(
-            f"<tr>{''.join(f'<td>{cell}</td>' for cell in row)}</tr>" for row in constituents.values
-        )
+def render_rows(rows):
+    return "".join(f"<tr>{''.join(f'<td>{escape(cell)}</td>' for cell in row)}</tr>" for row in rows.itertuples(index=False, name=None))
 
-        output_html = f"""
+def render_next_row(index_name, page, page_size, columns, colspan):
+    """Sentinel row that lazy loads the next page (htmx "intersect once" trigger, which also works inside the scrolling div) when it's scrolled into view."""
+    vals = escape(json.dumps({"index": index_name, "page": page, "page_size": page_size, "columns": ",".join(columns)}))
+    return f"""<tr hx-post="/scrape/rows" hx-trigger="intersect once" hx-swap="outerHTML" hx-vals='{vals}'><td colspan="{colspan}">Loading more...</td></tr>"""
+
+def render_table_start(columns):
+    table_headers = "".join(f"<th>{escape(col)}</th>" for col in columns)
+    return f"""
         <div style='overflow-y: auto; max-height: 500px;'>
             <table style='width: 100%; border-collapse: collapse;'>
                 <thead style='background-color: #bb86fc; color: white;'>
                     <tr>{table_headers}</tr>
                 </thead>
                 <tbody style='background-color: #2a2a2a; color: white;'>
-                    {table_rows}
+        """
+
+TABLE_END = """
                 </tbody>
             </table>
         </div>
         """
 
+@app.route('/scrape', methods=['POST'])
+def scrape():
+    """Constituents table of an index. Only the first page is rendered, the rest is lazy loaded by /scrape/rows as the
+    user scrolls. stream=1 streams the whole table instead (rendered page_size rows at a time).
+    """
+    try:
+        # Retrieve the index from form data instead of JSON
+        index_name, page, page_size, columns = table_params(request.form)  # HTMX sends form-encoded data
+    except ValueError as e:
+        return jsonify({"output": str(e)}), 400
+
+    try:
+        if not index_name:
+            return jsonify({"output": "No index selected."})
+
+        constituents, error = fetch_index_constituents(index_name)
+        if error:
+            return jsonify({"output": error})
+
+        if columns:
+            constituents = constituents[[col for col in columns if col in constituents.columns]]
+
+        if request.form.get('stream') in ('1', 'true'):
+            def generate():
+                yield render_table_start(constituents.columns)
+                for start in range(0, len(constituents), page_size):
+                    yield render_rows(constituents.iloc[start:start + page_size])
+                yield TABLE_END
+            return Response(stream_with_context(generate()), mimetype='text/html')
+
+         # Create a Material3-styled table manually using HTML
+        rows, has_more = select_page(constituents, page, page_size, [])
+        output_html = render_table_start(constituents.columns) + render_rows(rows)
+        if has_more:
+            output_html += render_next_row(index_name, page + 1, page_size, columns, len(constituents.columns))
+        output_html += TABLE_END
+
         return output_html
 
     except Exception as e:
         return jsonify({"output": f"An error occurred: {traceback.format_exc()}"})
 
+@app.route('/scrape/rows', methods=['POST'])
+def scrape_rows():
+    """One page of table rows (plus the sentinel for the next page) for the htmx lazy loading."""
+    try:
+        index_name, page, page_size, columns = table_params(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    constituents, error = fetch_index_constituents(index_name)
+    if error:
+        return f"<tr><td>{escape(error)}</td></tr>"
+
+    rows, has_more = select_page(constituents, page, page_size, columns)
+    output_html = render_rows(rows)
+    if has_more:
+        output_html += render_next_row(index_name, page + 1, page_size, columns, len(rows.columns))
+    return output_html
+
+@app.route('/constituents', methods=['GET'])
+def constituents_data():
+    """Constituents as data for clients that render the table themselves: ?index=...&page=...&page_size=...&columns=a,b
+    format=json (default) returns {"columns", "rows", "page", "total", "has_more"}, format=arrow an Arrow IPC stream of the page.
+    """
+    try:
+        index_name, page, page_size, columns = table_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not index_name:
+        return jsonify({"error": "No index selected."}), 400
+
+    constituents, error = fetch_index_constituents(index_name)
+    if error:
+        return jsonify({"error": error}), 404
+
+    rows, has_more = select_page(constituents, page, page_size, columns)
+    if request.args.get('format', 'json') == 'arrow':
+        if pa is None:
+            return jsonify({"error": "pyarrow is not installed, use format=json."}), 406
+        table = pa.Table.from_pandas(rows.astype(str), preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), mimetype='application/vnd.apache.arrow.stream')
+
+    return jsonify({
+        "columns": [str(col) for col in rows.columns],
+        "rows": json.loads(rows.to_json(orient='values')),
+        "page": page,
+        "page_size": page_size,
+        "total": len(constituents),
+        "has_more": has_more,
+    })
+
+
+job_manager = JobManager()
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a bulk enrichment job. JSON (or form) body with either "symbols" (list or comma separated) or "index" (one
+    index name, or several separated by commas for a deduplicated combined universe),
+    plus optional "start_date" / "end_date". Returns the job id right away, the fetching happens on the job pool.
+    """
+    params = request.get_json(silent=True) or request.form
+    symbols = params.get('symbols') or []
+    if isinstance(symbols, str):
+        symbols = [symbol.strip() for symbol in symbols.split(',') if symbol.strip()]
+    try:
+        job = job_manager.submit(symbols=symbols,
+                                index_name=params.get('index'),
+                                start_date=params.get('start_date', "2001-01-01"),
+                                end_date=params.get('end_date', "2024-12-31"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(job.to_dict(details=False)), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify([job.to_dict(details=False) for job in job_manager.list()])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Progress of a job with the status of every symbol (pending / done / failed)."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found."}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """Download the enrichment of a finished job, ?format=csv (default), xlsx or parquet."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found."}), 404
+    if job.status != 'done':
+        return jsonify({"error": f"Job '{job_id}' is {job.status}."}), 409
+
+    file_format = request.args.get('format', 'csv')
+    try:
+        data, mimetype = job_manager.export(job, file_format)
+    except (ValueError, ImportError) as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(data, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={job.id}.{file_format}"})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: cumulative stage timings, request / retry counts and cache hits of the process."""
+    return Response(default_telemetry.prometheus(), mimetype="text/plain; version=0.0.4")
+
 
 if __name__ == '__main__':
     app.run(debug=False)
@@ -0,0 +1,169 @@
+"""Offline benchmark of the fetch / metrics pipeline (enrich_symbols) on a data_sources.ReplaySource.
+
+    python bench_pipeline.py --sizes 10 500 5000 --latency 0.05 --error-rate 0.01
+
+Each size runs in a fresh process so the peak RSS of one run doesn't carry over to the next. Reports symbols/sec, the
+p50 / p99 per-symbol latency (from the first price request of a symbol, its chunk download on the batched path, to its
+result) and the peak RSS of the run (of the run's process, and of the largest --cpu-workers process separately). A size run that crashes or exceeds --timeout is reported as failed.
+"""
+import argparse
+import multiprocessing
+import queue
+import sys
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb(children=False):
+    """Peak resident memory of this process in MB, or with children=True the peak of its largest finished child process
+    (ru_maxrss of RUSAGE_CHILDREN is the maximum over the children, not their sum, so it isn't added to ours).
+    None where it can't be read.
+    """
+    if resource is None:
+        if children:
+            return None
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage / 2 ** 20 if sys.platform == 'darwin' else usage / 2 ** 10
+
+
+def timed_source(**kwargs):
+    """A ReplaySource noting when the first price request of every symbol went out (a batched download or the single
+    symbol history), the start of that symbol's latency.
+    """
+    from data_sources import ReplaySource
+
+    class TimedReplaySource(ReplaySource):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.first_request = {}
+
+        def _started(self, symbols):
+            now = time.perf_counter()
+            for symbol in ([symbols] if isinstance(symbols, str) else symbols):
+                self.first_request.setdefault(symbol, now)
+
+        def download(self, symbols, **download_args):
+            self._started(symbols)
+            return super().download(symbols, **download_args)
+
+        def history(self, symbol, start=None, end=None):
+            self._started(symbol)
+            return super().history(symbol, start, end)
+
+    return TimedReplaySource(**kwargs)
+
+
+def run_size(size, args):
+    from data_sources import set_source
+    from scheduler import FetchScheduler
+    import SymbolScraping
+
+    source = timed_source(fixtures_dir=args.fixtures, latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, seed=args.seed, start=args.history_start)
+    set_source(source)
+    symbols = [f"SYN{i:05d}" for i in range(size)]
+    scheduler = FetchScheduler(workers=args.workers, rate=args.rate, backoff=args.backoff)
+    done = {}
+
+    started = time.perf_counter()
+    SymbolScraping.enrich_symbols(symbols, args.start_date, args.end_date, chunk_size=args.chunk_size,
+                                  scheduler=scheduler, cpu_workers=args.cpu_workers,
+                                  on_result=lambda symbol, data: done.__setitem__(symbol, time.perf_counter()))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([finished - source.first_request[symbol] for symbol, finished in done.items()] or [np.nan])
+    return {
+        'symbols': size,
+        'done': len(done),
+        'seconds': elapsed,
+        'symbols_per_sec': len(done) / elapsed if elapsed else float('nan'),
+        'latency_p50': float(np.percentile(latencies, 50)),
+        'latency_p99': float(np.percentile(latencies, 99)),
+        'requests': source.calls,
+        'injected_errors': source.injected_errors,
+        'retries': scheduler.retry_count,
+        'peak_rss_mb': peak_rss_mb(),
+        'child_peak_rss_mb': peak_rss_mb(children=True) if args.cpu_workers else None,
+    }
+
+
+def _run_in_child(size, args, results):
+    results.put(run_size(size, args))
+
+
+def run_size_in_child(size, args):
+    """run_size in a fresh process, {'symbols': size, 'error': ...} when it dies or runs longer than args.timeout."""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    child = context.Process(target=_run_in_child, args=(size, args, results))
+    child.start()
+    deadline = None if args.timeout is None else time.monotonic() + args.timeout
+    row = None
+    while row is None:
+        try:
+            row = results.get(timeout=1.0)
+        except queue.Empty:
+            if not child.is_alive():
+                # The row may have been put right before the child exited
+                try:
+                    row = results.get(timeout=1.0)
+                except queue.Empty:
+                    row = {'symbols': size, 'error': f"exit code {child.exitcode}"}
+            elif deadline is not None and time.monotonic() > deadline:
+                child.terminate()
+                row = {'symbols': size, 'error': f"timed out after {args.timeout:.0f}s"}
+    child.join()
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 500, 5000])
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every simulated request")
+    parser.add_argument('--jitter', type=float, default=0.02, help="extra uniform(0, jitter) seconds per request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests failing with a 429")
+    parser.add_argument('--fixtures', default=None, help="ReplaySource fixtures directory (synthetic data otherwise)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--history-start', default="2015-01-02", help="first date of the synthetic histories")
+    parser.add_argument('--start-date', default="2018-01-01")
+    parser.add_argument('--end-date', default="2024-12-31")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=1000.0, help="scheduler requests per second")
+    parser.add_argument('--backoff', type=float, default=0.05, help="scheduler retry backoff base (seconds)")
+    parser.add_argument('--chunk-size', type=int, default=50)
+    parser.add_argument('--cpu-workers', type=int, default=None)
+    parser.add_argument('--in-process', action='store_true', help="run every size in this process (RSS is then cumulative)")
+    parser.add_argument('--timeout', type=float, default=3600, help="seconds before a size run is stopped and reported as failed")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for size in args.sizes:
+        rows.append(run_size(size, args) if args.in_process else run_size_in_child(size, args))
+
+    print()
+    print(f"{'symbols':>8} {'done':>6} {'seconds':>9} {'sym/s':>9} {'p50 s':>8} {'p99 s':>8} {'requests':>9} {'429s':>6} {'retries':>8} {'peak MB':>9} {'child MB':>9}")
+    for row in rows:
+        if 'error' in row:
+            print(f"{row['symbols']:>8} failed: {row['error']}")
+            continue
+        rss, child_rss = (f"{row[key]:.0f}" if row[key] is not None else "n/a" for key in ('peak_rss_mb', 'child_peak_rss_mb'))
+        print(f"{row['symbols']:>8} {row['done']:>6} {row['seconds']:>9.2f} {row['symbols_per_sec']:>9.1f} "
+              f"{row['latency_p50']:>8.3f} {row['latency_p99']:>8.3f} {row['requests']:>9} {row['injected_errors']:>6} "
+              f"{row['retries']:>8} {rss:>9} {child_rss:>9}")
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Non-interactive command line for the scraping tasks of the SymbolScraping menu, for scripts and cron jobs.
+
+    python cli.py scrape-index "S&P 500" "NASDAQ 100" -o universe.csv
+    python cli.py enrich-sheet symbols.xlsx --sheet SP500 -o enriched.parquet --start 2015-01-01 --workers 16
+    python cli.py lookup AAPL MSFT --format json
+    python cli.py enrich-sheet symbols.xlsx -o enriched.csv --processes 4 --queue /shared/queue.sqlite
+    python cli.py worker --queue /shared/queue.sqlite      # on other hosts, to join the run
+
+Only the standard library is imported up front, pandas / SymbolScraping / yfinance are imported by the subcommand that
+needs them, so --help and argument errors return right away and a lookup doesn't pay for the modules it never uses.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import sys
+
+DEFAULT_START = "2001-01-01"
+# enrich-sheet --float32, the price store dtypes (see SymbolScraping.enrich_symbols store_dtypes)
+STORE_FLOAT32 = {'Close': 'float32', 'Volume': 'float32'}
+
+
+def today():
+    return datetime.date.today().isoformat()
+
+
+def parse_indicators(values):
+    """--indicators sma=20,50 beta=60 -> {'sma': (20, 50), 'beta': (60,)}, no values -> the default set (None means off)."""
+    if values is None:
+        return None
+    if not values:
+        from indicators import DEFAULT_CONFIG
+        return DEFAULT_CONFIG
+    config = {}
+    for value in values:
+        name, _, windows = value.partition('=')
+        try:
+            config[name.strip().lower()] = tuple(int(window) for window in windows.split(',') if window.strip())
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid indicator '{value}', expected e.g. sma=20,50")
+    return config
+
+
+def replay_options(args):
+    """ReplaySource keyword arguments of --replay / --fixtures, None to use the network."""
+    if args.replay or args.fixtures:
+        return {'fixtures_dir': args.fixtures}
+    return None
+
+
+def setup(args):
+    """Data source and caches shared by the subcommands. Returns the PriceCache (None without --cache-dir)."""
+    replay = replay_options(args)
+    if replay is not None:
+        from data_sources import ReplaySource, set_source
+        set_source(ReplaySource(**replay))
+
+    if args.cache_dir is None:
+        if args.offline:
+            raise SystemExit("--offline needs a --cache-dir to read from.")
+        return None
+
+    from constituents import default_service
+    from price_cache import PriceCache
+    os.makedirs(args.cache_dir, exist_ok=True)
+    default_service.cache_dir = os.path.join(args.cache_dir, "constituents")
+    return PriceCache(os.path.join(args.cache_dir, "price_cache.sqlite"), offline=args.offline)
+
+
+def scrape_index(args):
+    from universe import fetch_universe, load_index_info
+    from writers import column_kinds, open_writer
+
+    index_info = load_index_info()
+    unknown = [index_name for index_name in args.indices if index_name not in index_info]
+    if unknown:
+        print(f"Unsupported indices: {', '.join(unknown)} (available: {', '.join(index_info)})", file=sys.stderr)
+        return 2
+    setup(args)
+
+    # The progress prints go to stderr, stdout only carries the table
+    with contextlib.redirect_stdout(sys.stderr):
+        universe = fetch_universe(args.indices, index_info=index_info, workers=args.workers)
+    if not universe.tables:
+        return 1
+    if len(args.indices) == 1:
+        table = next(iter(universe.tables.values()))
+    else:
+        table = universe.membership.reset_index()
+        overlap = ", ".join(f"{count} in {indices}" for indices, count in universe.overlap().items())
+        print(f"{len(universe.members)} memberships, {len(universe)} unique symbols ({overlap} indices).", file=sys.stderr)
+
+    if args.output is None:
+        table.to_csv(sys.stdout, index=False)
+    else:
+        with open_writer(args.output, table.columns, file_format=args.format, dtypes=column_kinds(table)) as writer:
+            writer.write_frame(table)
+        print(f"{len(table)} rows saved to {args.output}", file=sys.stderr)
+    return 0 if len(universe.tables) == len(args.indices) else 1
+
+
+def enrich_sheet(args):
+    if args.processes is not None or args.queue is not None:
+        return enrich_distributed(args)
+    from SymbolScraping import upload_symbol_script
+
+    cache = setup(args)
+    try:
+        upload_symbol_script(args.file,
+                             sheetname=args.sheet,
+                             start_date=args.start,
+                             end_date=args.end,
+                             output_file_path=args.output,
+                             chunk_size=args.chunk_size,
+                             cache=cache,
+                             workers=args.workers,
+                             rate=args.rate,
+                             journal_path=args.journal,
+                             retry_failed=not args.no_retry_failed,
+                             output_format=args.format,
+                             price_matrix_path=args.price_matrix,
+                             cpu_workers=args.cpu_workers,
+                             indicators=args.indicators,
+                             market_index=args.benchmark,
+                             price_store_path=args.price_store,
+                             store_dtypes=STORE_FLOAT32 if args.float32 else None)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+def enrich_distributed(args):
+    """enrich-sheet --processes / --queue: shard the sheet over worker processes (see distributed.distributed_upload)."""
+    from distributed import distributed_upload
+
+    if args.offline and args.cache_dir is None:
+        raise SystemExit("--offline needs a --cache-dir to read from.")
+    if args.journal or args.price_matrix or args.price_store or args.float32:
+        print("--journal, --price-matrix, --price-store and --float32 aren't used by a distributed run "
+              "(the work queue keeps the progress).", file=sys.stderr)
+    distributed_upload(args.file,
+                       sheetname=args.sheet,
+                       start_date=args.start,
+                       end_date=args.end,
+                       output_file_path=args.output,
+                       output_format=args.format,
+                       queue_path=args.queue or "work_queue.sqlite",
+                       processes=4 if args.processes is None else args.processes,
+                       shard_size=args.shard_size,
+                       lease_seconds=args.lease,
+                       chunk_size=args.chunk_size,
+                       workers=args.workers,
+                       rate=args.rate,
+                       cpu_workers=args.cpu_workers,
+                       cache_dir=args.cache_dir,
+                       offline=args.offline,
+                       replay=replay_options(args),
+                       indicators=args.indicators,
+                       market_index=args.benchmark)
+    return 0
+
+
+def worker(args):
+    from distributed import run_worker
+
+    if args.offline and args.cache_dir is None:
+        raise SystemExit("--offline needs a --cache-dir to read from.")
+    run_worker(args.queue,
+               run_id=args.run,
+               lease_seconds=args.lease,
+               workers=args.workers,
+               rate=args.rate,
+               cpu_workers=args.cpu_workers,
+               cache_dir=args.cache_dir,
+               offline=args.offline,
+               replay=replay_options(args),
+               wait=not args.no_wait)
+    return 0
+
+
+def lookup(args):
+    from SymbolScraping import fetch_stock_data, load_market_returns
+    from market_benchmarks import benchmark_for
+    from scheduler import FetchScheduler
+
+    cache = setup(args)
+    # The scheduler rate limits and retries the requests instead of the fixed sleep of an unscheduled fetch, and looks
+    # the symbols up workers at a time
+    scheduler = FetchScheduler(workers=args.workers, rate=args.rate)
+
+    def fetch(symbol):
+        market_returns = load_market_returns(args.start, args.end, cache=cache, market_index=args.benchmark or benchmark_for(symbol))
+        return fetch_stock_data(symbol, market_returns, args.start, args.end, cache=cache, request=scheduler.request)
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            fetched = scheduler.run(args.symbols, fetch)
+    finally:
+        if cache is not None:
+            cache.close()
+    results = {symbol: fetched.get(symbol) for symbol in args.symbols}
+
+    if args.format == 'json':
+        results = {symbol: None if data is None else {key: _json_value(value) for key, value in data.items()}
+                   for symbol, data in results.items()}
+        print(json.dumps(results, indent=2, allow_nan=False))
+    else:
+        for symbol, data in results.items():
+            if len(results) > 1:
+                print(f"\n{symbol}:")
+            if data:
+                for key, value in data.items():
+                    print(f"{key}: {value}")
+            else:
+                print("No data to display.")
+    return 0 if all(results.values()) else 1
+
+
+def _json_value(value):
+    """A fetch_stock_data value as strict JSON: numpy scalars as Python ones, NaN / inf (SMA 200 of a short range, a
+    missing P/E or Beta) as null, timestamps and anything else that isn't JSON as text.
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="stockscribe", description=__doc__.splitlines()[0])
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--cache-dir', default=None, help="directory of the price cache (price_cache.sqlite) and the constituents cache")
+    common.add_argument('--offline', action='store_true', help="only serve what is in the --cache-dir price cache")
+    common.add_argument('--replay', action='store_true', help="use the synthetic data_sources.ReplaySource instead of the network")
+    common.add_argument('--fixtures', default=None, help="ReplaySource fixtures directory (implies --replay)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scrape = subparsers.add_parser('scrape-index', parents=[common], help="fetch the constituents of one or more indices")
+    scrape.add_argument('indices', nargs='+', help="index names of server/indices.json, several for a merged universe")
+    scrape.add_argument('-o', '--output', default=None, help="output file (CSV on stdout otherwise)")
+    scrape.add_argument('--format', choices=['csv', 'xlsx', 'parquet', 'arrow'], default=None, help="defaults to the output extension")
+    scrape.add_argument('--workers', type=int, default=4, help="indices fetched at the same time")
+    scrape.set_defaults(handler=scrape_index)
+
+    enrich = subparsers.add_parser('enrich-sheet', parents=[common], help="enrich every symbol of an Excel sheet with the metrics")
+    enrich.add_argument('file', help="Excel file with a Symbol column")
+    enrich.add_argument('--sheet', default="SP500")
+    enrich.add_argument('-o', '--output', required=True)
+    enrich.add_argument('--format', choices=['xlsx', 'csv', 'parquet', 'arrow'], default=None, help="defaults to the output extension")
+    enrich.add_argument('--start', default=DEFAULT_START)
+    enrich.add_argument('--end', default=today())
+    enrich.add_argument('--workers', type=int, default=8, help="concurrent requests")
+    enrich.add_argument('--rate', type=float, default=2.0, help="requests per second")
+    enrich.add_argument('--cpu-workers', type=int, default=None, help="processes for the metrics (threads only by default)")
+    enrich.add_argument('--chunk-size', type=int, default=50, help="symbols per batched download")
+    enrich.add_argument('--journal', default=None, help="RunJournal file, re-running with it resumes the run")
+    enrich.add_argument('--no-retry-failed', action='store_true', help="skip the symbols the journal recorded as failed")
+    enrich.add_argument('--price-matrix', default=None, help="also save the close price matrix there")
+    enrich.add_argument('--price-store', default=None, help="directory to memory map the price store in (kept in RAM otherwise)")
+    enrich.add_argument('--float32', action='store_true', help="keep the price store closes / volumes as float32 (half the memory)")
+    enrich.add_argument('--indicators', nargs='*', default=None, metavar="NAME=WINDOWS",
+                        help="rolling indicator columns, e.g. sma=20,50 beta=60 (the default set without values)")
+    enrich.add_argument('--benchmark', default='^GSPC', help="index the correlation is computed against")
+    enrich.add_argument('--processes', type=int, default=None,
+                        help="shard the run over this many local worker processes (more can join with the worker command)")
+    enrich.add_argument('--queue', default=None, help="work queue file of a sharded run (work_queue.sqlite)")
+    enrich.add_argument('--shard-size', type=int, default=100, help="symbols per shard of a sharded run")
+    enrich.add_argument('--lease', type=float, default=600, help="seconds before the shard of a dead worker is handed out again")
+    enrich.set_defaults(handler=enrich_sheet)
+
+    work = subparsers.add_parser('worker', parents=[common], help="work on the shards of a sharded enrich-sheet run")
+    work.add_argument('--queue', required=True, help="work queue file the coordinator created")
+    work.add_argument('--run', default=None, help="only work on this run (every queued run by default)")
+    work.add_argument('--workers', type=int, default=8, help="concurrent requests")
+    work.add_argument('--rate', type=float, default=2.0, help="requests per second of this worker")
+    work.add_argument('--cpu-workers', type=int, default=None)
+    work.add_argument('--lease', type=float, default=600)
+    work.add_argument('--no-wait', action='store_true', help="exit as soon as there's no shard to claim")
+    work.set_defaults(handler=worker)
+
+    look = subparsers.add_parser('lookup', parents=[common], help="print the metrics of one or more symbols")
+    look.add_argument('symbols', nargs='+')
+    look.add_argument('--start', default=DEFAULT_START)
+    look.add_argument('--end', default=today())
+    look.add_argument('--format', choices=['text', 'json'], default='text')
+    look.add_argument('--benchmark', default=None, help="defaults to the benchmark of each symbol's exchange")
+    look.add_argument('--workers', type=int, default=4, help="concurrent requests")
+    look.add_argument('--rate', type=float, default=2.0, help="requests per second")
+    look.set_defaults(handler=lookup)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'indicators', None) is not None:
+        try:
+            args.indicators = parse_indicators(args.indicators)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import io
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+from collections import OrderedDict
+
+import pandas as pd
+
+from data_sources import get_source
+from telemetry import cache_result, count
+
+
+class ConstituentService:
+    """Shared source of index constituent tables (the Wikipedia tables listed in index_info), used by both the CLI and the
+    Flask app.
+
+    Tables are kept in an in-process LRU and on disk (cache_dir/<index>.pkl + .json with the ETag / Last-Modified of the
+    page). Once a table is older than max_age the page is re-requested conditionally, a 304 answer just bumps the
+    timestamp so the page is only parsed again when it actually changed. With block=False a stale table is returned
+    right away and revalidated on a background thread, start_background_refresh keeps a set of indices warm.
+    """
+
+    def __init__(self, cache_dir=".constituents_cache", max_entries=16, max_age=3600):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.refresh_thread = None
+
+    def get(self, index_name, url, table_index, block=True):
+        """Return a copy of the constituents table of an index.
+        block=False never waits on Wikipedia when any cached copy exists, a stale one is refreshed in the background.
+        """
+        key = _slug(index_name)
+        entry = self._memory_get(key) or self._disk_get(key)
+        if entry is not None and (entry['url'] != url or entry['table_index'] != table_index):
+            entry = None
+        fresh = entry is not None and time.time() - entry['checked_at'] < self.max_age
+        cache_result('constituents', hit=fresh)
+        if fresh:
+            return entry['table'].copy()
+        if entry is not None and not block:
+            self._refresh_async(index_name, url, table_index)
+            return entry['table'].copy()
+        return self.refresh(index_name, url, table_index).copy()
+
+    def refresh(self, index_name, url, table_index):
+        """Revalidate one index against Wikipedia (conditional GET) and return the current table."""
+        key = _slug(index_name)
+        entry = self._memory_get(key) or self._disk_get(key)
+
+        headers = {}
+        if entry is not None and entry['table_index'] == table_index and entry['url'] == url:
+            if entry.get('etag'):
+                headers["If-None-Match"] = entry['etag']
+            if entry.get('last_modified'):
+                headers["If-Modified-Since"] = entry['last_modified']
+
+        try:
+            html, response_headers = get_source().page(url, headers)
+            etag = response_headers.get("ETag")
+            last_modified = response_headers.get("Last-Modified")
+        except urllib.error.HTTPError as e:
+            if e.code != 304 or entry is None:
+                raise
+            print(f"Constituents for {index_name} not modified.")
+            count('constituents_not_modified')
+            entry['checked_at'] = time.time()
+            self._store(key, entry)
+            return entry['table']
+
+        print(f"Fetching data from URL: {url}, Table Index: {table_index}")
+        tables = pd.read_html(io.StringIO(html.decode('utf-8', errors='replace')))
+        entry = {
+            'table': tables[table_index],
+            'url': url,
+            'table_index': table_index,
+            'etag': etag,
+            'last_modified': last_modified,
+            'checked_at': time.time(),
+        }
+        self._store(key, entry)
+        return entry['table']
+
+    def start_background_refresh(self, indices, interval=None):
+        """Keep every index of an index_info style dictionary fresh from a daemon thread (every interval seconds,
+        defaults to max_age) so front-end requests are served from memory.
+        Only one refresh thread runs per service, later calls return the running one.
+        """
+        interval = self.max_age if interval is None else interval
+
+        def loop():
+            while True:
+                for index_name, index_data in indices.items():
+                    try:
+                        self.refresh(index_name, index_data["url"], index_data["table_index"])
+                    except Exception as e:
+                        print(f"Background refresh of {index_name} failed: {e}")
+                time.sleep(interval)
+
+        with self.lock:
+            if self.refresh_thread is not None and self.refresh_thread.is_alive():
+                return self.refresh_thread
+            self.refresh_thread = threading.Thread(target=loop, name="constituent-refresh", daemon=True)
+            self.refresh_thread.start()
+            return self.refresh_thread
+
+    def _refresh_async(self, index_name, url, table_index):
+        with self.lock:
+            if index_name in self.refreshing:
+                return
+            self.refreshing.add(index_name)
+
+        def run():
+            try:
+                self.refresh(index_name, url, table_index)
+            except Exception as e:
+                print(f"Background refresh of {index_name} failed: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(index_name)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _memory_get(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+            return entry
+
+    def _disk_get(self, key):
+        meta_path = os.path.join(self.cache_dir, key + ".json")
+        table_path = os.path.join(self.cache_dir, key + ".pkl")
+        if not (os.path.exists(meta_path) and os.path.exists(table_path)):
+            return None
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                entry = json.load(f)
+            entry['table'] = pd.read_pickle(table_path)
+        except Exception as e:
+            print(f"Ignoring unreadable constituent cache {meta_path}: {e}")
+            return None
+        self._memory_put(key, entry)
+        return entry
+
+    def _memory_put(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def _store(self, key, entry):
+        self._memory_put(key, entry)
+        meta = {k: v for k, v in entry.items() if k != 'table'}
+        meta_path = os.path.join(self.cache_dir, key + ".json")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry['table'].to_pickle(os.path.join(self.cache_dir, key + ".pkl"))
+        with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+
+def _slug(index_name):
+    return re.sub(r'[^A-Za-z0-9]+', '_', index_name).strip('_')
+
+
+# Process wide instance shared by SymbolScraping and the Flask app
+default_service = ConstituentService()
+
+
+def get_constituents(index_name, url, table_index, block=True):
+    return default_service.get(index_name, url, table_index, block=block)
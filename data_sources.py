@@ -0,0 +1,307 @@
+import json
+import logging
+import os
+import random
+import re
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+
+import numpy as np
+import pandas as pd
+
+USER_AGENT = "StockScribe/1.0 (index constituent scraper)"
+
+
+class DataSource:
+    """Where SymbolScraping / constituents get their data from. Every method is one upstream request.
+
+    history(symbol, start, end): daily OHLCV dataframe with a tz naive index, start=None meaning the whole history
+    download(symbols, **args): multi ticker history in the yf.download(group_by='ticker') layout
+    info(symbol): the stock.info dictionary
+    page(url, headers): (body bytes, response headers mapping) of a web page, raises urllib.error.HTTPError (304 included)
+    """
+
+    def history(self, symbol, start=None, end=None):
+        raise NotImplementedError
+
+    def download(self, symbols, **download_args):
+        raise NotImplementedError
+
+    def info(self, symbol):
+        raise NotImplementedError
+
+    def page(self, url, headers=None):
+        raise NotImplementedError
+
+
+class YFinanceSource(DataSource):
+    """The live source: YFinance for prices / info and Wikipedia (urllib) for the constituent pages.
+
+    yfinance and certifi are imported on first use, they're the slowest imports of the tree and a run on the cache or
+    a ReplaySource (or a CLI --help) never needs them.
+    """
+
+    def __init__(self):
+        self._ssl_context = None
+
+    @property
+    def ssl_context(self):
+        if self._ssl_context is None:
+            import certifi
+            self._ssl_context = ssl.create_default_context(cafile=certifi.where())
+        return self._ssl_context
+
+    def history(self, symbol, start=None, end=None):
+        import yfinance as yf
+        stock = yf.Ticker(symbol)
+        if start is None:
+            hist = stock.history(period="max")
+        else:
+            hist = stock.history(start=start, end=end)
+        if getattr(hist.index, 'tz', None) is not None:
+            hist.index = hist.index.tz_localize(None)
+        return hist
+
+    def download(self, symbols, **download_args):
+        import yfinance as yf
+        # yf.download only logs the tickers that failed, a call where nothing came back because of a 429 is raised as
+        # one so the FetchScheduler backs off and retries it
+        capture = _ErrorCapture()
+        logger = logging.getLogger('yfinance')
+        logger.addHandler(capture)
+        try:
+            data = yf.download(symbols, **download_args)
+        finally:
+            logger.removeHandler(capture)
+        rate_limited = [message for message in capture.messages if 'Too Many Requests' in message or 'RateLimit' in message]
+        if rate_limited and (data is None or data.empty or data.isna().all().all()):
+            raise RateLimitError(f"429 Too Many Requests: {rate_limited[0]}")
+        return data
+
+    def info(self, symbol):
+        import yfinance as yf
+        return yf.Ticker(symbol).info
+
+    def page(self, url, headers=None):
+        headers = {"User-Agent": USER_AGENT, **(headers or {})}
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), context=self.ssl_context) as response:
+            return response.read(), response.headers
+
+
+class _ErrorCapture(logging.Handler):
+    """Collects the error lines the yfinance logger writes on the calling thread (the failed tickers of a yf.download)."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.thread = threading.get_ident()
+        self.messages = []
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.messages.append(record.getMessage())
+
+
+class RateLimitError(Exception):
+    """Injected 429 (or a yf.download where every ticker was rate limited), recognized by scheduler.is_rate_limit_error
+    like the YFinance one.
+    """
+
+
+class ReplaySource(DataSource):
+    """Offline stand-in for YFinanceSource, to measure the pipeline without the network.
+
+    fixtures_dir: recorded data (see RecordingSource), history/<symbol>.csv, info/<symbol>.json and pages/<url slug>.html.
+        Anything without a fixture is synthesized: a deterministic random walk per symbol (some symbols listing late so
+        the first trading date logic is exercised), a seeded info dictionary and a constituents page of page_symbols
+        tickers.
+    latency / jitter: every call sleeps latency + uniform(0, jitter) seconds
+    error_rate: share of the calls that fail with a 429 RateLimitError
+    missing: symbols that come back empty, like a delisted ticker
+    """
+
+    def __init__(self,
+                fixtures_dir=None,
+                latency=0.0,
+                jitter=0.0,
+                error_rate=0.0,
+                seed=0,
+                start="2015-01-02",
+                end="2025-01-01",
+                missing=(),
+                page_symbols=500):
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self.start = start
+        self.end = end
+        self.missing = set(missing)
+        self.page_symbols = page_symbols
+        self.random = random.Random(seed)
+        # Business days of the synthetic histories, built once (bdate_range is slow next to the rest of a replayed request)
+        self.calendar = pd.bdate_range(start, end, inclusive='left')
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.injected_errors = 0
+
+    def history(self, symbol, start=None, end=None):
+        self._request()
+        hist = self._history(symbol)
+        if start is not None:
+            hist = hist[(hist.index >= pd.to_datetime(start)) & (hist.index < pd.to_datetime(end))]
+        return hist
+
+    def download(self, symbols, start=None, end=None, group_by=None, **download_args):
+        self._request()
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        frames = {}
+        for symbol in symbols:
+            hist = self._history(symbol)
+            if start is not None:
+                hist = hist[(hist.index >= pd.to_datetime(start)) & (hist.index < pd.to_datetime(end))]
+            if not hist.empty:
+                frames[symbol] = hist
+        if not frames:
+            return pd.DataFrame()
+        data = pd.concat(frames, axis=1)
+        return data if group_by == 'ticker' else data.swaplevel(axis=1).sort_index(axis=1)
+
+    def info(self, symbol):
+        self._request()
+        path = self._fixture('info', symbol, '.json')
+        if path is not None:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        rng = self._rng(symbol)
+        return {
+            'sector': 'Synthetic',
+            'industry': f"Industry {rng.integers(10)}",
+            'dividendYield': float(rng.choice([0.0, rng.uniform(0.5, 4.0)])),
+            'trailingPE': float(rng.uniform(5, 40)),
+            'beta': float(rng.uniform(0.5, 1.5)),
+        }
+
+    def page(self, url, headers=None):
+        self._request()
+        path = self._fixture('pages', _slug(url), '.html')
+        if path is not None:
+            with open(path, 'rb') as f:
+                return f.read(), {}
+        rows = "".join(f"<tr><td>SYN{i:04d}</td><td>Synthetic {i}</td></tr>" for i in range(self.page_symbols))
+        table = f"<table><tr><th>Symbol</th><th>Security</th></tr>{rows}</table>"
+        # Enough copies that any table_index of index_info points at a table
+        return f"<html><body>{table * 8}</body></html>".encode('utf-8'), {}
+
+    def _request(self):
+        """Simulated round trip: latency, then maybe a rate limit error."""
+        with self.lock:
+            self.calls += 1
+            wait = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.injected_errors += 1
+        if wait:
+            time.sleep(wait)
+        if failed:
+            raise RateLimitError("429 Too Many Requests (injected)")
+
+    def _history(self, symbol):
+        if symbol in self.missing:
+            # Empty but with a date index, so a start / end slice of it still works
+            return pd.DataFrame(index=pd.DatetimeIndex([]))
+        path = self._fixture('history', symbol, '.csv')
+        if path is not None:
+            return pd.read_csv(path, index_col=0, parse_dates=True)
+
+        rng = self._rng(symbol)
+        dates = self.calendar
+        if rng.random() < 0.2:
+            dates = dates[rng.integers(len(dates) // 2):]
+        n = len(dates)
+        close = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, n)))
+        open_ = close * (1 + rng.normal(0, 0.005, n))
+        spread = np.abs(rng.normal(0, 0.01, n))
+        return pd.DataFrame({
+            'Open': open_,
+            'High': np.maximum(open_, close) * (1 + spread),
+            'Low': np.minimum(open_, close) * (1 - spread),
+            'Close': close,
+            'Volume': rng.integers(100_000, 5_000_000, n).astype(float),
+            'Dividends': 0.0,
+            'Stock Splits': 0.0,
+        }, index=dates)
+
+    def _rng(self, symbol):
+        return np.random.default_rng(zlib.crc32(str(symbol).encode()) ^ self.seed)
+
+    def _fixture(self, kind, name, extension):
+        if self.fixtures_dir is None:
+            return None
+        path = os.path.join(self.fixtures_dir, kind, _slug(name) + extension)
+        return path if os.path.exists(path) else None
+
+
+class RecordingSource(DataSource):
+    """Wraps a source (the live one by default) and saves what it returns as ReplaySource fixtures."""
+
+    def __init__(self, fixtures_dir, source=None):
+        self.fixtures_dir = fixtures_dir
+        self.source = source or YFinanceSource()
+        for kind in ('history', 'info', 'pages'):
+            os.makedirs(os.path.join(fixtures_dir, kind), exist_ok=True)
+
+    def history(self, symbol, start=None, end=None):
+        hist = self.source.history(symbol, start, end)
+        # Only whole histories are recorded, a replayed range is sliced out of them
+        if start is None and not hist.empty:
+            hist.to_csv(os.path.join(self.fixtures_dir, 'history', _slug(symbol) + '.csv'))
+        return hist
+
+    def download(self, symbols, **download_args):
+        data = self.source.download(symbols, **download_args)
+        if download_args.get('period') == "max" and download_args.get('group_by') == 'ticker' and isinstance(data.columns, pd.MultiIndex):
+            for symbol in data.columns.get_level_values(0).unique():
+                hist = data[symbol].dropna(subset=['Close'])
+                if getattr(hist.index, 'tz', None) is not None:
+                    hist.index = hist.index.tz_localize(None)
+                hist.to_csv(os.path.join(self.fixtures_dir, 'history', _slug(symbol) + '.csv'))
+        return data
+
+    def info(self, symbol):
+        info = self.source.info(symbol)
+        with open(os.path.join(self.fixtures_dir, 'info', _slug(symbol) + '.json'), 'w', encoding='utf-8') as f:
+            json.dump(info, f, default=str)
+        return info
+
+    def page(self, url, headers=None):
+        body, response_headers = self.source.page(url, headers)
+        with open(os.path.join(self.fixtures_dir, 'pages', _slug(url) + '.html'), 'wb') as f:
+            f.write(body)
+        return body, response_headers
+
+
+def _slug(name):
+    return re.sub(r'[^A-Za-z0-9^.\-]+', '_', str(name)).strip('_')
+
+
+_source = YFinanceSource()
+
+
+def get_source():
+    """The source every fetch goes through (YFinance unless set_source was called)."""
+    return _source
+
+
+def set_source(source):
+    """Swap the process wide data source, e.g. set_source(ReplaySource(latency=0.05, error_rate=0.01)) to run offline.
+    Returns the previous one.
+    """
+    global _source
+    previous, _source = _source, source
+    return previous
@@ -0,0 +1,424 @@
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+from journal import _json_default
+from telemetry import default_telemetry
+from writers import column_kinds, open_writer
+
+
+class WorkQueue:
+    """SQLite backed work queue of sharded enrichment runs, shared by a coordinator and any number of workers.
+
+    A run is a symbol list cut into shards of shard_size symbols plus the settings every worker needs (dates, benchmark,
+    indicators...). Workers claim one shard at a time with a lease of lease_seconds that they renew while they work on it.
+    A shard whose lease runs out (the worker died or hung) is handed to the next worker that asks, up to max_attempts
+    times, after that its symbols are recorded as failed. Results are stored per symbol, so a shard finished twice (a slow
+    worker coming back after its lease was taken over) just writes the same rows again.
+
+    Nothing but the SQLite file is needed: local worker processes share it directly, workers on other hosts need it on a
+    filesystem with working file locks.
+
+    shards: pending -> leased -> done, or failed once max_attempts leases ran out
+    """
+
+    def __init__(self, path="work_queue.sqlite", timeout=30.0):
+        self.path = path
+        self.lock = threading.Lock()
+        # Autocommit mode, the transactions are opened explicitly with BEGIN IMMEDIATE so two workers can't claim the same shard
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run TEXT PRIMARY KEY, config TEXT, symbols INTEGER, max_attempts INTEGER, created_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shards ("
+                "run TEXT, shard INTEGER, symbols TEXT, status TEXT, worker TEXT, lease_expires REAL, "
+                "attempts INTEGER, error TEXT, PRIMARY KEY (run, shard))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "run TEXT, symbol TEXT, status TEXT, data TEXT, error TEXT, worker TEXT, finished_at REAL, "
+                "PRIMARY KEY (run, symbol))"
+            )
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def create_run(self, symbols, config, shard_size=100, max_attempts=3, run_id=None):
+        """Queue a run: the unique symbols (order kept) in shards of shard_size. Returns the run id."""
+        run_id = run_id or uuid.uuid4().hex[:12]
+        symbols = list(dict.fromkeys(symbols))
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?)",
+                         (run_id, json.dumps(config, default=_json_default), len(symbols), max_attempts, time.time()))
+            conn.executemany(
+                "INSERT INTO shards VALUES (?, ?, ?, 'pending', NULL, 0, 0, NULL)",
+                [(run_id, i, json.dumps(symbols[first:first + shard_size]))
+                 for i, first in enumerate(range(0, len(symbols), shard_size))]
+            )
+        return run_id
+
+    def run_config(self, run_id):
+        with self.lock:
+            row = self.conn.execute("SELECT config FROM runs WHERE run = ?", (run_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def claim(self, worker_id, lease_seconds=600, run_id=None):
+        """Lease the next pending (or expired) shard, of run_id or of the oldest run with work left.
+        Returns (run_id, shard, symbols) or None when there's nothing to take right now.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._fail_exhausted(conn, now)
+            query = ("SELECT s.run, s.shard, s.symbols FROM shards s JOIN runs r ON r.run = s.run "
+                     "WHERE (s.status = 'pending' OR (s.status = 'leased' AND s.lease_expires < ?)) "
+                     "AND s.attempts < r.max_attempts")
+            args = [now]
+            if run_id is not None:
+                query += " AND s.run = ?"
+                args.append(run_id)
+            row = conn.execute(query + " ORDER BY r.created_at, s.shard LIMIT 1", args).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE shards SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE run = ? AND shard = ?",
+                (worker_id, now + lease_seconds, row[0], row[1])
+            )
+        return row[0], row[1], json.loads(row[2])
+
+    def renew(self, run_id, shard, worker_id, lease_seconds=600):
+        """Extend a lease. False when the worker doesn't hold it anymore (it expired and another worker took the shard)."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE shards SET lease_expires = ? WHERE run = ? AND shard = ? AND worker = ? AND status = 'leased'",
+                (time.time() + lease_seconds, run_id, shard, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, run_id, shard, worker_id, results, failures):
+        """Store the results (symbol -> fetch_stock_data dictionary) and failures (symbol -> error) of a shard and mark it done.
+        A symbol that already has a result keeps it when a later attempt failed.
+        The shard is only marked done by the worker still holding its lease, False when it doesn't anymore (the results
+        are stored all the same, the shard stays with the worker that took it over).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, 'ok', ?, NULL, ?, ?)",
+                [(run_id, symbol, json.dumps(data, default=_json_default), worker_id, now) for symbol, data in results.items()]
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO results VALUES (?, ?, 'failed', NULL, ?, ?, ?)",
+                [(run_id, symbol, str(error), worker_id, now) for symbol, error in failures.items()]
+            )
+            cursor = conn.execute(
+                "UPDATE shards SET status = 'done', lease_expires = NULL "
+                "WHERE run = ? AND shard = ? AND worker = ? AND status = 'leased'",
+                (run_id, shard, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, run_id, shard, worker_id, error):
+        """Give a shard back after an error so another worker retries it right away (failed once out of attempts)."""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE shards SET status = 'pending', lease_expires = NULL, error = ? "
+                "WHERE run = ? AND shard = ? AND worker = ? AND status = 'leased'",
+                (str(error), run_id, shard, worker_id)
+            )
+            self._fail_exhausted(conn, time.time())
+
+    def _fail_exhausted(self, conn, now):
+        """Shards out of attempts (and not leased anymore) become failed, their symbols without a result too."""
+        rows = conn.execute(
+            "SELECT s.run, s.shard, s.symbols, s.error, s.attempts FROM shards s JOIN runs r ON r.run = s.run "
+            "WHERE s.attempts >= r.max_attempts AND (s.status = 'pending' OR (s.status = 'leased' AND s.lease_expires < ?))",
+            (now,)
+        ).fetchall()
+        for run_id, shard, symbols, error, attempts in rows:
+            error = f"Shard failed after {attempts} attempts: {error or 'lease expired'}"
+            conn.execute("UPDATE shards SET status = 'failed', lease_expires = NULL, error = ? WHERE run = ? AND shard = ?",
+                         (error, run_id, shard))
+            conn.executemany("INSERT OR IGNORE INTO results VALUES (?, ?, 'failed', NULL, ?, NULL, ?)",
+                             [(run_id, symbol, error, now) for symbol in json.loads(symbols)])
+
+    def progress(self, run_id):
+        """Shard counts per status and result counts of a run, e.g. {'shards': 12, 'done': 7, 'leased': 4, 'pending': 1,
+        'failed': 0, 'ok_symbols': 690, 'failed_symbols': 10, 'symbols': 1200}.
+        """
+        with self._transaction() as conn:
+            self._fail_exhausted(conn, time.time())
+            statuses = dict(conn.execute("SELECT status, COUNT(*) FROM shards WHERE run = ? GROUP BY status", (run_id,)).fetchall())
+            results = dict(conn.execute("SELECT status, COUNT(*) FROM results WHERE run = ? GROUP BY status", (run_id,)).fetchall())
+            symbols = conn.execute("SELECT symbols FROM runs WHERE run = ?", (run_id,)).fetchone()
+        progress = {status: statuses.get(status, 0) for status in ('pending', 'leased', 'done', 'failed')}
+        progress['shards'] = sum(statuses.values())
+        progress['ok_symbols'] = results.get('ok', 0)
+        progress['failed_symbols'] = results.get('failed', 0)
+        progress['symbols'] = symbols[0] if symbols else 0
+        return progress
+
+    def finished(self, run_id):
+        progress = self.progress(run_id)
+        return progress['pending'] == 0 and progress['leased'] == 0
+
+    def idle(self, run_id=None):
+        """No shard of run_id (or of any run) is pending or leased, a worker has nothing left to wait for."""
+        query = "SELECT COUNT(*) FROM shards WHERE status IN ('pending', 'leased')"
+        args = ()
+        if run_id is not None:
+            query += " AND run = ?"
+            args = (run_id,)
+        with self._transaction() as conn:
+            self._fail_exhausted(conn, time.time())
+            return conn.execute(query, args).fetchone()[0] == 0
+
+    def results(self, run_id):
+        """Result dictionaries of the run's completed symbols."""
+        with self.lock:
+            rows = self.conn.execute("SELECT data FROM results WHERE run = ? AND status = 'ok' ORDER BY finished_at", (run_id,)).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def failures(self, run_id):
+        """symbol -> error of the run's failed symbols."""
+        with self.lock:
+            rows = self.conn.execute("SELECT symbol, error FROM results WHERE run = ? AND status = 'failed'", (run_id,)).fetchall()
+        return dict(rows)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_worker(queue_path,
+            run_id=None,
+            worker_id=None,
+            lease_seconds=600,
+            workers=8,
+            rate=2.0,
+            cpu_workers=None,
+            cache_dir=None,
+            offline=False,
+            replay=None,
+            poll=5.0,
+            wait=True):
+    """Work through the shards of a WorkQueue until there are none left, then return the number of shards done.
+
+    Every shard goes through SymbolScraping.enrich_symbols (the fetch_stock_data metrics, batched downloads) with this
+    worker's own FetchScheduler of workers threads / rate requests per second, so each worker process or host brings its
+    own rate limit budget. The lease is renewed every lease_seconds / 3 while the shard runs. With wait the worker keeps
+    polling while other workers hold leases, to take over the shards of the ones that die.
+
+    cache_dir: PriceCache directory (price_cache.sqlite), shared by the workers of a host
+    replay: data_sources.ReplaySource keyword arguments to run offline, e.g. {'latency': 0.05}
+    """
+    from SymbolScraping import enrich_symbols
+
+    if replay is not None:
+        from data_sources import ReplaySource, set_source
+        set_source(ReplaySource(**replay))
+    cache = None
+    if cache_dir is not None:
+        from price_cache import PriceCache
+        os.makedirs(cache_dir, exist_ok=True)
+        cache = PriceCache(os.path.join(cache_dir, "price_cache.sqlite"), offline=offline)
+
+    worker_id = worker_id or default_worker_id()
+    queue = WorkQueue(queue_path)
+    started = default_telemetry.snapshot()
+    shards_done = 0
+    try:
+        while True:
+            claimed = queue.claim(worker_id, lease_seconds, run_id)
+            if claimed is None:
+                if not wait or queue.idle(run_id):
+                    break
+                time.sleep(poll)
+                continue
+
+            shard_run, shard, symbols = claimed
+            config = queue.run_config(shard_run)
+            print(f"[{worker_id}] Shard {shard} of run {shard_run}: {len(symbols)} symbols")
+
+            stop_renewing = threading.Event()
+
+            def renew():
+                while not stop_renewing.wait(lease_seconds / 3):
+                    if not queue.renew(shard_run, shard, worker_id, lease_seconds):
+                        print(f"[{worker_id}] Lost the lease of shard {shard}, another worker took it over.")
+                        return
+
+            renewer = threading.Thread(target=renew, daemon=True, name=f"lease-{shard}")
+            renewer.start()
+            results, failures = {}, {}
+            try:
+                enrich_symbols(symbols, config['start_date'], config['end_date'],
+                               chunk_size=config['chunk_size'],
+                               cache=cache,
+                               workers=workers,
+                               rate=rate,
+                               on_result=results.__setitem__,
+                               on_error=lambda symbol, error: failures.__setitem__(symbol, str(error)),
+                               cpu_workers=cpu_workers,
+                               indicators=config.get('indicators'),
+                               market_index=config['market_index'])
+            except Exception as e:
+                print(f"[{worker_id}] Shard {shard} failed: {e}")
+                queue.release(shard_run, shard, worker_id, e)
+                continue
+            finally:
+                stop_renewing.set()
+                renewer.join()
+
+            for symbol in symbols:
+                if symbol not in results and symbol not in failures:
+                    failures[symbol] = "No result"
+            if queue.complete(shard_run, shard, worker_id, results, failures):
+                shards_done += 1
+            else:
+                print(f"[{worker_id}] Shard {shard} finished after its lease was taken over, results stored.")
+    finally:
+        queue.close()
+        if cache is not None:
+            cache.close()
+
+    print(f"[{worker_id}] Done, {shards_done} shards.")
+    default_telemetry.print_summary(since=started)
+    return shards_done
+
+
+def _worker_process(queue_path, run_id, worker_id, options):
+    run_worker(queue_path, run_id=run_id, worker_id=worker_id, **options)
+
+
+def merge_results(sheet_df, results, result_columns):
+    """The input sheet left merged on Symbol with the result dictionaries, the updated_new_sorting_df of upload symbol script."""
+    results_df = pd.DataFrame(results, columns=result_columns)
+    return sheet_df.merge(results_df, on='Symbol', how='left')
+
+
+def distributed_upload(file_path,
+                    sheetname="SP500",
+                    start_date="2001-01-01",
+                    end_date="2024-12-31",
+                    output_file_path=None,
+                    output_format=None,
+                    queue_path="work_queue.sqlite",
+                    processes=4,
+                    shard_size=100,
+                    lease_seconds=600,
+                    max_attempts=3,
+                    chunk_size=50,
+                    workers=8,
+                    rate=2.0,
+                    cpu_workers=None,
+                    cache_dir=None,
+                    offline=False,
+                    replay=None,
+                    indicators=None,
+                    market_index='^GSPC',
+                    poll=2.0,
+                    max_restarts=3):
+    """Coordinator of a sharded upload symbol script: queue the sheet's symbols in a WorkQueue at queue_path, start
+    processes local worker processes (run_worker), wait for every shard to be done or failed and write the merged sheet.
+
+    Workers on other hosts join the same run with `python cli.py worker --queue <queue_path>` (the queue file on a
+    shared filesystem), processes=0 only coordinates. Local workers that exit while shards are left are restarted up to
+    max_restarts times each (a worker crashing at startup would otherwise respawn forever), a RuntimeError is raised
+    once every local worker is out of restarts and no shard is leased. A worker that dies mid-shard loses its lease
+    after lease_seconds and the shard goes to the next worker.
+    Every worker has its own rate requests per second budget, so set rate to the per-host budget divided by the workers
+    running on that host. Returns the updated dataframe.
+    """
+    from SymbolScraping import RESULT_COLUMNS, indicator_columns, result_dtypes
+
+    new_sorting_df = pd.read_excel(file_path, sheet_name=sheetname)
+    symbols = list(new_sorting_df['Symbol'].dropna().unique())
+    config = {'start_date': start_date, 'end_date': end_date, 'chunk_size': chunk_size,
+              'indicators': indicators, 'market_index': market_index}
+
+    queue = WorkQueue(queue_path)
+    run_id = queue.create_run(symbols, config, shard_size=shard_size, max_attempts=max_attempts)
+    print(f"Run {run_id}: {len(symbols)} symbols in {queue.progress(run_id)['shards']} shards, queue {queue_path}")
+
+    options = {'lease_seconds': lease_seconds, 'workers': workers, 'rate': rate, 'cpu_workers': cpu_workers,
+               'cache_dir': cache_dir, 'offline': offline, 'replay': replay, 'poll': poll}
+    context = multiprocessing.get_context('spawn')
+    hostname = socket.gethostname()
+
+    def start(i):
+        process = context.Process(target=_worker_process, args=(queue_path, run_id, f"{hostname}:local-{i}", options),
+                                  name=f"worker-{i}")
+        process.start()
+        return process
+
+    started = time.time()
+    pool = [start(i) for i in range(processes)]
+    restarts = [0] * processes
+    last_line = None
+    try:
+        while not queue.finished(run_id):
+            time.sleep(poll)
+            for i, process in enumerate(pool):
+                if process.is_alive() or restarts[i] > max_restarts or queue.idle(run_id):
+                    continue
+                restarts[i] += 1
+                if restarts[i] > max_restarts:
+                    print(f"Worker {i} exited (code {process.exitcode}) {max_restarts + 1} times, not restarting it.")
+                    continue
+                print(f"Worker {i} exited (code {process.exitcode}) with shards left, restarting it.")
+                pool[i] = start(i)
+            progress = queue.progress(run_id)
+            if pool and all(count > max_restarts for count in restarts) and progress['leased'] == 0:
+                raise RuntimeError(f"Every local worker of run {run_id} died {max_restarts + 1} times, "
+                                   f"{progress['pending']} shards left (the queue keeps them for a later worker)")
+            line = (f"{progress['done']}/{progress['shards']} shards done ({progress['leased']} running, "
+                    f"{progress['failed']} failed), {progress['ok_symbols']}/{progress['symbols']} symbols")
+            if line != last_line:
+                elapsed = time.time() - started
+                print(f"{line}, {progress['ok_symbols'] / elapsed:.1f} symbols/s")
+                last_line = line
+    finally:
+        # The workers exit by themselves once the queue is idle (within their poll interval)
+        for process in pool:
+            process.join(timeout=60)
+            if process.is_alive():
+                process.terminate()
+
+    result_columns = RESULT_COLUMNS + indicator_columns(indicators)
+    updated_new_sorting_df = merge_results(new_sorting_df, queue.results(run_id), result_columns)
+    failed = queue.failures(run_id)
+    queue.close()
+    if failed:
+        print(f"{len(failed)} symbols failed: {', '.join(sorted(failed))}")
+
+    if output_file_path is not None:
+        dtypes = {**column_kinds(new_sorting_df), **result_dtypes(result_columns)}
+        with open_writer(output_file_path, updated_new_sorting_df.columns, file_format=output_format, sheet_name=sheetname,
+                         dtypes=dtypes) as writer:
+            writer.write_frame(updated_new_sorting_df)
+        print(f"Updated file saved to {output_file_path}")
+    print(f"Run {run_id} took {time.time() - started:.1f}s")
+    return updated_new_sorting_df
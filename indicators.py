@@ -0,0 +1,334 @@
+import math
+import pickle
+from collections import deque
+
+import pandas as pd
+
+from market_benchmarks import Benchmark
+
+TRADING_DAYS = 252
+
+
+class SMA:
+    """Simple moving average of the last window closes (running sum, O(1) per bar)."""
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+
+    def update(self, close, market_return=None):
+        self.values.append(close)
+        self.total += close
+        if len(self.values) > self.window:
+            self.total -= self.values.popleft()
+
+    @property
+    def value(self):
+        return self.total / self.window if len(self.values) == self.window else math.nan
+
+
+class EMA:
+    """Exponential moving average (same as pandas ewm(span=span, adjust=False))."""
+
+    def __init__(self, span):
+        self.span = span
+        self.alpha = 2 / (span + 1)
+        self.current = math.nan
+
+    def update(self, close, market_return=None):
+        self.current = close if math.isnan(self.current) else self.alpha * close + (1 - self.alpha) * self.current
+
+    @property
+    def value(self):
+        return self.current
+
+
+class _RollingReturns:
+    """Keeps the last window daily returns (and their running sums) from the closes it's fed."""
+
+    def __init__(self, window):
+        self.window = window
+        self.previous = None
+        self.returns = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def _push(self, close):
+        if self.previous is None or self.previous == 0:
+            self.previous = close
+            return None
+        daily_return = close / self.previous - 1
+        self.previous = close
+        self.returns.append(daily_return)
+        self.total += daily_return
+        self.total_sq += daily_return * daily_return
+        if len(self.returns) > self.window:
+            old = self.returns.popleft()
+            self.total -= old
+            self.total_sq -= old * old
+        return daily_return
+
+    def _std(self):
+        n = len(self.returns)
+        if n < self.window or n < 2:
+            return math.nan
+        variance = (self.total_sq - self.total * self.total / n) / (n - 1)
+        return math.sqrt(max(variance, 0.0))
+
+
+class RollingVolatility(_RollingReturns):
+    """Annualized standard deviation of the last window daily returns."""
+
+    def update(self, close, market_return=None):
+        self._push(close)
+
+    @property
+    def value(self):
+        return self._std() * math.sqrt(TRADING_DAYS)
+
+
+class RollingSharpe(_RollingReturns):
+    """Annualized Sharpe ratio of the last window daily returns (same formula as the Sharpe Ratio column)."""
+
+    def __init__(self, window, risk_free_rate=0.02):
+        super().__init__(window)
+        self.daily_risk_free = risk_free_rate / TRADING_DAYS
+
+    def update(self, close, market_return=None):
+        self._push(close)
+
+    @property
+    def value(self):
+        std = self._std()
+        if math.isnan(std) or std == 0:
+            return math.nan
+        return (self.total / len(self.returns) - self.daily_risk_free) / std * math.sqrt(TRADING_DAYS)
+
+
+class RollingBeta:
+    """Beta against the market over the last window days where both the stock and the market have a return."""
+
+    def __init__(self, window):
+        self.window = window
+        self.previous = None
+        self.pairs = deque()
+        self.sx = self.sy = self.sxy = self.syy = 0.0
+
+    def update(self, close, market_return=None):
+        previous, self.previous = self.previous, close
+        if previous is None or previous == 0 or market_return is None or math.isnan(market_return):
+            return
+        x, y = close / previous - 1, market_return
+        self.pairs.append((x, y))
+        self.sx += x
+        self.sy += y
+        self.sxy += x * y
+        self.syy += y * y
+        if len(self.pairs) > self.window:
+            ox, oy = self.pairs.popleft()
+            self.sx -= ox
+            self.sy -= oy
+            self.sxy -= ox * oy
+            self.syy -= oy * oy
+
+    @property
+    def value(self):
+        n = len(self.pairs)
+        if n < self.window:
+            return math.nan
+        market_var = self.syy - self.sy * self.sy / n
+        if market_var <= 0:
+            return math.nan
+        return (self.sxy - self.sx * self.sy / n) / market_var
+
+
+class RollingMax:
+    """Max of the last window values with a monotonic deque (amortized O(1) per bar)."""
+
+    def __init__(self, window):
+        self.window = window
+        self.count = 0
+        self.candidates = deque()  # (bar number, value) with decreasing values
+
+    def update(self, value, market_return=None):
+        while self.candidates and self.candidates[-1][1] <= value:
+            self.candidates.pop()
+        self.candidates.append((self.count, value))
+        if self.candidates[0][0] <= self.count - self.window:
+            self.candidates.popleft()
+        self.count += 1
+
+    @property
+    def value(self):
+        return self.candidates[0][1] if self.candidates else math.nan
+
+
+class RollingDrawdown:
+    """Drawdown of the latest close from the highest close of the last window bars."""
+
+    def __init__(self, window):
+        self.high = RollingMax(window)
+        self.last = math.nan
+
+    def update(self, close, market_return=None):
+        self.high.update(close)
+        self.last = close
+
+    @property
+    def value(self):
+        return (self.last - self.high.value) / self.high.value if self.high.value else math.nan
+
+
+class Drawdown:
+    """Full history drawdown: current / max drawdown and current / longest duration (bars spent below the previous peak)."""
+
+    def __init__(self):
+        self.peak = -math.inf
+        self.current = 0.0
+        self.max_drawdown = 0.0
+        self.duration = 0
+        self.max_duration = 0
+
+    def update(self, close, market_return=None):
+        if close >= self.peak:
+            self.peak = close
+            self.duration = 0
+        else:
+            self.duration += 1
+        self.current = (close - self.peak) / self.peak if self.peak else 0.0
+        self.max_drawdown = min(self.max_drawdown, self.current)
+        self.max_duration = max(self.max_duration, self.duration)
+
+    @property
+    def value(self):
+        return {
+            'Drawdown': self.current,
+            'Max Drawdown': self.max_drawdown,
+            'Drawdown Duration': self.duration,
+            'Max Drawdown Duration': self.max_duration,
+        }
+
+
+INDICATORS = {
+    'sma': ('SMA', SMA),
+    'ema': ('EMA', EMA),
+    'volatility': ('Volatility', RollingVolatility),
+    'beta': ('Beta', RollingBeta),
+    'sharpe': ('Sharpe', RollingSharpe),
+    'drawdown': ('Drawdown', RollingDrawdown),
+}
+
+DEFAULT_CONFIG = {'sma': (50, 200), 'ema': (12, 26), 'volatility': (20,), 'beta': (60,), 'sharpe': (252,)}
+
+
+class IndicatorSet:
+    """A user selected set of indicators, e.g. IndicatorSet({'sma': (20, 50), 'beta': (60,)}), plus the full history
+    Drawdown. Bars are fed one at a time and remembered by date, so update_frame() only processes the bars after the last
+    one it has seen: a daily refresh costs time proportional to the new bars. The whole set pickles (to_bytes) so the
+    state can be persisted between runs (PriceCache.save_indicator_state).
+    """
+
+    def __init__(self, config=None):
+        self.config = {name: tuple(windows) for name, windows in (config or DEFAULT_CONFIG).items()}
+        unknown = set(self.config) - set(INDICATORS)
+        if unknown:
+            raise ValueError(f"Unknown indicators: {', '.join(sorted(unknown))}")
+        self.indicators = {}
+        for name, windows in self.config.items():
+            label, cls = INDICATORS[name]
+            for window in windows:
+                self.indicators[f"{label} {window}"] = cls(window)
+        self.drawdown = Drawdown()
+        self.last_date = None
+        self.last_close = None
+
+    @property
+    def key(self):
+        """Identifies the configuration (a stored state is only reused for the same window sets)."""
+        return ";".join(f"{name}={','.join(map(str, windows))}" for name, windows in sorted(self.config.items()))
+
+    def columns(self):
+        return list(self.indicators) + list(self.drawdown.value)
+
+    def update(self, close, market_return=None):
+        for indicator in self.indicators.values():
+            indicator.update(close, market_return)
+        self.drawdown.update(close)
+
+    def update_frame(self, hist, market_returns=None):
+        """Feed the Close column of a history dataframe, skipping the bars up to the last one already processed.
+        Returns the number of new bars.
+        """
+        closes = hist['Close'].dropna()
+        if self.last_date is not None:
+            closes = closes[closes.index > self.last_date]
+        if closes.empty:
+            return 0
+
+        market = None
+        if isinstance(market_returns, Benchmark):
+            market = market_returns.aligned(closes.index)
+        elif market_returns is not None:
+            market = pd.Series(market_returns.squeeze()).reindex(closes.index).to_numpy(dtype=float)
+        for i, (date, close) in enumerate(closes.items()):
+            self.update(float(close), None if market is None else float(market[i]))
+        self.last_date = closes.index[-1]
+        self.last_close = float(closes.iloc[-1])
+        return len(closes)
+
+    def continues(self, closes):
+        """Whether this state can be carried on with a closes series: the series still has the state's last bar, with the
+        same close. A range ending before it, or a revised / split adjusted close, means starting over.
+        """
+        if self.last_date is None:
+            return True
+        if self.last_date not in closes.index or self.last_close is None:
+            return False
+        return math.isclose(float(closes[self.last_date]), self.last_close, rel_tol=1e-9)
+
+    def values(self):
+        values = {name: indicator.value for name, indicator in self.indicators.items()}
+        values.update(self.drawdown.value)
+        return values
+
+    def to_bytes(self):
+        return pickle.dumps(self)
+
+    @staticmethod
+    def from_bytes(data):
+        return pickle.loads(data)
+
+
+def incremental_indicators(symbol, hist, market_returns=None, config=None, cache=None, state_key=""):
+    """Indicator values of a symbol at its last bar. With a PriceCache the IndicatorSet state is loaded, only fed the bars
+    newer than the stored state and saved back. state_key separates states built over different ranges (pass the start date),
+    the benchmark ticker is part of the stored key too since Beta's running sums depend on the market returns.
+
+    The state is saved one bar behind the history: the last bar may be an intraday one the next cache refresh rewrites,
+    so it's fed after the save and the next run feeds it again with its final close. A stored state that doesn't
+    continue the history (see IndicatorSet.continues) is rebuilt from scratch.
+    """
+    indicator_set = IndicatorSet(config)
+    key = f"{indicator_set.key}|{state_key}|{_benchmark_key(market_returns)}"
+    hist = hist[hist['Close'].notna()]
+    if cache is not None:
+        stored = cache.load_indicator_state(symbol, key)
+        if stored is not None:
+            state = IndicatorSet.from_bytes(stored)
+            if state.continues(hist['Close']):
+                indicator_set = state
+
+    indicator_set.update_frame(hist.iloc[:-1], market_returns)
+    if cache is not None and indicator_set.last_date is not None:
+        cache.save_indicator_state(symbol, key, indicator_set.to_bytes(), indicator_set.last_date)
+    indicator_set.update_frame(hist.iloc[-1:], market_returns)
+    return indicator_set.values()
+
+
+def _benchmark_key(market_returns):
+    """Name of the benchmark behind market_returns: the Benchmark ticker, else the series name ('' without one)."""
+    if isinstance(market_returns, Benchmark):
+        return market_returns.ticker
+    name = getattr(market_returns, 'name', None)
+    return "" if name is None else str(name)
@@ -0,0 +1,202 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import SymbolScraping
+from journal import RunJournal
+from market_benchmarks import benchmark_for
+from telemetry import default_telemetry
+from universe import fetch_universe
+from writers import open_writer
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class Job:
+    """One bulk enrichment request: the symbols (or index) to score and the per-symbol progress of the run."""
+
+    def __init__(self, symbols=None, index_name=None, start_date="2001-01-01", end_date="2024-12-31"):
+        self.id = uuid.uuid4().hex[:12]
+        self.symbols = list(symbols or [])
+        self.index_name = index_name
+        self.start_date = start_date
+        self.end_date = end_date
+        self.status = 'queued'
+        self.error = None
+        self.symbol_status = {symbol: 'pending' for symbol in self.symbols}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.journal = None
+        self.results = []
+        self.telemetry = None
+        self.lock = threading.Lock()
+
+    def set_symbol_status(self, symbol, status):
+        with self.lock:
+            self.symbol_status[symbol] = status
+
+    def to_dict(self, details=True):
+        with self.lock:
+            counts = {}
+            for status in self.symbol_status.values():
+                counts[status] = counts.get(status, 0) + 1
+            job = {
+                'id': self.id,
+                'status': self.status,
+                'error': self.error,
+                'index': self.index_name,
+                'start_date': self.start_date,
+                'end_date': self.end_date,
+                'total': len(self.symbol_status),
+                'done': counts.get('done', 0),
+                'failed': counts.get('failed', 0),
+                'pending': counts.get('pending', 0),
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'telemetry': self.telemetry,
+            }
+            if details:
+                job['symbols'] = dict(self.symbol_status)
+        return job
+
+
+class JobManager:
+    """Runs enrichment jobs on a background pool so HTTP request threads never fetch anything themselves.
+
+    max_jobs: jobs running at the same time (each job parallelizes its own symbols with workers threads)
+    jobs_dir: every job journals its finished symbols there (jobs_dir/<id>.jsonl)
+    keep_jobs / job_ttl_hours: finished jobs (and their journal) are dropped once there are more than keep_jobs of them
+    or they finished more than job_ttl_hours ago, queued and running jobs are always kept
+    """
+
+    def __init__(self, max_jobs=2, workers=8, rate=2.0, cache=None, jobs_dir="jobs", keep_jobs=100, job_ttl_hours=24):
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="enrich-job")
+        self.workers = workers
+        self.rate = rate
+        self.cache = cache
+        self.jobs_dir = jobs_dir
+        self.keep_jobs = keep_jobs
+        self.job_ttl_hours = job_ttl_hours
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, symbols=None, index_name=None, start_date="2001-01-01", end_date="2024-12-31"):
+        """Queue a job for a symbol list or an index name from index_info and return it right away.
+        index_name can list several indices separated by commas, their members are merged and every symbol scored once.
+        """
+        if not symbols and not index_name:
+            raise ValueError("Either symbols or an index name is required.")
+        for name in _index_names(index_name):
+            if name not in SymbolScraping.index_info:
+                raise ValueError(f"Index '{name}' is not supported.")
+
+        self.prune()
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        job = Job(symbols, index_name, start_date, end_date)
+        job.journal = RunJournal(os.path.join(self.jobs_dir, f"{job.id}.jsonl"))
+        with self.lock:
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        self.prune()
+        with self.lock:
+            return list(self.jobs.values())
+
+    def prune(self):
+        """Forget the finished jobs past keep_jobs or job_ttl_hours and delete their journal files."""
+        expire_before = time.time() - self.job_ttl_hours * 3600
+        with self.lock:
+            finished = sorted((job for job in self.jobs.values() if job.finished_at is not None),
+                              key=lambda job: job.finished_at, reverse=True)
+            expired = [job for i, job in enumerate(finished) if i >= self.keep_jobs or job.finished_at < expire_before]
+            for job in expired:
+                del self.jobs[job.id]
+        for job in expired:
+            if job.journal is not None and os.path.exists(job.journal.path):
+                os.remove(job.journal.path)
+
+    def _run(self, job):
+        with job.lock:
+            job.status = 'running'
+            job.started_at = time.time()
+        run_started = default_telemetry.snapshot()
+        try:
+            index_names = _index_names(job.index_name)
+            if index_names and not job.symbols:
+                # Overlapping indices (S&P 500 / NASDAQ 100 / Dow) share their members, each symbol is fetched once
+                universe = fetch_universe(index_names, index_info=SymbolScraping.index_info)
+                if not len(universe):
+                    raise RuntimeError(f"Could not fetch constituents for {job.index_name}.")
+                job.symbols = universe.symbols
+                with job.lock:
+                    job.symbol_status = {symbol: 'pending' for symbol in job.symbols}
+
+            def on_result(symbol, data):
+                job.journal.record_result(symbol, data)
+                job.set_symbol_status(symbol, 'done')
+
+            def on_error(symbol, error):
+                job.journal.record_failure(symbol, error)
+                job.set_symbol_status(symbol, 'failed')
+
+            SymbolScraping.enrich_symbols(job.symbols, job.start_date, job.end_date, cache=self.cache,
+                                        workers=self.workers, rate=self.rate, on_result=on_result, on_error=on_error,
+                                        market_index=benchmark_for(index_name=index_names[0] if len(index_names) == 1 else None))
+            with job.lock:
+                for symbol, status in job.symbol_status.items():
+                    if status == 'pending':
+                        job.symbol_status[symbol] = 'failed'
+            results = job.journal.results()
+            with job.lock:
+                job.results = results
+                job.status = 'done'
+        except Exception as e:
+            with job.lock:
+                job.error = str(e)
+                job.status = 'failed'
+        finally:
+            # Process wide counters, jobs running at the same time show up in each other's summary
+            telemetry = default_telemetry.summary(since=run_started)
+            with job.lock:
+                job.telemetry = telemetry
+                job.finished_at = time.time()
+
+    def export(self, job, file_format='csv'):
+        """Serialize the results of a finished job, returns (bytes, mimetype)."""
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported format '{file_format}', use one of {', '.join(EXPORT_FORMATS)}.")
+        columns = SymbolScraping.RESULT_COLUMNS
+        results_df = pd.DataFrame(job.results, columns=columns)
+        # Same writers (and column types) as the file output, the file is only a scratch copy of the response body
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"{job.id}.{file_format}")
+            with open_writer(path, columns, file_format=file_format, sheet_name="Results",
+                             dtypes=SymbolScraping.result_dtypes(columns)) as writer:
+                writer.write_frame(results_df)
+            with open(path, 'rb') as f:
+                return f.read(), EXPORT_FORMATS[file_format]
+
+
+def _index_names(index_name):
+    """"S&P 500, NASDAQ 100" -> ['S&P 500', 'NASDAQ 100']."""
+    if not index_name:
+        return []
+    names = index_name if isinstance(index_name, (list, tuple)) else str(index_name).split(',')
+    return [name.strip() for name in names if name.strip()]
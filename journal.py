@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class RunJournal:
+    """Append only JSONL journal of a bulk run, one line per finished symbol:
+
+        {"run": {"sheet": "SP500", "start_date": "2001-01-01", ...}, "time": ...}
+        {"symbol": "AAPL", "status": "ok", "data": {...fetch_stock_data result...}, "time": ...}
+        {"symbol": "XYZ", "status": "failed", "error": "...", "time": ...}
+
+    Every line is flushed and fsync'd as soon as the symbol finishes, so a crashed run can be restarted and only the
+    symbols that aren't in the journal yet are fetched again. The last line of a symbol wins (a successful retry
+    replaces an earlier failure).
+
+    run is a dictionary of the parameters the results depend on (sheet, dates, indicators, benchmark...), written as the
+    header line of a new journal. Opening an existing journal with a different run raises a ValueError instead of
+    mixing the results of two runs.
+    """
+
+    def __init__(self, path, run=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        # Compared as they read back from the file (tuples become lists)
+        self.run = json.loads(json.dumps(run, default=_json_default)) if run is not None else None
+        header = self._load() if os.path.exists(path) else None
+        if self.run is None:
+            return
+        if header is None and not self.entries:
+            self._write({'run': self.run, 'time': time.time()})
+        elif header != self.run:
+            raise ValueError(f"Journal {path} was written for another run ({_run_differences(header, self.run)}), "
+                             f"use a new journal or delete it.")
+
+    def _load(self):
+        """Read the entries, return the run header (None without one)."""
+        header = None
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        for line in content.decode('utf-8', errors='replace').splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash in the middle of a write leaves a partial last line, that symbol just gets fetched again
+                continue
+            if 'run' in entry:
+                header = entry['run']
+            else:
+                self.entries[entry['symbol']] = entry
+        if content and not content.endswith(b"\n"):
+            # Cut the partial line off, the next entry would be appended to it and be unreadable too
+            with open(self.path, 'r+b') as f:
+                f.truncate(content.rfind(b"\n") + 1)
+        return header
+
+    def _write(self, entry):
+        line = json.dumps(entry, default=_json_default)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append(self, entry):
+        with self.lock:
+            self._write(entry)
+            self.entries[entry['symbol']] = entry
+
+    def record_result(self, symbol, data):
+        self._append({'symbol': symbol, 'status': 'ok', 'data': data, 'time': time.time()})
+
+    def record_failure(self, symbol, error):
+        self._append({'symbol': symbol, 'status': 'failed', 'error': str(error), 'time': time.time()})
+
+    def completed(self):
+        """Symbols that already have a result."""
+        return {symbol for symbol, entry in self.entries.items() if entry['status'] == 'ok'}
+
+    def failed(self):
+        """symbol -> error message of the symbols whose last attempt failed."""
+        return {symbol: entry['error'] for symbol, entry in self.entries.items() if entry['status'] == 'failed'}
+
+    def results(self):
+        """Result dictionaries of every completed symbol, in the order they finished."""
+        return [entry['data'] for entry in self.entries.values() if entry['status'] == 'ok']
+
+    def pending(self, symbols, retry_failed=True):
+        """The symbols of a run that still have to be fetched. Failed symbols are included unless retry_failed is False."""
+        done = self.completed()
+        if not retry_failed:
+            done |= set(self.failed())
+        return [symbol for symbol in symbols if symbol not in done]
+
+
+def _run_differences(header, run):
+    if header is None:
+        return "no run header"
+    keys = sorted(set(header) | set(run))
+    return ", ".join(f"{key}: {header.get(key)!r} != {run.get(key)!r}" for key in keys if header.get(key) != run.get(key))
+
+
+def _json_default(value):
+    """numpy scalars (np.int64 volumes, np.bool_ flags...) aren't JSON serializable as is."""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -0,0 +1,191 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from data_sources import get_source
+from telemetry import cache_result, stage
+
+# Benchmark used for the correlation column of each index in index_info
+INDEX_BENCHMARKS = {
+    "S&P 500": "^GSPC",
+    "Dow Jones": "^GSPC",
+    "NASDAQ 100": "^NDX",
+    "Russell 2000": "^GSPC",
+    "FTSE 100": "^FTSE",
+    "DAX": "^GDAXI",
+}
+
+# Exchange suffix of a YFinance ticker -> benchmark, for symbols that aren't looked up through an index
+SUFFIX_BENCHMARKS = {
+    ".L": "^FTSE",
+    ".DE": "^GDAXI",
+}
+
+DEFAULT_BENCHMARK = "^GSPC"
+
+
+def benchmark_for(symbol=None, index_name=None):
+    """Pick the benchmark of a symbol: the one of its index_info index when known, else from the exchange suffix
+    (VOD.L -> ^FTSE, SAP.DE -> ^GDAXI), else the S&P 500.
+    """
+    if index_name in INDEX_BENCHMARKS:
+        return INDEX_BENCHMARKS[index_name]
+    if symbol:
+        for suffix, ticker in SUFFIX_BENCHMARKS.items():
+            if str(symbol).upper().endswith(suffix.upper()):
+                return ticker
+    return DEFAULT_BENCHMARK
+
+
+class Benchmark:
+    """Daily returns of a benchmark over one date range, kept both as a series and as NumPy arrays on the benchmark's
+    trading calendar so lining up a symbol is an index lookup. This is what load_market_returns hands to the metrics code
+    as market_returns: market_correlation, metrics and indicators read the arrays instead of converting the series again.
+    """
+
+    def __init__(self, ticker, close):
+        self.ticker = ticker
+        self.returns = close.pct_change().dropna()
+        self.returns.name = ticker
+        self.dates = self.returns.index
+        self.values = self.returns.to_numpy(dtype=float)
+
+    def aligned(self, dates):
+        """Benchmark returns on the given dates (NaN where the benchmark didn't trade)."""
+        positions = self.dates.get_indexer(pd.DatetimeIndex(dates))
+        return np.where(positions >= 0, self.values[positions], np.nan)
+
+
+def market_correlation(stock_returns, market_returns):
+    """Pearson correlation of a daily returns series with the market over the days both have a return, same value as
+    the pd.DataFrame({'Stock': ..., 'Market': ...}).dropna() + corr() it replaces. market_returns is a Benchmark or
+    a returns series.
+    """
+    if not isinstance(market_returns, Benchmark):
+        market_returns = _as_series(market_returns)
+        dates, values = market_returns.index, market_returns.to_numpy(dtype=float)
+    else:
+        dates, values = market_returns.dates, market_returns.values
+
+    stock = _as_series(stock_returns)
+    positions = dates.get_indexer(stock.index)
+    found = positions >= 0
+    x = stock.to_numpy(dtype=float)[found]
+    y = values[positions[found]]
+    both = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[both], y[both]
+    if len(x) < 2:
+        return np.nan
+    x = x - x.mean()
+    y = y - y.mean()
+    denominator = np.sqrt(np.dot(x, x) * np.dot(y, y))
+    return np.dot(x, y) / denominator if denominator else np.nan
+
+
+def _as_series(returns):
+    if isinstance(returns, pd.DataFrame):
+        returns = returns.iloc[:, 0]
+    if getattr(returns.index, 'tz', None) is not None:
+        returns = returns.tz_localize(None)
+    return returns
+
+
+class BenchmarkRegistry:
+    """Process wide store of benchmark prices. Each ticker is downloaded once (widened when a later request needs more
+    dates) and every date range gets its own Benchmark, built once and then shared by every run, GUI click and Flask
+    request of the process.
+
+    The GUI, the Flask app and the JobManager live for days, so both are reloaded once they're older than ttl_hours
+    (the PriceCache's ttl_hours when the request passes one) and at most max_benchmarks date ranges are kept, the least
+    recently used one is dropped first.
+    """
+
+    def __init__(self, ttl_hours=12, max_benchmarks=32):
+        self.ttl_hours = ttl_hours
+        self.max_benchmarks = max_benchmarks
+        self.closes = {}  # ticker -> (start, end, close series, loaded_at)
+        self.benchmarks = OrderedDict()  # (ticker, start, end) -> (Benchmark, loaded_at)
+        self.lock = threading.Lock()
+        self.ticker_locks = {}
+
+    def get(self, ticker, start_date, end_date, cache=None, fetch=None):
+        """Benchmark of ticker over [start_date, end_date). With a PriceCache the prices are read through it, fetch is
+        the history function it uses for the missing bars (SymbolScraping.yf_history).
+        """
+        start, end = pd.to_datetime(start_date), pd.to_datetime(end_date)
+        key = (ticker, start, end)
+        ttl_hours = cache.ttl_hours if cache is not None else self.ttl_hours
+        with self.lock:
+            benchmark = self._lookup(key, ttl_hours)
+            ticker_lock = self.ticker_locks.setdefault(ticker, threading.Lock())
+        cache_result('benchmarks', hit=benchmark is not None)
+        if benchmark is not None:
+            return benchmark
+
+        # One download per ticker at a time, concurrent requests for the same benchmark wait for it
+        with ticker_lock:
+            with self.lock:
+                benchmark = self._lookup(key, ttl_hours)
+            if benchmark is not None:
+                return benchmark
+            close, loaded_at = self._close(ticker, start, end, cache, fetch, ttl_hours)
+            benchmark = Benchmark(ticker, close[(close.index >= start) & (close.index < end)])
+            with self.lock:
+                self.benchmarks[key] = (benchmark, loaded_at)
+                self.benchmarks.move_to_end(key)
+                while len(self.benchmarks) > self.max_benchmarks:
+                    self.benchmarks.popitem(last=False)
+        return benchmark
+
+    def clear(self):
+        with self.lock:
+            self.closes.clear()
+            self.benchmarks.clear()
+
+    def _lookup(self, key, ttl_hours):
+        """The stored Benchmark of key (marked as just used), None if there is none or it's expired."""
+        entry = self.benchmarks.get(key)
+        if entry is None:
+            return None
+        if _expired(entry[1], ttl_hours):
+            del self.benchmarks[key]
+            return None
+        self.benchmarks.move_to_end(key)
+        return entry[0]
+
+    def _close(self, ticker, start, end, cache, fetch, ttl_hours):
+        """Close series of ticker covering [start, end) and when it was loaded."""
+        loaded = self.closes.get(ticker)
+        if loaded is not None and _expired(loaded[3], ttl_hours):
+            loaded = None
+        if loaded is not None and loaded[0] <= start and loaded[1] >= end:
+            return loaded[2], loaded[3]
+        if loaded is not None:
+            start, end = min(start, loaded[0]), max(end, loaded[1])
+
+        print(f"Loading benchmark {ticker} {start.date()} / {end.date()}")
+        start_date, end_date = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+        if cache is not None:
+            data = cache.get_history(ticker, start_date, end_date, fetch=fetch)
+        else:
+            with stage('range_fetch'):
+                data = get_source().history(ticker, start_date, end_date)
+        close = _as_series(data['Close']).astype(float).sort_index()
+        loaded_at = time.time()
+        self.closes[ticker] = (start, end, close, loaded_at)
+        return close, loaded_at
+
+
+def _expired(loaded_at, ttl_hours):
+    return time.time() - loaded_at > ttl_hours * 3600
+
+
+# Process wide instance shared by SymbolScraping, the GUI and the Flask app
+default_registry = BenchmarkRegistry()
+
+
+def get_benchmark(ticker, start_date, end_date, cache=None, fetch=None):
+    return default_registry.get(ticker, start_date, end_date, cache=cache, fetch=fetch)
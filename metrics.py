@@ -0,0 +1,175 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+from market_benchmarks import Benchmark
+
+# Same constants fetch_stock_data / compute_stock_metrics use
+RISK_FREE_RATE = 0.02
+TRADING_DAYS = 252
+
+# Price derived columns, in the order compute_stock_metrics returns them
+METRIC_COLUMNS = [
+    'Total Volume', 'Average Yearly Volume', 'Correlation with Market', 'SMA 50', 'SMA 200',
+    'Max Drawdown', 'Sharpe Ratio', 'Incomplete Data', 'Data Range', 'First Trading Date', 'Historical Range'
+]
+
+
+def compute_metrics_matrix(close,
+                        volume,
+                        market_returns,
+                        start_date,
+                        end_date,
+                        first_trading_dates=None):
+    """Compute the compute_stock_metrics price columns for every symbol of a date x symbol close matrix in one pass.
+
+    close / volume: date x symbol dataframes (NaN where the symbol has no bar), usually the full histories
+    market_returns: daily market returns (market_benchmarks.Benchmark, series or single column dataframe)
+    first_trading_dates: symbol -> first trading date, defaults to the first non NaN close of every column
+
+    Each symbol is masked to [max(start_date, first trading date), end_date) before anything is computed, so the
+    result matches fetch_stock_data symbol by symbol. Returns a dataframe indexed by symbol with METRIC_COLUMNS.
+    """
+    close = close.sort_index()
+    volume = volume.reindex(index=close.index, columns=close.columns)
+
+    if first_trading_dates is None:
+        first_dates = close.apply(lambda column: column.first_valid_index())
+    else:
+        first_dates = pd.to_datetime(pd.Series(first_trading_dates)).reindex(close.columns)
+
+    return _metrics_block(close.to_numpy(dtype=float), volume.to_numpy(dtype=float), close.index, close.columns,
+                          pd.to_datetime(first_dates), _align_market(market_returns, close.index), start_date, end_date)
+
+
+def compute_metrics_store(store, market_returns, start_date, end_date, block_size=500):
+    """compute_metrics_matrix over a price_store.PriceStore, block_size symbols at a time.
+
+    Only the calendar rows of [start_date, end_date) are read (views of the store arrays, nothing is copied until a block
+    is converted to float64) and the temporaries of one block are freed before the next one, so the peak memory depends
+    on block_size instead of the size of the universe. Same result as compute_metrics_matrix on the full matrices.
+    """
+    rows = store.row_range(start_date, end_date)
+    dates = store.calendar[rows]
+    market = _align_market(market_returns, dates)
+    first_dates = store.first_dates
+
+    results = []
+    for symbols, fields in store.blocks(block_size, start_date, end_date, fields=['Close', 'Volume']):
+        results.append(_metrics_block(np.asarray(fields['Close'], dtype=float), np.asarray(fields['Volume'], dtype=float),
+                                      dates, pd.Index(symbols), first_dates.reindex(symbols), market, start_date, end_date))
+    if not results:
+        return pd.DataFrame(columns=METRIC_COLUMNS, index=pd.Index([], name='Symbol'))
+    return pd.concat(results)
+
+
+def _metrics_block(values, volume, dates, symbols, first_dates, market, start_date, end_date):
+    """The compute_metrics_matrix math on plain arrays: values / volume are dates x symbols, market the market returns
+    already aligned on dates, first_dates a symbol indexed series.
+    """
+    start_dt = pd.to_datetime(start_date)
+    end_dt = pd.to_datetime(end_date)
+    first_dates = pd.Series(pd.to_datetime(first_dates.to_numpy()), index=symbols)
+
+    # Per symbol start date, moved up to the first trading date like fetch_stock_data does
+    starts = first_dates.where(first_dates > start_dt, start_dt)
+
+    date_values = dates.to_numpy()[:, None]
+    in_range = (date_values >= starts.to_numpy()[None, :]) & (date_values < np.datetime64(end_dt))
+    values = np.where(in_range & ~np.isnan(values), values, np.nan)
+    valid = ~np.isnan(values)
+    vol = np.where(valid, volume, np.nan)
+
+    total_volume = np.nansum(vol, axis=0)
+    average_yearly_volume = _nan_reduce(np.nanmean, vol) * TRADING_DAYS
+
+    # Returns against the previous bar of the same symbol (skipping other symbols' trading days), like pct_change on
+    # the symbol's own history
+    previous = pd.DataFrame(values).ffill().shift(1).to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.where(valid, values / previous - 1, np.nan)
+    returns_valid = ~np.isnan(returns)
+
+    # Final value of the 50 / 200 bar rolling means: mean of the last N valid bars, NaN if there are fewer than N
+    bars_from_end = np.cumsum(valid[::-1], axis=0)[::-1]
+    counts = valid.sum(axis=0)
+    sma = {}
+    for window in (50, 200):
+        last_bars = np.where(valid & (bars_from_end <= window), values, np.nan)
+        sma[window] = np.where(counts >= window, _nan_reduce(np.nanmean, last_bars), np.nan)
+
+    running_max = np.fmax.accumulate(np.where(valid, values, -np.inf), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drawdown = np.where(valid, (values - running_max) / running_max, np.nan)
+    max_drawdown = _nan_reduce(np.nanmin, drawdown)
+
+    excess = returns - RISK_FREE_RATE / TRADING_DAYS
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe_ratio = _nan_reduce(np.nanmean, excess) / _nan_reduce(lambda a, axis: np.nanstd(a, axis=axis, ddof=1), excess) * np.sqrt(TRADING_DAYS)
+
+    correlation = _correlation(returns, returns_valid, market)
+
+    # Date range columns, same integer arithmetic as compute_stock_metrics
+    first_days = (end_dt - first_dates).dt.days
+    start_days = (end_dt - starts).dt.days
+    years_diff, months_diff = first_days // 365, first_days % 365 // 30
+    data_years_diff, data_months_diff = start_days // 365, start_days % 365 // 30
+    historical_range = _range_labels(years_diff, months_diff, years_diff)
+    data_range = _range_labels(data_years_diff, data_months_diff, years_diff)
+
+    result = pd.DataFrame({
+        'Total Volume': total_volume,
+        'Average Yearly Volume': average_yearly_volume,
+        'Correlation with Market': correlation,
+        'SMA 50': sma[50],
+        'SMA 200': sma[200],
+        'Max Drawdown': max_drawdown,
+        'Sharpe Ratio': sharpe_ratio,
+        'Incomplete Data': (start_dt > first_dates).to_numpy(),
+        'Data Range': data_range.to_numpy(),
+        'First Trading Date': first_dates.dt.strftime('%Y-%m-%d').to_numpy(),
+        'Historical Range': historical_range.to_numpy(),
+    }, index=pd.Index(symbols, name='Symbol'))
+
+    # Symbols without a single bar in range are skipped by fetch_stock_data, drop them here too
+    return result[counts > 0]
+
+
+def _align_market(market_returns, dates):
+    """Market returns (Benchmark, series or single column dataframe) on the given dates, NaN where the market didn't trade."""
+    if isinstance(market_returns, Benchmark):
+        return market_returns.aligned(dates)
+    market = pd.Series(np.asarray(market_returns, dtype=float).reshape(len(market_returns), -1)[:, 0],
+                       index=pd.DatetimeIndex(market_returns.index))
+    return market.reindex(dates).to_numpy()
+
+
+def _correlation(returns, returns_valid, market):
+    """Pearson correlation of every column with the (aligned) market over the days both have a return."""
+    market = market[:, None]
+    both = returns_valid & ~np.isnan(market)
+    n = both.sum(axis=0)
+
+    x = np.where(both, returns, 0.0)
+    y = np.where(both, market, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = x.sum(axis=0) / n
+        y_mean = y.sum(axis=0) / n
+        dx = np.where(both, x - x_mean, 0.0)
+        dy = np.where(both, y - y_mean, 0.0)
+        correlation = (dx * dy).sum(axis=0) / np.sqrt((dx * dx).sum(axis=0) * (dy * dy).sum(axis=0))
+    return np.where(n > 1, correlation, np.nan)
+
+
+def _nan_reduce(func, array):
+    """Apply a nan-aware numpy reduction over the date axis without the all-NaN column warnings."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return func(array, axis=0)
+
+
+def _range_labels(years, months, years_check):
+    """Vectorized version of the f"{years} years, {months} months" labels (months only when years_check is 0)."""
+    with_years = years.astype(str) + ' years, ' + months.astype(str) + ' months'
+    months_only = months.astype(str) + ' months'
+    return with_years.where(years_check > 0, months_only)
@@ -0,0 +1,128 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from telemetry import record
+
+# Set in every worker process by _init_worker, so the shared arguments (market returns...) are pickled once per process
+# instead of once per symbol
+_compute = None
+_shared_args = ()
+
+
+def _init_worker(compute, shared_args):
+    global _compute, _shared_args
+    _compute = compute
+    _shared_args = shared_args
+
+
+def _run_compute(symbol, payload):
+    # Timed here and recorded by the parent, the worker processes have their own (unexported) telemetry
+    started = time.perf_counter()
+    result = _compute(symbol, *payload, *_shared_args)
+    return result, time.perf_counter() - started
+
+
+def run_pipeline(symbols,
+                fetch,
+                compute,
+                shared_args=(),
+                io_workers=8,
+                cpu_workers=None,
+                queue_size=32,
+                on_result=None,
+                on_error=None):
+    """Two stage producer / consumer pipeline: network I/O on threads, number crunching on a process pool.
+
+    fetch(symbol) runs on io_workers threads and returns a payload tuple (or None when there's nothing to score), the
+    payloads go through a bounded queue of queue_size items so the downloads block (backpressure) when the CPU stage falls
+    behind. compute(symbol, *payload, *shared_args) runs on cpu_workers processes (defaults to the core count) and must be
+    a module level function so it can be pickled, at most 2 * cpu_workers payloads are in flight in the pool.
+
+    Returns a symbol -> result dictionary, on_result(symbol, result) / on_error(symbol, error) are called as each
+    symbol finishes. When a worker process dies (BrokenProcessPool) the pipeline stops: the downloads still queued are
+    dropped and every symbol not scored yet is reported through on_error.
+    """
+    symbols = list(symbols)
+    cpu_workers = cpu_workers or os.cpu_count() or 1
+    work = queue.Queue(maxsize=queue_size)
+    in_flight = threading.BoundedSemaphore(cpu_workers * 2)
+    results = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def put(item):
+        # Timed puts so a producer blocked on the full queue gives up once the consumer stopped
+        while not stop.is_set():
+            try:
+                work.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def produce(symbol):
+        if stop.is_set():
+            return
+        try:
+            payload = fetch(symbol)
+        except Exception as e:
+            put((symbol, None, e))
+            return
+        put((symbol, payload, None))
+
+    def report_error(symbol, error):
+        print(f"Error fetching data for {symbol}: {error}")
+        if on_error is not None:
+            on_error(symbol, error)
+
+    def finished(symbol, future):
+        in_flight.release()
+        try:
+            result, seconds = future.result()
+        except Exception as e:
+            report_error(symbol, e)
+            return
+        record('metrics_compute', seconds)
+        if not result:
+            report_error(symbol, "No data returned")
+            return
+        with lock:
+            results[symbol] = result
+        if on_result is not None:
+            on_result(symbol, result)
+
+    with ProcessPoolExecutor(max_workers=cpu_workers, initializer=_init_worker, initargs=(compute, tuple(shared_args))) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="pipeline-io") as io_pool:
+        for symbol in symbols:
+            io_pool.submit(produce, symbol)
+
+        taken = set()
+        try:
+            for _ in range(len(symbols)):
+                symbol, payload, error = work.get()
+                taken.add(symbol)
+                if error is not None:
+                    report_error(symbol, error)
+                    continue
+                if payload is None:
+                    report_error(symbol, "No data in the given date range")
+                    continue
+                in_flight.acquire()
+                try:
+                    future = cpu_pool.submit(_run_compute, symbol, payload)
+                except BrokenProcessPool as e:
+                    # The symbols already in the pool get the same error through their futures
+                    in_flight.release()
+                    print(f"A metrics worker process died, stopping the pipeline: {e}")
+                    stop.set()
+                    for left in [symbol] + [symbol for symbol in symbols if symbol not in taken]:
+                        report_error(left, e)
+                    break
+                future.add_done_callback(lambda future, symbol=symbol: finished(symbol, future))
+        finally:
+            stop.set()
+
+    return results
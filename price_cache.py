@@ -0,0 +1,248 @@
+import json
+import sqlite3
+import threading
+import time
+import pandas as pd
+
+from telemetry import cache_result
+
+# Columns kept for every cached bar (same names as stock.history returns)
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+
+# Seconds a write waits for another process holding the cache file's lock
+BUSY_TIMEOUT = 30
+
+
+class PriceCache:
+    """On disk (SQLite) cache of daily price history keyed by symbol.
+
+    Every symbol has a coverage row recording the date range that has been downloaded, whether that range starts at the
+    first trading date (a period="max" download) and when the tail was last refreshed. A request only downloads the
+    missing head / tail segments and merges them into the stored bars.
+
+    ttl_hours: how long the tail is considered fresh before asking YFinance for newer bars again
+    info_ttl_days: how long a cached stock.info dictionary is used (sector / industry / beta rarely change)
+    max_age_days: symbols that haven't been read for this long are dropped by evict()
+    offline: never download, only serve what is already in the cache
+    """
+
+    def __init__(self, path="price_cache.sqlite", ttl_hours=12, max_age_days=30, offline=False, info_ttl_days=7):
+        self.path = path
+        self.ttl_hours = ttl_hours
+        self.info_ttl_days = info_ttl_days
+        self.max_age_days = max_age_days
+        self.offline = offline
+        self.lock = threading.Lock()
+        # The cache file is shared by the pipeline / distributed worker processes: WAL lets readers go on while one of
+        # them writes, and a writer waits for the lock instead of failing with "database is locked"
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=BUSY_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS bars ("
+                "symbol TEXT, date TEXT, open REAL, high REAL, low REAL, close REAL, volume REAL, "
+                "dividends REAL, splits REAL, PRIMARY KEY (symbol, date))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                "symbol TEXT PRIMARY KEY, start TEXT, end TEXT, full_history INTEGER, "
+                "refreshed_at REAL, accessed_at REAL)"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS info (symbol TEXT PRIMARY KEY, data TEXT, fetched_at REAL)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS indicator_state ("
+                "symbol TEXT, key TEXT, state BLOB, last_date TEXT, PRIMARY KEY (symbol, key))"
+            )
+
+    def close(self):
+        self.conn.close()
+
+    def coverage(self, symbol):
+        """Return the coverage row of a symbol as a dict, or None if nothing is cached."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT start, end, full_history, refreshed_at FROM coverage WHERE symbol = ?", (symbol,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'start': row[0], 'end': row[1], 'full_history': bool(row[2]), 'refreshed_at': row[3]}
+
+    def missing_segments(self, symbol, start=None, end=None):
+        """Work out which (start, end) segments still have to be downloaded for a request.
+        start=None means the whole history (period="max"), end=None means up to today. Segment ends are exclusive.
+        """
+        if self.offline:
+            return []
+
+        today = pd.Timestamp.today().normalize()
+        want_end = min(pd.to_datetime(end), today + pd.Timedelta(days=1)) if end else today + pd.Timedelta(days=1)
+        cov = self.coverage(symbol)
+        if cov is None:
+            return [(start, _fmt(want_end))]
+
+        segments = []
+        if not cov['full_history'] and (start is None or pd.to_datetime(start) < pd.to_datetime(cov['start'])):
+            segments.append((start, cov['start']))
+
+        # The TTL only holds back the refresh of a tail that already reaches today, a range ending at a past date is
+        # simply incomplete and always gets its missing tail
+        cov_end = pd.to_datetime(cov['end'])
+        stale = time.time() - (cov['refreshed_at'] or 0) > self.ttl_hours * 3600
+        if want_end > cov_end and (cov_end < today or stale):
+            # Start from the last stored bar so a partial (intraday) last bar gets overwritten, a period="max" download
+            # can have stored bars past the coverage end though
+            last_bar = min(self._last_bar(symbol) or cov['end'], cov['end'])
+            segments.append((last_bar, _fmt(want_end)))
+        return segments
+
+    def store(self, symbol, hist, start=None, end=None):
+        """Merge a downloaded segment into the cache and extend the symbol's coverage."""
+        today = pd.Timestamp.today().normalize()
+        seg_end = min(pd.to_datetime(end), today) if end else today
+        hist = _naive(hist) if not hist.empty else pd.DataFrame(columns=BAR_COLUMNS, index=pd.DatetimeIndex([]))
+
+        bars = hist.reindex(columns=BAR_COLUMNS).dropna(subset=['Close']).astype(float)
+        bars = bars.astype(object).where(bars.notna(), None)
+        dates = bars.index.strftime('%Y-%m-%d')
+        rows = [(symbol, date, *values) for date, values in zip(dates, bars.itertuples(index=False, name=None))]
+
+        # A whole history download that came back empty (a ticker without any bars) covers nothing but its end, so the
+        # symbol is only asked for again once the tail is stale
+        seg_start = start if start is not None else (_fmt(hist.index.min()) if not hist.empty else _fmt(seg_end))
+        cov = self.coverage(symbol)
+
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if cov is None:
+                self.conn.execute(
+                    "INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?)",
+                    (symbol, seg_start, _fmt(seg_end), int(start is None), now, now),
+                )
+            else:
+                new_start = min(cov['start'], seg_start)
+                new_end = max(cov['end'], _fmt(seg_end))
+                full_history = cov['full_history'] or start is None
+                # Head segments don't touch the tail, so they don't count as a refresh
+                refreshed_at = now if _fmt(seg_end) >= cov['end'] else cov['refreshed_at']
+                self.conn.execute(
+                    "UPDATE coverage SET start = ?, end = ?, full_history = ?, refreshed_at = ? WHERE symbol = ?",
+                    (new_start, new_end, int(full_history), refreshed_at, symbol),
+                )
+
+    def load(self, symbol, start=None, end=None, touch=True):
+        """Read cached bars for [start, end) as a history dataframe (empty dataframe if nothing is cached).
+        touch=False leaves the symbol's accessed_at alone, to mark a whole batch of reads at once with touch().
+        """
+        query = "SELECT date, open, high, low, close, volume, dividends, splits FROM bars WHERE symbol = ?"
+        params = [symbol]
+        if start is not None:
+            query += " AND date >= ?"
+            params.append(_fmt(start))
+        if end is not None:
+            query += " AND date < ?"
+            params.append(_fmt(end))
+        query += " ORDER BY date"
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        if touch:
+            self.touch([symbol])
+
+        hist = pd.DataFrame([row[1:] for row in rows], columns=BAR_COLUMNS,
+                            index=pd.DatetimeIndex([row[0] for row in rows], name='Date'))
+        return hist
+
+    def touch(self, symbols):
+        """Mark symbols as read now (evict() drops the ones that haven't been read in max_age_days), one write for all."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE coverage SET accessed_at = ? WHERE symbol = ?", [(now, symbol) for symbol in symbols])
+
+    def get_history(self, symbol, start=None, end=None, fetch=None):
+        """Return the history of a symbol for [start, end), downloading only what the cache is missing.
+        fetch(symbol, start, end) does the actual download, start=None meaning period="max".
+        """
+        if fetch is not None:
+            missing = self.missing_segments(symbol, start, end)
+            cache_result('prices', hit=not missing)
+            for seg_start, seg_end in missing:
+                print(f"Cache miss for {symbol}: fetching {seg_start or 'max'} / {seg_end}")
+                hist = fetch(symbol, seg_start, seg_end)
+                # Store empty results too, so a tail with no new bars still counts as refreshed
+                if hist is not None:
+                    self.store(symbol, hist, seg_start, seg_end)
+        return self.load(symbol, start, end)
+
+    def get_info(self, symbol, fetch=None):
+        """Return the stock.info dictionary of a symbol, calling fetch(symbol) only when the cached copy is older than
+        info_ttl_days. Offline (or without fetch) the cached copy is returned whatever its age, {} if there is none.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT data, fetched_at FROM info WHERE symbol = ?", (symbol,)).fetchone()
+        fresh = row is not None and time.time() - row[1] < self.info_ttl_days * 86400
+        cache_result('info', hit=fresh)
+        if fresh or self.offline or fetch is None:
+            return json.loads(row[0]) if row is not None else {}
+
+        info = fetch(symbol)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO info VALUES (?, ?, ?)",
+                            (symbol, json.dumps(info, default=str), time.time()))
+        return info
+
+    def load_indicator_state(self, symbol, key):
+        """Pickled IndicatorSet of a symbol / configuration, None if there is none."""
+        with self.lock:
+            row = self.conn.execute("SELECT state FROM indicator_state WHERE symbol = ? AND key = ?", (symbol, key)).fetchone()
+        return row[0] if row is not None else None
+
+    def save_indicator_state(self, symbol, key, state, last_date):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO indicator_state VALUES (?, ?, ?, ?)",
+                            (symbol, key, state, _fmt(last_date)))
+
+    def evict(self, max_age_days=None):
+        """Drop every symbol that hasn't been read in max_age_days (defaults to the cache setting)."""
+        max_age_days = self.max_age_days if max_age_days is None else max_age_days
+        cutoff = time.time() - max_age_days * 86400
+        with self.lock, self.conn:
+            stale = [row[0] for row in self.conn.execute("SELECT symbol FROM coverage WHERE accessed_at < ?", (cutoff,))]
+            for symbol in stale:
+                self.conn.execute("DELETE FROM bars WHERE symbol = ?", (symbol,))
+                self.conn.execute("DELETE FROM coverage WHERE symbol = ?", (symbol,))
+                self.conn.execute("DELETE FROM info WHERE symbol = ?", (symbol,))
+                self.conn.execute("DELETE FROM indicator_state WHERE symbol = ?", (symbol,))
+        if stale:
+            print(f"Evicted {len(stale)} symbols from the price cache.")
+        return stale
+
+    def clear(self, symbol=None):
+        with self.lock, self.conn:
+            if symbol is None:
+                self.conn.execute("DELETE FROM bars")
+                self.conn.execute("DELETE FROM coverage")
+                self.conn.execute("DELETE FROM info")
+                self.conn.execute("DELETE FROM indicator_state")
+            else:
+                self.conn.execute("DELETE FROM bars WHERE symbol = ?", (symbol,))
+                self.conn.execute("DELETE FROM coverage WHERE symbol = ?", (symbol,))
+                self.conn.execute("DELETE FROM info WHERE symbol = ?", (symbol,))
+                self.conn.execute("DELETE FROM indicator_state WHERE symbol = ?", (symbol,))
+
+    def _last_bar(self, symbol):
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(date) FROM bars WHERE symbol = ?", (symbol,)).fetchone()
+        return row[0] if row else None
+
+
+def _naive(hist):
+    if hist.index.tz is not None:
+        hist = hist.copy()
+        hist.index = hist.index.tz_localize(None)
+    return hist
+
+
+def _fmt(date):
+    return pd.to_datetime(date).strftime('%Y-%m-%d')
@@ -0,0 +1,240 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Fields kept by default and their dtypes (pass dtypes={'Volume': np.float32} to halve the volume array)
+DEFAULT_DTYPES = {'Close': np.float64, 'Volume': np.float64}
+
+
+class PriceStore:
+    """Multi-symbol daily prices on one shared calendar, one (dates x symbols) array per field.
+
+    The arrays are column-major (Fortran order), so a symbol's column is contiguous and column() / blocks() hand out
+    views without copying anything. With a path the arrays are .npy files opened as memory maps, PriceStore.open()
+    reopens a saved store read only, so a universe larger than RAM is paged in as it's read.
+    first_rows / last_rows are each symbol's first / last bar (row numbers in the calendar), first_dates its first trading
+    date, which is before the calendar when the store only holds a date range of longer histories.
+    """
+
+    def __init__(self, calendar, symbols, fields, first_rows, last_rows, first_dates=None):
+        self.calendar = pd.DatetimeIndex(calendar)
+        self.symbols = list(symbols)
+        self.positions = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.fields = fields
+        self.first_rows = np.asarray(first_rows)
+        self.last_rows = np.asarray(last_rows)
+        if first_dates is None:
+            first_dates = self.calendar[self.first_rows]
+        self.trading_starts = pd.DatetimeIndex(first_dates)
+
+    @classmethod
+    def from_histories(cls, histories, dtypes=None, path=None):
+        """Build a store from symbol -> history dataframes (or (symbol, history) pairs). Only the DEFAULT_DTYPES fields
+        (or the dtypes ones) are kept, the rows without a Close are dropped. path writes memory mapped .npy files there.
+        """
+        items = list(histories.items() if isinstance(histories, dict) else histories)
+        dates = [_naive_dates(hist.dropna(subset=['Close']).index) for _, hist in items]
+        calendar = np.unique(np.concatenate(dates)) if dates else None
+        builder = PriceStoreBuilder(len(items), dtypes=dtypes, path=path, calendar=calendar)
+        builder.add(items)
+        return builder.build()
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """Reopen a store saved with save() / from_histories(path=...), the field arrays memory mapped."""
+        with open(os.path.join(path, "store.json"), encoding='utf-8') as f:
+            meta = json.load(f)
+        fields = {field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode=mode) for field in meta['fields']}
+        first_dates = os.path.join(path, "first_dates.npy")
+        return cls(np.load(os.path.join(path, "calendar.npy")), meta['symbols'], fields,
+                   np.load(os.path.join(path, "first_rows.npy")), np.load(os.path.join(path, "last_rows.npy")),
+                   first_dates=np.load(first_dates) if os.path.exists(first_dates) else None)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for field, array in self.fields.items():
+            if isinstance(array, np.memmap) and os.path.abspath(array.filename) == os.path.abspath(os.path.join(path, f"{field}.npy")):
+                array.flush()
+            else:
+                np.save(os.path.join(path, f"{field}.npy"), np.asfortranarray(array))
+        np.save(os.path.join(path, "calendar.npy"), self.calendar.to_numpy(dtype='datetime64[ns]'))
+        np.save(os.path.join(path, "first_rows.npy"), self.first_rows)
+        np.save(os.path.join(path, "last_rows.npy"), self.last_rows)
+        np.save(os.path.join(path, "first_dates.npy"), self.trading_starts.to_numpy(dtype='datetime64[ns]'))
+        with open(os.path.join(path, "store.json"), 'w', encoding='utf-8') as f:
+            json.dump({'symbols': self.symbols, 'fields': list(self.fields)}, f)
+
+    def __contains__(self, symbol):
+        return symbol in self.positions
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.fields.values())
+
+    @property
+    def first_dates(self):
+        """symbol -> first trading date."""
+        return pd.Series(self.trading_starts, index=self.symbols)
+
+    def row_range(self, start=None, end=None):
+        """Calendar rows of [start, end) as a slice."""
+        first = 0 if start is None else self.calendar.searchsorted(pd.to_datetime(start))
+        last = len(self.calendar) if end is None else self.calendar.searchsorted(pd.to_datetime(end))
+        return slice(first, last)
+
+    def column(self, field, symbol, start=None, end=None):
+        """A symbol's values of one field as a view (NaN on the calendar days it didn't trade)."""
+        return self.fields[field][self.row_range(start, end), self.positions[symbol]]
+
+    def blocks(self, block_size=500, start=None, end=None, fields=None):
+        """Yield (symbols, {field: dates x symbols view}) for consecutive groups of block_size symbols."""
+        rows = self.row_range(start, end)
+        fields = fields or list(self.fields)
+        for first in range(0, len(self.symbols), block_size):
+            columns = slice(first, first + block_size)
+            yield self.symbols[columns], {field: self.fields[field][rows, columns] for field in fields}
+
+    def history(self, symbol, start=None, end=None):
+        """A symbol's bars as a history dataframe (a copy, only the days it traded)."""
+        rows = self.row_range(start, end)
+        j = self.positions[symbol]
+        rows = slice(max(rows.start, self.first_rows[j]), min(rows.stop, self.last_rows[j] + 1))
+        hist = pd.DataFrame({field: array[rows, j] for field, array in self.fields.items()}, index=self.calendar[rows])
+        return hist.dropna(subset=['Close'])
+
+    def frame(self, field='Close'):
+        """dates x symbols dataframe of one field (NaN on the days a symbol didn't trade), the write_price_matrix layout."""
+        return pd.DataFrame(self.fields[field], index=self.calendar, columns=self.symbols, copy=False)
+
+
+class PriceStoreBuilder:
+    """Fills a PriceStore a chunk of histories at a time, so the per-symbol dataframes of a batched download can be freed
+    as soon as their chunk is copied in (download_history_batch(on_chunk=builder.add)) instead of all of them being held
+    until the store is built.
+
+    The calendar is fixed before the first chunk (e.g. the business days of the requested range) and the arrays are
+    allocated once for capacity symbols, so filling them never moves a column. Bars outside the calendar's first / last
+    date are left out (each symbol's first trading date is still kept, see PriceStore.first_dates). Bars inside it on a
+    date the calendar doesn't have (another exchange's trading day) are set aside and merged in one pass by build().
+    Without a calendar every bar is set aside and the calendar is the union of their dates.
+    With a path the arrays are memory mapped files in that directory, build() saves the store there and reopens it.
+    """
+
+    def __init__(self, capacity, dtypes=None, path=None, calendar=None):
+        self.capacity = max(int(capacity), 1)
+        self.dtypes = dtypes or DEFAULT_DTYPES
+        self.path = path
+        self.bounded = calendar is not None
+        self.calendar = _naive_dates([] if calendar is None else calendar)
+        self.symbols = []
+        self.first_dates = []
+        self.last_dates = []
+        # (column, dates, {field: values}) of the bars on dates the calendar doesn't have
+        self.overflow = []
+        self.generation = 0
+        self.fields = self._allocate(len(self.calendar), self.capacity)
+
+    def _allocate(self, rows, columns):
+        fields = {}
+        for field, dtype in self.dtypes.items():
+            if self.path is None:
+                fields[field] = np.full((rows, columns), np.nan, dtype=dtype, order='F')
+            else:
+                os.makedirs(self.path, exist_ok=True)
+                fields[field] = np.lib.format.open_memmap(self._scratch_file(field, self.generation), mode='w+',
+                                                         dtype=dtype, shape=(rows, columns), fortran_order=True)
+                fields[field][:] = np.nan
+        return fields
+
+    def _scratch_file(self, field, generation):
+        return os.path.join(self.path, f"{field}.building-{generation}.npy")
+
+    def _remove_scratch(self, generation):
+        if self.path is not None:
+            for field in self.dtypes:
+                os.remove(self._scratch_file(field, generation))
+
+    def add(self, histories):
+        """Copy in symbol -> history dataframes (or (symbol, history) pairs), the rows without a Close are dropped."""
+        items = list(histories.items() if isinstance(histories, dict) else histories)
+        items = [(symbol, hist.dropna(subset=['Close'])) for symbol, hist in items]
+        items = [(symbol, hist) for symbol, hist in items if not hist.empty]
+        if not items:
+            return
+        if len(self.symbols) + len(items) > self.capacity:
+            raise ValueError(f"PriceStoreBuilder has room for {self.capacity} symbols, got {len(self.symbols) + len(items)}")
+
+        for j, (symbol, hist) in enumerate(items, start=len(self.symbols)):
+            dates = _naive_dates(hist.index)
+            order = np.argsort(dates, kind='stable')
+            dates = dates[order]
+            self.first_dates.append(dates[0])
+            self.last_dates.append(dates[-1])
+            values = {field: hist[field].to_numpy(dtype=dtype, na_value=np.nan)[order] for field, dtype in self.dtypes.items()}
+
+            if self.bounded:
+                inside = np.zeros(len(dates), dtype=bool)
+                if len(self.calendar):
+                    inside = (dates >= self.calendar[0]) & (dates <= self.calendar[-1])
+                dates = dates[inside]
+                values = {field: array[inside] for field, array in values.items()}
+            rows = np.searchsorted(self.calendar, dates)
+            found = rows < len(self.calendar)
+            found[found] = self.calendar[rows[found]] == dates[found]
+            for field, array in self.fields.items():
+                array[rows[found], j] = values[field][found]
+            if not found.all():
+                self.overflow.append((j, dates[~found], {field: array[~found] for field, array in values.items()}))
+            self.symbols.append(symbol)
+
+    def _merge_overflow(self):
+        """Move the set aside bars into arrays on the calendar extended with their dates (one copy, done once)."""
+        calendar = np.union1d(self.calendar, np.concatenate([dates for _, dates, _ in self.overflow]))
+        row_map = np.searchsorted(calendar, self.calendar)
+        old_fields, old_generation = self.fields, self.generation
+        self.generation += 1
+        self.fields = self._allocate(len(calendar), self.capacity)
+        filled = len(self.symbols)
+        for field, array in self.fields.items():
+            array[row_map, :filled] = old_fields[field][:, :filled]
+        for j, dates, values in self.overflow:
+            rows = np.searchsorted(calendar, dates)
+            for field, array in self.fields.items():
+                array[rows, j] = values[field]
+        self.calendar = calendar
+        self.overflow = []
+        del old_fields
+        self._remove_scratch(old_generation)
+
+    def build(self):
+        """The PriceStore of everything added (the spare columns are cut off, a view of the column-major arrays)."""
+        if self.overflow:
+            self._merge_overflow()
+        filled = len(self.symbols)
+        fields = {field: array[:, :filled] for field, array in self.fields.items()}
+        first_dates = np.array(self.first_dates, dtype='datetime64[ns]')
+        # A symbol whose bars all fall outside the calendar gets an empty row range (last row before the first one)
+        first_rows = np.searchsorted(self.calendar, first_dates)
+        last_rows = np.searchsorted(self.calendar, np.array(self.last_dates, dtype='datetime64[ns]'), side='right') - 1
+        store = PriceStore(self.calendar, self.symbols, fields, first_rows.astype(np.int64), last_rows.astype(np.int64),
+                           first_dates=first_dates)
+        if self.path is None:
+            return store
+        store.save(self.path)
+        # The scratch files can only go once nothing maps them anymore
+        del store, fields
+        self.fields = {}
+        self._remove_scratch(self.generation)
+        return PriceStore.open(self.path)
+
+
+def _naive_dates(index):
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.to_numpy(dtype='datetime64[ns]')
@@ -0,0 +1,211 @@
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from telemetry import count, record
+
+
+class TokenBucket:
+    """Thread safe token bucket shared by every worker, rate is the sustained requests per second and burst how many
+    requests can go out back to back after an idle period.
+    """
+
+    def __init__(self, rate=2.0, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available and take them."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = max(self.paused_until - now, (tokens - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a while (every worker backs off when the upstream says 429)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+class Cancelled(Exception):
+    """Raised by FetchScheduler.request / run once the scheduler was cancelled."""
+
+
+RATE_LIMIT_ERRORS = {'YFRateLimitError', 'RateLimitError'}
+
+
+def is_rate_limit_error(exc):
+    """A 429: a rate limit exception type, an HTTP error with status 429 (urllib's code, requests' response) or a message
+    with both the status and its reason ('429 Too Many Requests'). A bare 429 in the text could be a symbol or a price.
+    """
+    if type(exc).__name__ in RATE_LIMIT_ERRORS:
+        return True
+    if getattr(exc, 'code', None) == 429 or getattr(getattr(exc, 'response', None), 'status_code', None) == 429:
+        return True
+    text = str(exc)
+    return bool(re.search(r'\b429\b', text)) and 'Too Many Requests' in text
+
+
+def is_retryable(exc):
+    """Rate limits and transient network errors are worth retrying, anything else (bad symbol, parsing) is not."""
+    if is_rate_limit_error(exc):
+        return True
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    return bool(names & {'Timeout', 'ConnectionError', 'ChunkedEncodingError', 'URLError', 'RemoteDisconnected'})
+
+
+class FetchScheduler:
+    """Runs fetch_stock_data style work over a bounded thread pool while keeping every network request under one shared
+    requests per second budget.
+
+    workers: number of symbols processed at the same time
+    rate / burst: token bucket settings shared by all workers
+    retries / backoff / max_backoff: exponential backoff for rate limit (429) and transient errors
+    """
+
+    def __init__(self, workers=8, rate=2.0, burst=None, retries=4, backoff=1.0, max_backoff=60.0):
+        self.workers = workers
+        self.limiter = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latencies = {}
+        self.errors = {}
+        self.retry_count = 0
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.unpaused = threading.Event()
+        self.unpaused.set()
+        self.cancelled = threading.Event()
+
+    def pause(self):
+        """Hold every new request (the ones in flight finish) until resume()."""
+        self.unpaused.clear()
+
+    def resume(self):
+        self.unpaused.set()
+
+    def cancel(self):
+        """Fail every request not started yet with Cancelled, so the run winds down after the ones in flight."""
+        self.cancelled.set()
+        self.unpaused.set()
+
+    @property
+    def paused(self):
+        return not self.unpaused.is_set()
+
+    def request(self, func, *args, weight=1, **kwargs):
+        """Make one upstream request: wait for a token, call func and retry with exponential backoff when it's retryable.
+        weight is the number of requests func really sends (a yf.download makes one per ticker), it takes a token each.
+        """
+        for attempt in range(self.retries + 1):
+            self.unpaused.wait()
+            if self.cancelled.is_set():
+                raise Cancelled("Run cancelled")
+            waiting = time.perf_counter()
+            # One token at a time, acquire(weight) would never return for a weight above the bucket capacity
+            for _ in range(weight):
+                self.limiter.acquire()
+            record('throttle_wait', time.perf_counter() - waiting)
+            with self.lock:
+                self.request_count += weight
+            count('requests', weight)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                count('rate_limited' if rate_limited else 'request_errors')
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                wait = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if rate_limited:
+                    self.limiter.pause(wait)
+                with self.lock:
+                    self.retry_count += 1
+                count('retries')
+                print(f"Retrying in {wait:.1f}s after error: {e}")
+                time.sleep(wait)
+                record('sleep_backoff', wait)
+
+    def run(self, symbols, task, on_result=None, on_error=None):
+        """Run task(symbol) for every symbol on the worker pool and return a symbol -> result dictionary.
+        Symbols whose task raised are left out and recorded in self.errors. on_result(symbol, result) / on_error(symbol, error)
+        are called as soon as each symbol finishes.
+        """
+        results = {}
+
+        def timed(symbol):
+            if self.cancelled.is_set():
+                raise Cancelled("Run cancelled")
+            started = time.perf_counter()
+            try:
+                return task(symbol)
+            finally:
+                with self.lock:
+                    self.latencies[symbol] = time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(timed, symbol): symbol for symbol in symbols}
+            for future in as_completed(futures):
+                symbol = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if not isinstance(e, Cancelled):
+                        print(f"Error fetching data for {symbol}: {e}")
+                    self.errors[symbol] = str(e)
+                    if on_error is not None:
+                        try:
+                            on_error(symbol, e)
+                        except Exception as callback_error:
+                            print(f"Error handling the failure of {symbol}: {callback_error}")
+                            count('result_errors')
+                    continue
+                results[symbol] = result
+                if on_result is not None:
+                    # A failing callback (e.g. the output writer) loses that symbol's row, not the rest of the run
+                    try:
+                        on_result(symbol, result)
+                    except Exception as e:
+                        print(f"Error handling the result of {symbol}: {e}")
+                        count('result_errors')
+        return results
+
+    def summary(self):
+        """Latency / request statistics of everything run so far."""
+        latencies = np.array(list(self.latencies.values()))
+        if not len(latencies):
+            latencies = np.zeros(1)
+        return {
+            'symbols': len(self.latencies),
+            'requests': self.request_count,
+            'retries': self.retry_count,
+            'errors': len(self.errors),
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'latency_max': float(latencies.max()),
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Fetched {summary['symbols']} symbols with {summary['requests']} requests "
+              f"({summary['retries']} retries, {summary['errors']} errors). "
+              f"Per symbol latency p50 {summary['latency_p50']:.2f}s, p95 {summary['latency_p95']:.2f}s, "
+              f"max {summary['latency_max']:.2f}s")
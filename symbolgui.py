@@ -3,12 +3,34 @@ import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 from tkinter import filedialog, messagebox
 import threading
-import pandas as pd
-import yfinance as yf
+import queue
 import time
+import pandas as pd
+from SymbolScraping import RESULT_COLUMNS, enrich_symbols, load_market_returns, result_dtypes
+from scheduler import FetchScheduler
+from writers import MergedSheetWriter
+from market_benchmarks import benchmark_for
+from telemetry import default_telemetry
+
+# How often (ms) the Tk main loop drains the worker's progress events
+POLL_MS = 100
+
+# Indices of the Scrape combobox, the first one is preselected
+SCRAPE_INDICES = ["S&P 500", "NASDAQ 100", "Dow Jones"]
 
 class SymbolAggregationGUI:
     def __init__(self, root):
+        self.root = root
+        # The upload worker never touches Tk, it posts (kind, value) events here and poll_events applies them
+        self.events = queue.Queue()
+        self.scheduler = None
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.run_started = None
+        self.paused_at = None
+        self.paused_for = 0.0
+
         root.title("Symbol Aggregation Tool")
         root.geometry("900x600")
 
@@ -39,14 +61,29 @@ class SymbolAggregationGUI:
 
         ttk.Label(output_frame, text="Output", font=("Arial", 14), bootstyle="light").pack(anchor="nw", padx=10, pady=5)
 
+        # Progress of the running upload: bar, counts / throughput / ETA and the pause / cancel controls
+        progress_frame = ttk.Frame(output_frame, bootstyle="dark")
+        progress_frame.pack(fill="x", padx=10)
+        self.progress = ttk.Progressbar(progress_frame, mode="determinate", bootstyle="success-striped")
+        self.progress.pack(side="left", expand=True, fill="x", padx=(0, 10))
+        self.progress_label = ttk.Label(progress_frame, text="Idle", bootstyle="light", width=48)
+        self.progress_label.pack(side="left")
+        self.pause_button = ttk.Button(progress_frame, text="Pause", bootstyle="warning outline", command=self.toggle_pause, state="disabled")
+        self.pause_button.pack(side="left", padx=5)
+        self.cancel_button = ttk.Button(progress_frame, text="Cancel", bootstyle="danger outline", command=self.cancel_run, state="disabled")
+        self.cancel_button.pack(side="left")
+
         self.output_text = tk.Text(output_frame, height=5, font=("Courier", 12), bg="#2c3e50", fg="white", wrap="word")
         self.output_text.pack(expand=True, fill="both", padx=10, pady=10)
         self.output_text.insert("end", "Output will be displayed here...")
 
+        root.after(POLL_MS, self.poll_events)
+
     def show_scrape(self):
         self.clear_content()
         ttk.Label(self.content_frame, text="Select Index:", font=("Arial", 12)).pack(pady=5)
-        self.index_var = ttk.Combobox(self.content_frame, values=["S&P 500", "NASDAQ 100", "Dow Jones"], bootstyle="info")
+        self.index_var = ttk.Combobox(self.content_frame, values=SCRAPE_INDICES, state="readonly", bootstyle="info")
+        self.index_var.current(0)
         self.index_var.pack(pady=5)
         ttk.Button(self.content_frame, text="Scrape Data", bootstyle="success", command=self.upload_symbol_script).pack(pady=5)
 
@@ -74,6 +111,13 @@ class SymbolAggregationGUI:
             self.file_entry.insert(0, file_path)
 
     def upload_symbol_script(self):
+        if self.scheduler is not None:
+            messagebox.showinfo("Upload running", "Wait for the current upload to finish or cancel it.")
+            return
+        index_name = self.index_var.get()
+        if index_name not in SCRAPE_INDICES:
+            messagebox.showerror("Error", "Please select an index.")
+            return
         file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
         if not file_path:
             messagebox.showerror("Error", "Please select an Excel file.")
@@ -85,32 +129,123 @@ class SymbolAggregationGUI:
             return
         
         self.update_output("Starting data upload...")
-        threading.Thread(target=self.run_upload_symbol_script, args=(file_path, "Sheet1", "2001-01-01", "2024-12-31", output_path)).start()
+        self.scheduler = FetchScheduler()
+        # Pause / Cancel are enabled by the worker's 'start' event, once the benchmark and the sheet are loaded
+        self.run_started = None
+        threading.Thread(target=self.run_upload_symbol_script, args=(file_path, "Sheet1", "2001-01-01", "2024-12-31", output_path, index_name),
+                        daemon=True).start()
+
+    def run_upload_symbol_script(self, file_path, sheetname, start_date, end_date, output_file_path, index_name=None):
+        """Worker thread: drives the parallel engine (enrich_symbols on self.scheduler) and reports through self.events only.
+        The benchmark of index_name is resolved and loaded here too, a cold process downloads it and that mustn't block Tk.
+        """
+        try:
+            # Correlation against the selected index's benchmark, loaded once per process and shared by every run
+            market_index = benchmark_for(index_name=index_name)
+            self.events.put(('log', f"Loading benchmark {market_index}..."))
+            market_returns = load_market_returns(start_date, end_date, market_index=market_index)
+            new_sorting_df = pd.read_excel(file_path, sheet_name=sheetname)
+            symbols = list(new_sorting_df['Symbol'].dropna().unique())
+            self.events.put(('start', len(symbols)))
+
+            # Rows are written in chunks as symbols finish instead of one big DataFrame at the end
+            output = MergedSheetWriter(new_sorting_df, RESULT_COLUMNS, output_file_path, sheet_name=sheetname,
+                                       result_dtypes=result_dtypes(RESULT_COLUMNS))
+            run_started = default_telemetry.snapshot()
+
+            def on_result(symbol, data):
+                output.add_result(symbol, data)
+                self.events.put(('done', symbol))
 
-    def run_upload_symbol_script(self, file_path, sheetname, start_date, end_date, output_file_path):
-        new_sorting_df = pd.read_excel(file_path, sheet_name=sheetname)
-        symbols = new_sorting_df['Symbol'].dropna().unique()
+            def on_error(symbol, error):
+                output.add_failure(symbol)
+                self.events.put(('failed', symbol))
 
-        market_index = '^GSPC'
-        market_data = yf.download(market_index, start=start_date, end=end_date)
-        market_data.index = market_data.index.tz_localize(None)
-        market_returns = market_data['Close'].pct_change().dropna()
+            try:
+                enrich_symbols(symbols, start_date, end_date, market_returns=market_returns, on_result=on_result,
+                            on_error=on_error, scheduler=self.scheduler)
+            finally:
+                output.close()
 
-        results = []
-        for index, symbol in enumerate(symbols):
-            data = fetch_stock_data(symbol, market_returns, start_date, end_date)
-            if data:
-                results.append(data)
-            self.update_output(f"Processing {index + 1}/{len(symbols)}: {symbol}")
-            time.sleep(1)
+            if self.scheduler.cancelled.is_set():
+                self.events.put(('log', f"Upload cancelled, the finished symbols were saved to {output_file_path}"))
+            else:
+                self.events.put(('log', f"Updated file saved to {output_file_path}"))
+            self.events.put(('log', default_telemetry.format_summary(since=run_started)))
+        except Exception as e:
+            self.events.put(('log', f"Upload failed: {e}"))
+        finally:
+            self.events.put(('finished', None))
 
-        results_df = pd.DataFrame(results)
-        updated_new_sorting_df = new_sorting_df.merge(results_df, on='Symbol', how='left')
+    def poll_events(self):
+        """Apply every queued worker event on the Tk main loop, then refresh the progress widgets once for the batch."""
+        changed = False
+        try:
+            while True:
+                kind, value = self.events.get_nowait()
+                changed = True
+                if kind == 'start':
+                    self.total, self.completed, self.failed = value, 0, 0
+                    self.run_started, self.paused_at, self.paused_for = time.monotonic(), None, 0.0
+                    self.progress.configure(maximum=max(value, 1), value=0)
+                    self.pause_button.configure(state="normal", text="Pause")
+                    self.cancel_button.configure(state="normal")
+                elif kind == 'done':
+                    self.completed += 1
+                elif kind == 'failed':
+                    self.failed += 1
+                elif kind == 'log':
+                    self.update_output(value)
+                elif kind == 'finished':
+                    self.finish_run()
+        except queue.Empty:
+            pass
+        if changed and self.run_started is not None:
+            self.update_progress()
+        self.root.after(POLL_MS, self.poll_events)
+
+    def update_progress(self):
+        if self.run_started is None:
+            return
+        processed = self.completed + self.failed
+        self.progress.configure(value=processed)
+        paused_for = self.paused_for + (time.monotonic() - self.paused_at if self.paused_at else 0.0)
+        elapsed = max(time.monotonic() - self.run_started - paused_for, 1e-9)
+        rate = processed / elapsed
+        text = f"{processed}/{self.total} ({self.failed} failed) - {rate:.1f} symbols/s"
+        if self.paused_at is not None:
+            text += " - paused"
+        elif processed < self.total and rate > 0:
+            eta = int((self.total - processed) / rate)
+            text += f" - ETA {eta // 60}:{eta % 60:02d}"
+        self.progress_label.configure(text=text)
+
+    def toggle_pause(self):
+        if self.scheduler is None or self.run_started is None:
+            return
+        if self.scheduler.paused:
+            self.scheduler.resume()
+            self.paused_for += time.monotonic() - self.paused_at
+            self.paused_at = None
+            self.pause_button.configure(text="Pause")
+        else:
+            self.scheduler.pause()
+            self.paused_at = time.monotonic()
+            self.pause_button.configure(text="Resume")
+        self.update_progress()
 
-        with pd.ExcelWriter(output_file_path, engine='openpyxl') as writer:
-            updated_new_sorting_df.to_excel(writer, sheet_name=sheetname, index=False)
+    def cancel_run(self):
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+            if self.paused_at is not None:
+                self.paused_for += time.monotonic() - self.paused_at
+                self.paused_at = None
+            self.update_output("Cancelling, waiting for the requests in flight...")
 
-        self.update_output(f"Updated file saved to {output_path}")
+    def finish_run(self):
+        self.scheduler = None
+        self.pause_button.configure(state="disabled", text="Pause")
+        self.cancel_button.configure(state="disabled")
 
     def update_output(self, message):
         self.output_text.insert("end", f"{message}\n")
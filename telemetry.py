@@ -0,0 +1,159 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Stages timed across a run, in the order the summary lists them
+STAGES = ['history_probe', 'range_fetch', 'info_fetch', 'metrics_compute', 'throttle_wait', 'sleep_backoff', 'export']
+
+
+class Telemetry:
+    """Thread safe stage timers and counters for the scraping runs.
+
+    Stages (STAGES) accumulate wall time, call count and the slowest call: the network stages tell upstream latency apart,
+    throttle_wait is the time spent waiting on the rate limiter and sleep_backoff the fixed delays and retry backoffs.
+    Counters are named with optional labels, e.g. count('requests'), cache_result('prices', hit=True).
+
+    Everything is cumulative for the process (that's what the /metrics endpoint exports), a run summary is the
+    difference with a snapshot taken when the run started. Runs going on at the same time share the counters.
+    """
+
+    def __init__(self):
+        self.stages = {}  # name -> [calls, seconds, max seconds]
+        self.counters = {}  # (name, ((label, value), ...)) -> value
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] = max(stage[2], seconds)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def cache_result(self, cache, hit):
+        self.count('cache_hits' if hit else 'cache_misses', cache=cache)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'stages': {name: list(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters),
+                'time': time.time(),
+            }
+
+    def summary(self, since=None):
+        """Stage timings, counters and cache hit rates, since a snapshot() when one is given."""
+        now = self.snapshot()
+        before = since or {'stages': {}, 'counters': {}, 'time': self.started_at}
+
+        stages = {}
+        for name in STAGES + sorted(set(now['stages']) - set(STAGES)):
+            calls, seconds, slowest = now['stages'].get(name, [0, 0.0, 0.0])
+            previous = before['stages'].get(name, [0, 0.0, 0.0])
+            calls, seconds = calls - previous[0], seconds - previous[1]
+            if calls:
+                stages[name] = {'calls': calls, 'seconds': seconds, 'mean': seconds / calls, 'max': slowest}
+
+        counters = {}
+        for key, value in now['counters'].items():
+            value -= before['counters'].get(key, 0)
+            if value:
+                counters[_key_label(key)] = value
+
+        cache_rates = {}
+        for cache in {dict(labels)['cache'] for name, labels in now['counters'] if name in ('cache_hits', 'cache_misses')}:
+            hits = counters.get(f"cache_hits[cache={cache}]", 0)
+            misses = counters.get(f"cache_misses[cache={cache}]", 0)
+            if hits + misses:
+                cache_rates[cache] = hits / (hits + misses)
+
+        return {'elapsed': now['time'] - before['time'], 'stages': stages, 'counters': counters, 'cache_hit_rates': cache_rates}
+
+    def format_summary(self, since=None):
+        summary = self.summary(since)
+        lines = [f"Run summary ({summary['elapsed']:.1f}s):"]
+        for name, stage in summary['stages'].items():
+            lines.append(f"  {name:<16} {stage['seconds']:9.2f}s over {stage['calls']} calls "
+                         f"(mean {stage['mean']:.3f}s, max {stage['max']:.3f}s)")
+        if summary['counters']:
+            lines.append("  " + ", ".join(f"{name}: {value:g}" for name, value in sorted(summary['counters'].items())))
+        if summary['cache_hit_rates']:
+            lines.append("  Cache hit rates: " + ", ".join(f"{cache} {rate:.0%}" for cache, rate in sorted(summary['cache_hit_rates'].items())))
+        return "\n".join(lines)
+
+    def print_summary(self, since=None):
+        print(self.format_summary(since))
+
+    def prometheus(self, prefix="stockscribe"):
+        """Prometheus text exposition of the cumulative stage timings and counters."""
+        now = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Wall time spent in each pipeline stage.",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for name, (calls, seconds, _) in sorted(now['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {seconds}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {calls}')
+        lines.append(f"# HELP {prefix}_stage_seconds_max Slowest single call of each stage.")
+        lines.append(f"# TYPE {prefix}_stage_seconds_max gauge")
+        for name, (_, _, slowest) in sorted(now['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_max{{stage="{name}"}} {slowest}')
+
+        names = sorted({name for name, _ in now['counters']})
+        for name in names:
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for (counter, labels), value in sorted(now['counters'].items()):
+                if counter == name:
+                    label_text = ",".join(f'{label}="{_escape(value_)}"' for label, value_ in labels)
+                    lines.append(f"{prefix}_{name}_total{{{label_text}}} {value}" if label_text else f"{prefix}_{name}_total {value}")
+        lines.append(f"# TYPE {prefix}_uptime_seconds gauge")
+        lines.append(f"{prefix}_uptime_seconds {now['time'] - self.started_at}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.counters.clear()
+            self.started_at = time.time()
+
+
+def _key_label(key):
+    name, labels = key
+    return f"{name}[{','.join(f'{label}={value}' for label, value in labels)}]" if labels else name
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Process wide instance every module records into and the Flask /metrics endpoint exports
+default_telemetry = Telemetry()
+
+
+def stage(name):
+    return default_telemetry.stage(name)
+
+
+def record(name, seconds):
+    default_telemetry.record(name, seconds)
+
+
+def count(name, value=1, **labels):
+    default_telemetry.count(name, value, **labels)
+
+
+def cache_result(cache, hit):
+    default_telemetry.cache_result(cache, hit)
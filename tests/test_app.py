@@ -0,0 +1,70 @@
+import io
+
+import pandas as pd
+import pytest
+
+import app as app_module
+from constituents import default_service
+from data_sources import ReplaySource, set_source
+from jobs import Job
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(default_service, 'cache_dir', str(tmp_path / "constituents"))
+    monkeypatch.setitem(app_module.app.config, 'CONSTITUENT_REFRESH', False)
+    previous = set_source(ReplaySource(page_symbols=250))
+    yield app_module.app.test_client()
+    set_source(previous)
+
+
+@pytest.mark.parametrize('query', ["page=abc", "page_size=ten", "page=1.5"])
+def test_constituents_rejects_bad_paging(client, query):
+    response = client.get(f"/constituents?index=S%26P+500&{query}")
+    assert response.status_code == 400
+    assert "must be an integer" in response.get_json()['error']
+
+
+def test_scrape_rows_rejects_bad_paging(client):
+    response = client.post("/scrape/rows", data={'index': "S&P 500", 'page': "abc"})
+    assert response.status_code == 400
+    assert "'page'" in response.get_json()['error']
+
+
+def test_scrape_rejects_bad_paging(client):
+    response = client.post("/scrape", data={'index': "S&P 500", 'page_size': "x"})
+    assert response.status_code == 400
+
+
+def test_constituents_pages(client):
+    response = client.get("/constituents?index=S%26P+500&page=2&page_size=100&columns=Symbol")
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data['columns'] == ['Symbol']
+    assert data['rows'][0] == ['SYN0100']
+    assert data['total'] == 250 and data['has_more']
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'csv', 'xlsx'])
+def test_job_result_exports_mixed_type_columns(client, monkeypatch, file_format):
+    job = Job(symbols=["AAA", "BBB"])
+    job.status = 'done'
+    # yfinance's trailingPE is 'Infinity' for some symbols
+    job.results = [{'Symbol': "AAA", 'P/E Ratio': 'Infinity', 'Incomplete Data': False},
+                   {'Symbol': "BBB", 'P/E Ratio': 12.5, 'Incomplete Data': True}]
+    monkeypatch.setitem(app_module.job_manager.jobs, job.id, job)
+
+    response = client.get(f"/jobs/{job.id}/result?format={file_format}")
+    assert response.status_code == 200
+    read = {'parquet': pd.read_parquet, 'csv': pd.read_csv, 'xlsx': pd.read_excel}[file_format]
+    results = read(io.BytesIO(response.data))
+    assert list(results['Symbol']) == ["AAA", "BBB"]
+    assert results['P/E Ratio'].iloc[1] == 12.5
+
+
+def test_first_request_starts_the_constituent_refresh(client, monkeypatch):
+    started = []
+    monkeypatch.setitem(app_module.app.config, 'CONSTITUENT_REFRESH', True)
+    monkeypatch.setattr(default_service, 'start_background_refresh', started.append)
+    client.get("/metrics")
+    assert started == [app_module.index_info]
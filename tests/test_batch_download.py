@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+import SymbolScraping
+from data_sources import ReplaySource, set_source
+
+SYMBOLS = [f"SYN{i:04d}" for i in range(1, 8)]
+
+
+class BatchSource(ReplaySource):
+    """ReplaySource recording its download / history calls, the dropped symbols never come back from a download."""
+
+    def __init__(self, dropped=(), **kwargs):
+        super().__init__(**kwargs)
+        self.dropped = set(dropped)
+        self.downloads = []
+        self.histories = []
+
+    def download(self, symbols, **download_args):
+        self.downloads.append(list(symbols))
+        return super().download([symbol for symbol in symbols if symbol not in self.dropped], **download_args)
+
+    def history(self, symbol, start=None, end=None):
+        self.histories.append(symbol)
+        return super().history(symbol, start, end)
+
+
+@pytest.fixture
+def use_source():
+    previous = SymbolScraping.get_source()
+
+    def use(source):
+        set_source(source)
+        return source
+
+    yield use
+    set_source(previous)
+
+
+def test_batch_is_downloaded_in_chunks_and_split_per_symbol(use_source):
+    source = use_source(BatchSource(seed=4))
+    histories = SymbolScraping.download_history_batch(SYMBOLS, chunk_size=3, request=SymbolScraping.direct_request)
+
+    assert source.downloads == [SYMBOLS[0:3], SYMBOLS[3:6], SYMBOLS[6:7]]
+    assert list(histories) == SYMBOLS
+    for symbol in SYMBOLS:
+        # The chunk frame is aligned on every symbol's dates, a late listing gets back only its own rows
+        expected = ReplaySource(seed=4).history(symbol)
+        pd.testing.assert_frame_equal(histories[symbol], expected, check_freq=False, check_names=False)
+
+
+def test_columns_and_on_chunk(use_source):
+    use_source(BatchSource(seed=4))
+    chunks = []
+    histories = SymbolScraping.download_history_batch(SYMBOLS, chunk_size=4, request=SymbolScraping.direct_request,
+                                                      columns=['Close', 'Volume'], on_chunk=chunks.append)
+    assert histories == {}
+    assert [list(chunk) for chunk in chunks] == [SYMBOLS[:4], SYMBOLS[4:]]
+    assert all(list(hist.columns) == ['Close', 'Volume'] for chunk in chunks for hist in chunk.values())
+
+
+def test_symbols_missing_from_the_batch_fall_back_to_single_requests(use_source):
+    source = use_source(BatchSource(dropped={"SYN0003"}, seed=4))
+    results = SymbolScraping.enrich_symbols(SYMBOLS, "2018-01-01", "2020-01-01", chunk_size=3, workers=2, rate=1000.0)
+
+    assert [result['Symbol'] for result in results] == SYMBOLS
+    # SYN0003 is asked for again in the batch once, then on its own
+    assert source.downloads == [SYMBOLS[0:3], ["SYN0003"], SYMBOLS[3:6], SYMBOLS[6:7]]
+    assert [symbol for symbol in source.histories if not symbol.startswith('^')] == ["SYN0003"]
+
+    fallback = next(result for result in results if result['Symbol'] == "SYN0003")
+    batched = next(result for result in results if result['Symbol'] == "SYN0001")
+    assert fallback.keys() == batched.keys()
+    assert fallback['Total Volume'] > 0
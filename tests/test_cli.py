@@ -0,0 +1,66 @@
+import json
+import subprocess
+import sys
+
+import cli
+
+HEAVY_MODULES = ['writers', 'constituents', 'pipeline', 'journal', 'price_store', 'metrics', 'yfinance']
+
+
+def test_cli_and_lookup_imports_stay_light():
+    code = ("import sys, cli, SymbolScraping; "
+            f"print([module for module in {HEAVY_MODULES!r} if module in sys.modules])")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=cli.os.path.dirname(cli.__file__)).stdout
+    assert output.strip() == "[]"
+
+
+def test_lookup_runs_the_symbols_concurrently(capsys):
+    symbols = ["SYN0001", "SYN0002", "SYN0003"]
+    try:
+        status = cli.main(["lookup", *symbols, "--replay", "--workers", "3", "--rate", "100", "--format", "json",
+                           "--start", "2020-01-01", "--end", "2021-01-01"])
+    finally:
+        from data_sources import YFinanceSource, set_source
+        set_source(YFinanceSource())
+    results = json.loads(capsys.readouterr().out)
+    assert status == 0
+    assert list(results) == symbols
+    assert all(results[symbol]['Symbol'] == symbol for symbol in symbols)
+
+
+def test_lookup_json_is_strict(capsys):
+    try:
+        # Two months: too short for the SMAs, so they're NaN
+        status = cli.main(["lookup", "SYN0001", "--replay", "--rate", "100", "--format", "json",
+                           "--start", "2024-06-01", "--end", "2024-08-01"])
+    finally:
+        from data_sources import YFinanceSource, set_source
+        set_source(YFinanceSource())
+
+    def reject(constant):
+        raise ValueError(f"Invalid JSON constant {constant}")
+
+    results = json.loads(capsys.readouterr().out, parse_constant=reject)
+    assert status == 0
+    assert results['SYN0001']['SMA 200'] is None
+    assert isinstance(results['SYN0001']['Max Drawdown'], float)
+
+
+def test_enrich_sheet_price_store_options(tmp_path):
+    import numpy as np
+    import pandas as pd
+
+    symbols_file = tmp_path / "symbols.xlsx"
+    pd.DataFrame({'Symbol': ["SYN0001", "SYN0002"]}).to_excel(symbols_file, sheet_name="SP500", index=False)
+    store_path = tmp_path / "store"
+    try:
+        status = cli.main(["enrich-sheet", str(symbols_file), "-o", str(tmp_path / "enriched.csv"), "--replay",
+                           "--rate", "100", "--start", "2020-01-01", "--end", "2021-01-01",
+                           "--price-store", str(store_path), "--float32"])
+    finally:
+        from data_sources import YFinanceSource, set_source
+        set_source(YFinanceSource())
+    assert status == 0
+    assert len(pd.read_csv(tmp_path / "enriched.csv")) == 2
+    assert np.load(store_path / "Close.npy", mmap_mode='r').dtype == np.float32
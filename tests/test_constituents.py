@@ -0,0 +1,109 @@
+import threading
+import urllib.error
+
+import pytest
+
+from constituents import ConstituentService
+from data_sources import DataSource, set_source
+
+URL = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+
+
+class PageSource(DataSource):
+    """Serves a one table page with an ETag, answers 304 to a request carrying that ETag. Records the request headers,
+    and page() waits for the gate event when one is set.
+    """
+
+    def __init__(self, symbols=("AAA", "BBB")):
+        self.symbols = list(symbols)
+        self.etag = '"v1"'
+        self.requests = []
+        self.gate = None
+
+    def page(self, url, headers=None):
+        headers = headers or {}
+        self.requests.append(headers)
+        if self.gate is not None:
+            self.gate.wait(5)
+        if headers.get("If-None-Match") == self.etag:
+            raise urllib.error.HTTPError(url, 304, "Not Modified", {}, None)
+        rows = "".join(f"<tr><td>{symbol}</td></tr>" for symbol in self.symbols)
+        return f"<table><tr><th>Symbol</th></tr>{rows}</table>".encode('utf-8'), {"ETag": self.etag}
+
+
+@pytest.fixture
+def source():
+    source = PageSource()
+    previous = set_source(source)
+    yield source
+    set_source(previous)
+
+
+@pytest.fixture
+def service(tmp_path):
+    return ConstituentService(cache_dir=str(tmp_path / "constituents"), max_age=3600)
+
+
+def test_fresh_table_is_served_from_memory(service, source):
+    assert list(service.get("S&P 500", URL, 0)['Symbol']) == ["AAA", "BBB"]
+    service.get("S&P 500", URL, 0)
+    assert len(source.requests) == 1
+
+
+def test_least_recently_used_index_is_evicted(service, source):
+    service.max_entries = 2
+    for index_name in ("A", "B", "C"):
+        service.get(index_name, URL, 0)
+    assert list(service.memory) == ["B", "C"]
+    service.get("B", URL, 0)
+    service.get("D", URL, 0)
+    assert list(service.memory) == ["B", "D"]
+    # The evicted table is still on disk, reading it back doesn't hit the page
+    service.get("A", URL, 0)
+    assert len(source.requests) == 4
+
+
+def test_stale_table_is_revalidated_with_its_etag(service, source):
+    service.get("S&P 500", URL, 0)
+    service.max_age = 0
+    checked_at = service.memory["S_P_500"]['checked_at']
+    source.symbols = ["CHANGED"]
+    # Not modified: the cached table is kept and its timestamp bumped
+    assert list(service.get("S&P 500", URL, 0)['Symbol']) == ["AAA", "BBB"]
+    assert source.requests[-1] == {"If-None-Match": '"v1"'}
+    assert service.memory["S_P_500"]['checked_at'] >= checked_at
+
+    source.etag = '"v2"'
+    assert list(service.get("S&P 500", URL, 0)['Symbol']) == ["CHANGED"]
+    assert service.memory["S_P_500"]['etag'] == '"v2"'
+
+
+def test_non_blocking_get_returns_the_stale_copy(service, source):
+    service.get("S&P 500", URL, 0)
+    service.max_age = 0
+    source.etag = '"v2"'
+    source.symbols = ["NEW"]
+    source.gate = threading.Event()
+
+    # The refresh waits on the gate, the stale table comes back right away
+    assert list(service.get("S&P 500", URL, 0, block=False)['Symbol']) == ["AAA", "BBB"]
+    assert service.refreshing == {"S&P 500"}
+    source.gate.set()
+    for _ in range(100):
+        if not service.refreshing:
+            break
+        threading.Event().wait(0.05)
+    assert list(service.memory["S_P_500"]['table']['Symbol']) == ["NEW"]
+
+
+def test_only_one_background_refresh_runs(service, source):
+    service.max_age = 3600
+    indices = {"S&P 500": {"url": URL, "table_index": 0}}
+    thread = service.start_background_refresh(indices)
+    assert service.start_background_refresh(indices) is thread
+    # Let its first pass finish on the fake source, the thread then sleeps for the hour
+    for _ in range(100):
+        if "S_P_500" in service.memory:
+            break
+        threading.Event().wait(0.05)
+    assert len(source.requests) == 1
@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from data_sources import RateLimitError, RecordingSource, ReplaySource
+
+
+def replay_calls(source, symbols):
+    """history of every symbol through source, None for the calls that got an injected 429."""
+    frames = []
+    for symbol in symbols:
+        try:
+            frames.append(source.history(symbol))
+        except RateLimitError:
+            frames.append(None)
+    return frames
+
+
+SYMBOLS = [f"SYN{i:04d}" for i in range(40)]
+
+
+def test_same_seed_replays_the_same_run():
+    first, second = ReplaySource(seed=5, error_rate=0.3), ReplaySource(seed=5, error_rate=0.3)
+    first_frames, second_frames = replay_calls(first, SYMBOLS), replay_calls(second, SYMBOLS)
+    assert first.injected_errors == second.injected_errors > 0
+    assert [frame is None for frame in first_frames] == [frame is None for frame in second_frames]
+    for a, b in zip(first_frames, second_frames):
+        if a is not None:
+            pd.testing.assert_frame_equal(a, b)
+    assert first.info("SYN0001") == second.info("SYN0001")
+
+
+def test_other_seed_gives_other_prices():
+    a, b = ReplaySource(seed=1).history("SYN0001"), ReplaySource(seed=2).history("SYN0001")
+    assert not a['Close'].equals(b['Close'])
+
+
+def test_error_rate_is_injected():
+    assert ReplaySource(seed=0).injected_errors == 0
+    source = ReplaySource(seed=0, error_rate=0.25)
+    frames = replay_calls(source, SYMBOLS * 10)
+    assert source.calls == 400
+    assert source.injected_errors == sum(frame is None for frame in frames)
+    assert 60 < source.injected_errors < 140
+    with pytest.raises(RateLimitError):
+        ReplaySource(error_rate=1.0).info("SYN0001")
+
+
+def test_missing_symbol_and_ranges():
+    source = ReplaySource(missing={"GONE"})
+    assert source.history("GONE").empty
+    hist = source.history("SYN0001", "2020-01-01", "2021-01-01")
+    assert hist.index.min() >= pd.Timestamp("2020-01-01") and hist.index.max() < pd.Timestamp("2021-01-01")
+    data = source.download(["SYN0001", "GONE"], start="2020-01-01", end="2021-01-01", group_by='ticker')
+    assert list(data.columns.get_level_values(0).unique()) == ["SYN0001"]
+    pd.testing.assert_frame_equal(data["SYN0001"], hist, check_freq=False)
+
+
+def test_recorded_fixtures_are_replayed(tmp_path):
+    fixtures = str(tmp_path / "fixtures")
+    # Record from one synthetic source, replay with another seed: the fixtures win over the synthetic data
+    recorder = RecordingSource(fixtures, source=ReplaySource(seed=1))
+    recorded = recorder.history("SYN0001")
+    info = recorder.info("SYN0001")
+    body, _ = recorder.page("https://en.wikipedia.org/wiki/Nasdaq-100")
+
+    replay = ReplaySource(seed=2, fixtures_dir=fixtures)
+    replayed = replay.history("SYN0001")
+    pd.testing.assert_series_equal(replayed['Close'], recorded['Close'], check_freq=False, check_names=False,
+                                   check_index_type=False)
+    assert replayed.index.equals(pd.DatetimeIndex(recorded.index))
+    assert replay.info("SYN0001") == info
+    assert replay.page("https://en.wikipedia.org/wiki/Nasdaq-100")[0] == body
+    # A symbol without a fixture is still synthesized
+    assert not replay.history("SYN0002").empty
@@ -0,0 +1,135 @@
+import pytest
+
+from data_sources import get_source, set_source
+from distributed import WorkQueue, run_worker
+
+CONFIG = {'start_date': "2020-01-01", 'end_date': "2021-01-01", 'chunk_size': 10, 'indicators': None,
+          'market_index': '^GSPC'}
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "queue.sqlite")
+
+
+@pytest.fixture
+def queue(queue_path):
+    queue = WorkQueue(queue_path)
+    yield queue
+    queue.close()
+
+
+def shard_rows(queue, run_id):
+    with queue.lock:
+        return queue.conn.execute("SELECT shard, status, worker, attempts, error FROM shards WHERE run = ? ORDER BY shard",
+                                  (run_id,)).fetchall()
+
+
+def test_run_is_cut_into_shards(queue):
+    run_id = queue.create_run(["A", "B", "C", "B", "D", "E"], CONFIG, shard_size=2)
+    assert queue.progress(run_id) == {'pending': 3, 'leased': 0, 'done': 0, 'failed': 0, 'shards': 3,
+                                      'ok_symbols': 0, 'failed_symbols': 0, 'symbols': 5}
+    assert queue.run_config(run_id) == CONFIG
+    assert queue.claim('w1', run_id=run_id) == (run_id, 0, ["A", "B"])
+    assert queue.claim('w2', run_id=run_id) == (run_id, 1, ["C", "D"])
+    assert queue.claim('w3', run_id=run_id) == (run_id, 2, ["E"])
+    assert queue.claim('w4', run_id=run_id) is None
+
+
+def test_only_the_lease_holder_renews(queue):
+    run_id = queue.create_run(["A", "B"], CONFIG)
+    _, shard, _ = queue.claim('w1')
+    assert queue.renew(run_id, shard, 'w1')
+    assert not queue.renew(run_id, shard, 'w2')
+
+
+def test_expired_lease_is_taken_over(queue):
+    run_id = queue.create_run(["A", "B"], CONFIG)
+    _, shard, _ = queue.claim('dead', lease_seconds=-1)
+    assert queue.claim('other', lease_seconds=600) == (run_id, shard, ["A", "B"])
+    assert shard_rows(queue, run_id) == [(0, 'leased', 'other', 2, None)]
+    # The worker that lost the lease can't renew it anymore, and a live lease isn't handed out again
+    assert not queue.renew(run_id, shard, 'dead')
+    assert queue.claim('third') is None
+    # Nor can it mark the shard done under the new holder
+    assert not queue.complete(run_id, shard, 'dead', {"A": {'Symbol': "A"}}, {"B": "timeout"})
+    assert shard_rows(queue, run_id) == [(0, 'leased', 'other', 2, None)]
+    assert queue.complete(run_id, shard, 'other', {"B": {'Symbol': "B"}}, {})
+    assert shard_rows(queue, run_id) == [(0, 'done', 'other', 2, None)]
+    assert sorted(result['Symbol'] for result in queue.results(run_id)) == ["A", "B"]
+
+
+def test_released_shard_is_retried_right_away(queue):
+    run_id = queue.create_run(["A"], CONFIG)
+    queue.claim('w1')
+    queue.release(run_id, 0, 'w1', RuntimeError("boom"))
+    assert shard_rows(queue, run_id) == [(0, 'pending', 'w1', 1, "boom")]
+    assert queue.claim('w2') == (run_id, 0, ["A"])
+
+
+def test_shard_fails_once_out_of_attempts(queue):
+    run_id = queue.create_run(["A", "B", "C"], CONFIG, shard_size=2, max_attempts=2)
+    # Shard 0 is leased twice by workers that die, shard 1 is done
+    assert queue.claim('w1', lease_seconds=-1, run_id=run_id)[1] == 0
+    assert queue.claim('w2', lease_seconds=-1, run_id=run_id)[1] == 0
+    assert queue.claim('w3', run_id=run_id)[1] == 1
+    queue.complete(run_id, 1, 'w3', {"C": {'Symbol': "C"}}, {})
+    assert queue.claim('w4', run_id=run_id) is None
+    assert queue.finished(run_id)
+    assert queue.idle(run_id)
+    assert queue.failures(run_id) == {"A": "Shard failed after 2 attempts: lease expired",
+                                      "B": "Shard failed after 2 attempts: lease expired"}
+    assert queue.progress(run_id) == {'pending': 0, 'leased': 0, 'done': 1, 'failed': 1, 'shards': 2,
+                                      'ok_symbols': 1, 'failed_symbols': 2, 'symbols': 3}
+
+
+def test_release_of_the_last_attempt_fails_the_shard(queue):
+    run_id = queue.create_run(["A"], CONFIG, max_attempts=1)
+    queue.claim('w1')
+    queue.release(run_id, 0, 'w1', "no data")
+    assert queue.finished(run_id)
+    assert queue.failures(run_id) == {"A": "Shard failed after 1 attempts: no data"}
+
+
+def test_a_result_is_kept_over_a_later_failure(queue):
+    run_id = queue.create_run(["A", "B"], CONFIG)
+    queue.claim('slow', lease_seconds=-1)
+    queue.claim('fast')
+    queue.complete(run_id, 0, 'fast', {"A": {'Symbol': "A"}}, {"B": "timeout"})
+    # The slow worker comes back after its lease was taken over
+    queue.complete(run_id, 0, 'slow', {"B": {'Symbol': "B"}}, {"A": "timeout"})
+    assert sorted(result['Symbol'] for result in queue.results(run_id)) == ["A", "B"]
+    assert queue.failures(run_id) == {}
+    assert queue.finished(run_id)
+
+
+def test_worker_takes_over_an_expired_shard(queue, queue_path):
+    symbols = [f"SYN{i:04d}" for i in range(1, 5)]
+    run_id = queue.create_run(symbols, CONFIG, shard_size=2)
+    queue.claim('dead', lease_seconds=0.5, run_id=run_id)
+
+    previous = get_source()
+    try:
+        shards_done = run_worker(queue_path, run_id=run_id, worker_id='live', workers=2, rate=100.0, replay={}, poll=0.2)
+    finally:
+        set_source(previous)
+
+    assert shards_done == 2
+    assert [(shard, status, worker, attempts) for shard, status, worker, attempts, _ in shard_rows(queue, run_id)] == [
+        (0, 'done', 'live', 2), (1, 'done', 'live', 1)]
+    assert sorted(result['Symbol'] for result in queue.results(run_id)) == symbols
+    assert queue.failures(run_id) == {}
+
+
+def test_coordinator_gives_up_on_a_worker_crashing_at_startup(tmp_path, queue_path):
+    import pandas as pd
+    from distributed import distributed_upload
+
+    sheet = str(tmp_path / "symbols.xlsx")
+    pd.DataFrame({'Symbol': ["SYN0001", "SYN0002"]}).to_excel(sheet, sheet_name="SP500", index=False)
+    # The cache directory is a file, so every worker dies creating it
+    cache_dir = tmp_path / "not_a_directory"
+    cache_dir.write_text("")
+    with pytest.raises(RuntimeError, match="died 2 times"):
+        distributed_upload(sheet, queue_path=queue_path, processes=1, replay={}, cache_dir=str(cache_dir), poll=0.1,
+                           max_restarts=1)
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators import IndicatorSet, incremental_indicators
+from market_benchmarks import Benchmark
+from price_cache import PriceCache
+
+CONFIG = {'sma': (20, 50), 'ema': (12,), 'volatility': (20,), 'beta': (60,), 'drawdown': (30,)}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = PriceCache(str(tmp_path / "prices.sqlite"))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def history():
+    rng = np.random.default_rng(1)
+    dates = pd.bdate_range("2015-01-01", "2024-01-01")
+    close = 100 * np.exp(np.cumsum(rng.normal(0.0005, 0.02, len(dates))))
+    return pd.DataFrame({'Close': close}, index=dates)
+
+
+@pytest.fixture
+def market(history):
+    rng = np.random.default_rng(2)
+    return pd.Series(rng.normal(0, 0.01, len(history)), index=history.index)
+
+
+def from_scratch(hist, market):
+    indicator_set = IndicatorSet(CONFIG)
+    indicator_set.update_frame(hist, market)
+    return indicator_set.values()
+
+
+def assert_same_values(values, expected):
+    assert values.keys() == expected.keys()
+    for name in expected:
+        np.testing.assert_allclose(values[name], expected[name], rtol=1e-9, equal_nan=True, err_msg=name)
+
+
+def test_daily_refresh_matches_from_scratch(cache, history, market):
+    incremental_indicators('AAA', history[:"2022-01-01"], market, CONFIG, cache)
+    values = incremental_indicators('AAA', history, market, CONFIG, cache)
+    assert_same_values(values, from_scratch(history, market))
+
+
+def test_earlier_end_date_rebuilds_the_state(cache, history, market):
+    incremental_indicators('AAA', history, market, CONFIG, cache)
+    shorter = history[:"2020-01-01"]
+    values = incremental_indicators('AAA', shorter, market, CONFIG, cache)
+    assert_same_values(values, from_scratch(shorter, market))
+
+
+def test_revised_last_bar_is_fed_again(cache, history, market):
+    # First run ends on an intraday bar, the next cache refresh rewrites its close and adds a bar
+    intraday = history[:"2022-01-03"].copy()
+    intraday.iloc[-1, 0] *= 1.05
+    incremental_indicators('AAA', intraday, market, CONFIG, cache)
+    final = history[:"2022-01-04"]
+    values = incremental_indicators('AAA', final, market, CONFIG, cache)
+    assert_same_values(values, from_scratch(final, market))
+
+
+def test_revised_older_close_rebuilds_the_state(cache, history, market):
+    incremental_indicators('AAA', history[:"2022-01-01"], market, CONFIG, cache)
+    # Split adjusted history: every close before the split halves
+    adjusted = history.copy()
+    adjusted.loc[:"2023-01-01", 'Close'] /= 2
+    values = incremental_indicators('AAA', adjusted, market, CONFIG, cache)
+    assert_same_values(values, from_scratch(adjusted, market))
+
+
+def test_same_history_twice(cache, history, market):
+    first = incremental_indicators('AAA', history, market, CONFIG, cache)
+    assert_same_values(incremental_indicators('AAA', history, market, CONFIG, cache), first)
+
+
+def test_benchmark_market_returns(history, market):
+    close = (1 + market).cumprod() * 100
+    benchmark = Benchmark('^TEST', close)
+    assert_same_values(from_scratch(history, benchmark), from_scratch(history, benchmark.returns))
+
+
+def test_state_is_kept_per_benchmark(cache, history, market):
+    first = Benchmark('^ONE', (1 + market).cumprod() * 100)
+    other_market = pd.Series(np.random.default_rng(3).normal(0, 0.01, len(history)), index=history.index)
+    second = Benchmark('^TWO', (1 + other_market).cumprod() * 100)
+
+    incremental_indicators('AAA', history[:"2022-01-01"], first, CONFIG, cache)
+    values = incremental_indicators('AAA', history, second, CONFIG, cache)
+    assert_same_values(values, from_scratch(history, second))
+    assert not np.isclose(values['Beta 60'], from_scratch(history, first)['Beta 60'])
@@ -0,0 +1,33 @@
+import os
+import time
+
+from jobs import Job, JobManager
+from journal import RunJournal
+
+
+def finished_job(manager, finished_at):
+    job = Job(symbols=["AAA"])
+    job.journal = RunJournal(os.path.join(manager.jobs_dir, f"{job.id}.jsonl"))
+    job.journal.record_failure("AAA", "boom")
+    job.status = 'failed'
+    job.finished_at = finished_at
+    manager.jobs[job.id] = job
+    return job
+
+
+def test_prune_drops_old_and_extra_finished_jobs(tmp_path):
+    manager = JobManager(jobs_dir=str(tmp_path), keep_jobs=2, job_ttl_hours=1)
+    now = time.time()
+    expired = finished_job(manager, now - 2 * 3600)
+    oldest = finished_job(manager, now - 30)
+    kept = [finished_job(manager, now - 20), finished_job(manager, now - 10)]
+    running = Job(symbols=["BBB"])
+    manager.jobs[running.id] = running
+
+    manager.prune()
+
+    assert set(manager.jobs) == {job.id for job in kept} | {running.id}
+    for job in (expired, oldest):
+        assert not os.path.exists(job.journal.path)
+    for job in kept:
+        assert os.path.exists(job.journal.path)
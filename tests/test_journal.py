@@ -0,0 +1,91 @@
+import json
+
+import pandas as pd
+import pytest
+
+import SymbolScraping
+from constituents import default_service
+from data_sources import ReplaySource, set_source
+from journal import RunJournal
+
+RUN = {'sheet': "SP500", 'start_date': "2020-01-01", 'end_date': "2021-01-01", 'indicators': {'sma': (20, 50)},
+       'market_index': '^GSPC'}
+
+
+def test_resume_skips_the_symbols_done(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    journal = RunJournal(path, run=RUN)
+    journal.record_result("AAA", {'Symbol': "AAA"})
+    journal.record_failure("BBB", "timeout")
+
+    resumed = RunJournal(path, run=RUN)
+    assert resumed.pending(["AAA", "BBB", "CCC"]) == ["BBB", "CCC"]
+    assert resumed.pending(["AAA", "BBB", "CCC"], retry_failed=False) == ["CCC"]
+    assert resumed.results() == [{'Symbol': "AAA"}]
+
+
+@pytest.mark.parametrize('change', [{'end_date': "2022-01-01"}, {'sheet': "NASDAQ"}, {'indicators': None},
+                                    {'market_index': '^IXIC'}])
+def test_journal_of_another_run_is_refused(tmp_path, change):
+    path = str(tmp_path / "run.jsonl")
+    RunJournal(path, run=RUN).record_result("AAA", {'Symbol': "AAA"})
+    with pytest.raises(ValueError, match="another run"):
+        RunJournal(path, run={**RUN, **change})
+
+
+def test_journal_without_a_header_is_refused(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    RunJournal(path).record_result("AAA", {'Symbol': "AAA"})
+    with pytest.raises(ValueError, match="no run header"):
+        RunJournal(path, run=RUN)
+
+
+def test_partial_last_line_is_dropped(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    journal = RunJournal(path, run=RUN)
+    journal.record_result("AAA", {'Symbol': "AAA"})
+    # A crash in the middle of writing BBB
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"symbol": "BBB", "status": "ok", "da')
+
+    resumed = RunJournal(path, run=RUN)
+    assert resumed.pending(["AAA", "BBB"]) == ["BBB"]
+    resumed.record_result("BBB", {'Symbol': "BBB"})
+    with open(path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert [line.get('symbol') for line in lines] == [None, "AAA", "BBB"]
+    assert RunJournal(path, run=RUN).pending(["AAA", "BBB"]) == []
+
+
+def test_partial_header_starts_over(tmp_path):
+    path = tmp_path / "run.jsonl"
+    path.write_text('{"run": {"sheet": "SP5')
+    journal = RunJournal(str(path), run=RUN)
+    assert journal.entries == {}
+    assert RunJournal(str(path), run=RUN).run == journal.run
+
+
+@pytest.fixture
+def replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(default_service, 'cache_dir', str(tmp_path / "constituents"))
+    previous = set_source(ReplaySource())
+    yield
+    set_source(previous)
+
+
+def test_upload_refuses_the_journal_of_another_run(tmp_path, replay):
+    sheet = str(tmp_path / "symbols.xlsx")
+    pd.DataFrame({'Symbol': [f"SYN{i:04d}" for i in range(1, 6)]}).to_excel(sheet, sheet_name="SP500", index=False)
+    journal = str(tmp_path / "run.jsonl")
+    output = tmp_path / "out.csv"
+
+    SymbolScraping.upload_symbol_script(sheet, start_date="2020-01-01", end_date="2021-01-01", output_file_path=str(output),
+                                        journal_path=journal, rate=1000)
+    assert RunJournal(journal).completed() == {f"SYN{i:04d}" for i in range(1, 6)}
+    written = output.read_bytes()
+
+    with pytest.raises(ValueError, match="end_date"):
+        SymbolScraping.upload_symbol_script(sheet, start_date="2020-01-01", end_date="2022-01-01",
+                                            output_file_path=str(output), journal_path=journal, rate=1000)
+    # Refused before the output was opened
+    assert output.read_bytes() == written
@@ -0,0 +1,46 @@
+import pytest
+
+from data_sources import ReplaySource, set_source
+from market_benchmarks import BenchmarkRegistry
+
+
+@pytest.fixture
+def source():
+    source = ReplaySource(seed=1)
+    previous = set_source(source)
+    yield source
+    set_source(previous)
+
+
+def test_benchmark_is_loaded_once(source):
+    registry = BenchmarkRegistry()
+    first = registry.get('^GSPC', '2018-01-01', '2020-01-01')
+    assert registry.get('^GSPC', '2018-01-01', '2020-01-01') is first
+    # A narrower range is sliced out of the prices already loaded
+    registry.get('^GSPC', '2018-06-01', '2019-06-01')
+    assert source.calls == 1
+
+
+def test_expired_benchmark_is_reloaded(source, monkeypatch):
+    import market_benchmarks
+
+    now = 1_000_000.0
+    monkeypatch.setattr(market_benchmarks.time, 'time', lambda: now)
+    registry = BenchmarkRegistry(ttl_hours=12)
+    first = registry.get('^GSPC', '2018-01-01', '2020-01-01')
+    now += 11 * 3600
+    assert registry.get('^GSPC', '2018-01-01', '2020-01-01') is first
+    now += 2 * 3600
+    assert registry.get('^GSPC', '2018-01-01', '2020-01-01') is not first
+    assert source.calls == 2
+
+
+def test_least_recently_used_range_is_dropped(source):
+    registry = BenchmarkRegistry(max_benchmarks=2)
+    first = registry.get('^GSPC', '2018-01-01', '2020-01-01')
+    registry.get('^GSPC', '2018-01-01', '2019-01-01')
+    registry.get('^GSPC', '2018-01-01', '2020-01-01')
+    registry.get('^GSPC', '2019-01-01', '2020-01-01')
+    assert len(registry.benchmarks) == 2
+    assert registry.get('^GSPC', '2018-01-01', '2020-01-01') is first
+    assert [(start.year, end.year) for _, start, end in registry.benchmarks] == [(2019, 2020), (2018, 2020)]
@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from market_benchmarks import Benchmark
+from metrics import METRIC_COLUMNS, compute_metrics_matrix, compute_metrics_store
+from price_store import PriceStore, PriceStoreBuilder
+from SymbolScraping import compute_stock_metrics, slice_history
+
+START_DATE = "2018-01-01"
+END_DATE = "2023-06-30"
+TEXT_COLUMNS = ['Incomplete Data', 'Data Range', 'First Trading Date', 'Historical Range']
+
+
+def synthetic_histories(count=40, seed=7):
+    """Random walks on a business day calendar, some listed late (in and after the range), some with missing days."""
+    rng = np.random.default_rng(seed)
+    calendar = pd.bdate_range("2015-01-01", "2024-01-01")
+    histories = {}
+    for i in range(count):
+        dates = calendar
+        if i % 5 == 1:
+            dates = dates[rng.integers(len(dates) // 2, len(dates) - 300):]
+        if i % 7 == 2:
+            dates = dates[rng.random(len(dates)) > 0.1]
+        close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, len(dates))))
+        histories[f"S{i:02d}"] = pd.DataFrame({'Close': close, 'Volume': rng.integers(1_000, 100_000, len(dates)).astype(float)},
+                                               index=dates)
+    # Listed after the end of the range: no result on either path
+    histories["LATE"] = pd.DataFrame({'Close': [10.0, 11.0], 'Volume': [1.0, 2.0]}, index=pd.to_datetime(["2023-09-01", "2023-09-04"]))
+    return histories
+
+
+def market_close(seed=3):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2015-01-01", "2024-01-01")
+    # Market holidays the symbols traded on, so aligning the market matters
+    dates = dates[rng.random(len(dates)) > 0.02]
+    return pd.Series(3000 * np.exp(np.cumsum(rng.normal(0.0002, 0.01, len(dates)))), index=dates)
+
+
+def market_returns():
+    return market_close().pct_change().dropna()
+
+
+def per_symbol_metrics(histories, market):
+    """The fetch_stock_data path: adjust the start to the first trading date, slice, compute_stock_metrics."""
+    rows = {}
+    for symbol, hist in histories.items():
+        first_trading_date = hist.index.min().strftime('%Y-%m-%d')
+        start_date = max(START_DATE, first_trading_date)
+        sliced = slice_history(hist, start_date, END_DATE)
+        if sliced.empty:
+            continue
+        data = compute_stock_metrics(symbol, sliced, {}, market, start_date, END_DATE, first_trading_date)
+        rows[symbol] = {column: data[column] for column in METRIC_COLUMNS}
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def assert_same_metrics(vectorized, expected):
+    assert sorted(vectorized.index) == sorted(expected.index)
+    vectorized = vectorized.loc[expected.index]
+    for column in METRIC_COLUMNS:
+        if column in TEXT_COLUMNS:
+            assert list(vectorized[column]) == list(expected[column]), column
+        else:
+            np.testing.assert_allclose(vectorized[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float),
+                                       rtol=1e-9, atol=1e-12, equal_nan=True, err_msg=column)
+
+
+@pytest.fixture(scope='module')
+def histories():
+    return synthetic_histories()
+
+
+@pytest.fixture(scope='module')
+def expected(histories):
+    return per_symbol_metrics(histories, market_returns())
+
+
+def test_matrix_matches_compute_stock_metrics(histories, expected):
+    close = pd.DataFrame({symbol: hist['Close'] for symbol, hist in histories.items()}).sort_index()
+    volume = pd.DataFrame({symbol: hist['Volume'] for symbol, hist in histories.items()}).sort_index()
+    assert_same_metrics(compute_metrics_matrix(close, volume, market_returns(), START_DATE, END_DATE), expected)
+
+
+@pytest.mark.parametrize('block_size', [500, 7])
+def test_store_matches_compute_stock_metrics(histories, expected, block_size):
+    store = PriceStore.from_histories(histories)
+    assert_same_metrics(compute_metrics_store(store, market_returns(), START_DATE, END_DATE, block_size=block_size), expected)
+
+
+def test_memory_mapped_store_matches(histories, expected, tmp_path):
+    PriceStore.from_histories(histories, path=str(tmp_path / "store"))
+    store = PriceStore.open(str(tmp_path / "store"))
+    assert_same_metrics(compute_metrics_store(store, market_returns(), START_DATE, END_DATE), expected)
+
+
+def test_benchmark_gives_the_same_metrics(histories, expected):
+    benchmark = Benchmark('^TEST', market_close())
+    assert_same_metrics(per_symbol_metrics(histories, benchmark), expected)
+    store = PriceStore.from_histories(histories)
+    assert_same_metrics(compute_metrics_store(store, benchmark, START_DATE, END_DATE), expected)
+
+
+@pytest.mark.parametrize('path', [None, "store"])
+def test_store_built_chunk_by_chunk_matches(histories, expected, tmp_path, path):
+    # The late listings come first, and one symbol trades on a Saturday the range's business days don't have
+    items = sorted(histories.items(), key=lambda item: item[1].index.min(), reverse=True)
+    weekend = histories['S00'].copy()
+    weekend.loc[pd.Timestamp("2020-06-06")] = [weekend['Close'].iloc[0], 1.0]
+    items.append(('WKND', weekend.sort_index()))
+    path = None if path is None else str(tmp_path / path)
+    builder = PriceStoreBuilder(len(items), path=path, calendar=pd.bdate_range(START_DATE, END_DATE, inclusive='left'))
+    fields = builder.fields
+    for first in range(0, len(items) - 6, 6):
+        builder.add(dict(items[first:first + 6]))
+        # Filling never reallocates the arrays
+        assert builder.fields is fields
+    builder.add(dict(items[first + 6:]))
+    store = builder.build()
+
+    whole = PriceStore.from_histories(dict(items))
+    assert store.symbols == whole.symbols
+    assert store.calendar[0] == pd.Timestamp(START_DATE)
+    assert pd.Timestamp("2020-06-06") in store.calendar
+    assert store.first_dates.equals(whole.first_dates)
+    np.testing.assert_array_equal(store.frame('Close').dropna(how='all'),
+                                  whole.frame('Close').iloc[whole.row_range(START_DATE, END_DATE)].dropna(how='all'))
+    vectorized = compute_metrics_store(store, market_returns(), START_DATE, END_DATE)
+    assert_same_metrics(vectorized.drop('WKND'), expected)
+    if path is not None:
+        assert sorted(os.listdir(path)) == ['Close.npy', 'Volume.npy', 'calendar.npy', 'first_dates.npy', 'first_rows.npy',
+                                            'last_rows.npy', 'store.json']
+
+
+def test_builder_refuses_more_symbols_than_its_capacity(histories):
+    builder = PriceStoreBuilder(2, calendar=pd.bdate_range(START_DATE, END_DATE, inclusive='left'))
+    with pytest.raises(ValueError):
+        builder.add({symbol: histories[symbol] for symbol in ('S00', 'S01', 'S03')})
@@ -0,0 +1,34 @@
+import os
+
+from pipeline import run_pipeline
+
+
+def fetch(symbol):
+    return (symbol,)
+
+
+def compute(symbol, value, scale):
+    if symbol == 'S050':
+        os._exit(1)
+    return {'Symbol': symbol, 'Value': scale}
+
+
+def square(symbol, value, scale):
+    return {'Symbol': symbol, 'Value': scale * int(value[1:]) ** 2}
+
+
+def test_pipeline_scores_every_symbol():
+    symbols = [f"S{i:03d}" for i in range(20)]
+    results = run_pipeline(symbols, fetch, square, shared_args=(2,), io_workers=4, cpu_workers=2, queue_size=2)
+    assert sorted(results) == symbols
+    assert results['S003']['Value'] == 18
+
+
+def test_dead_worker_process_stops_the_pipeline():
+    # A worker dying mid run breaks the pool, the producers blocked on the full queue must not hang the pipeline
+    symbols = [f"S{i:03d}" for i in range(200)]
+    errors = {}
+    results = run_pipeline(symbols, fetch, compute, shared_args=(1,), io_workers=4, cpu_workers=2, queue_size=2,
+                           on_error=errors.__setitem__)
+    assert 'S050' in errors
+    assert sorted([*results, *errors]) == symbols
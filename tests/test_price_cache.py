@@ -0,0 +1,240 @@
+import pandas as pd
+import pytest
+
+from price_cache import PriceCache
+
+
+def synthetic_history(start, end):
+    dates = pd.bdate_range(start, end, inclusive='left')
+    close = pd.Series(range(1, len(dates) + 1), index=dates, dtype=float)
+    return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1000.0,
+                         'Dividends': 0.0, 'Stock Splits': 0.0}, index=dates)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = PriceCache(str(tmp_path / "prices.sqlite"))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def fetch():
+    """Fake download over a 2010-2025 history, records every segment it's asked for."""
+    full = synthetic_history("2010-01-01", "2025-01-01")
+
+    def fetch(symbol, start=None, end=None):
+        fetch.calls.append((start, end))
+        hist = full if start is None else full[pd.to_datetime(start):]
+        return hist if end is None else hist[hist.index < pd.to_datetime(end)]
+
+    fetch.calls = []
+    return fetch
+
+
+def test_cold_cache_downloads_the_requested_range(cache, fetch):
+    hist = cache.get_history('AAA', '2016-01-01', '2018-01-01', fetch=fetch)
+    assert fetch.calls == [('2016-01-01', '2018-01-01')]
+    assert hist.index.min() == pd.Timestamp('2016-01-01')
+    assert hist.index.max() == pd.Timestamp('2017-12-29')
+
+
+def test_covered_range_is_served_from_the_cache(cache, fetch):
+    cache.get_history('AAA', '2016-01-01', '2018-01-01', fetch=fetch)
+    fetch.calls.clear()
+    hist = cache.get_history('AAA', '2016-06-01', '2017-06-01', fetch=fetch)
+    assert fetch.calls == []
+    assert hist.index.max() == pd.Timestamp('2017-05-31')
+
+
+def test_head_segment_is_fetched_before_the_cached_start(cache, fetch):
+    cache.get_history('AAA', '2016-01-01', '2018-01-01', fetch=fetch)
+    fetch.calls.clear()
+    hist = cache.get_history('AAA', '2014-01-01', '2018-01-01', fetch=fetch)
+    assert fetch.calls == [('2014-01-01', '2016-01-01')]
+    assert hist.index.min() == pd.Timestamp('2014-01-01')
+
+
+def test_past_end_extension_ignores_the_ttl(cache, fetch):
+    # The first range ends in the past, the tail TTL must not hold back a longer request made right after it
+    cache.get_history('AAA', '2016-01-01', '2018-01-01', fetch=fetch)
+    hist = cache.get_history('AAA', '2016-01-01', '2024-01-01', fetch=fetch)
+    assert fetch.calls[-1][1] == '2024-01-01'
+    assert hist.index.max() == pd.Timestamp('2023-12-29')
+    assert cache.coverage('AAA')['end'] == '2024-01-01'
+
+
+def test_fresh_tail_up_to_today_isnt_refetched(cache, fetch):
+    cache.get_history('AAA', '2016-01-01', None, fetch=fetch)
+    fetch.calls.clear()
+    cache.get_history('AAA', '2016-01-01', None, fetch=fetch)
+    assert fetch.calls == []
+
+
+def test_offline_cache_never_fetches(tmp_path, fetch):
+    cache = PriceCache(str(tmp_path / "prices.sqlite"), offline=True)
+    assert cache.get_history('AAA', '2016-01-01', '2018-01-01', fetch=fetch).empty
+    assert fetch.calls == []
+    cache.close()
+
+
+def test_tail_never_starts_after_the_coverage_end(cache, fetch):
+    # A period="max" download stores bars past the requested end
+    cache.store('AAA', fetch('AAA'), None, '2020-01-01')
+    assert cache.missing_segments('AAA', None, '2022-01-01') == [('2020-01-01', '2022-01-01')]
+
+
+def batch_download(full, dropped=()):
+    """Fake multi ticker yf.download over the histories of full, the dropped tickers are missing from the payload."""
+    def download(symbols, start=None, end=None, **kwargs):
+        frames = {}
+        for symbol in symbols:
+            if symbol in dropped:
+                continue
+            hist = full[symbol] if start is None else full[symbol][pd.to_datetime(start):]
+            frames[symbol] = hist if end is None else hist[hist.index < pd.to_datetime(end)]
+        return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+    return download
+
+
+def test_batch_leaves_a_symbol_missing_from_the_payload_uncovered(cache, monkeypatch):
+    import SymbolScraping
+
+    full = {symbol: synthetic_history("2010-01-01", "2025-01-01") for symbol in ('AAA', 'BBB')}
+    monkeypatch.setattr(SymbolScraping, '_timed_download', batch_download(full))
+    SymbolScraping.download_history_batch(['AAA', 'BBB'], cache=cache, end_date='2020-01-01',
+                                          request=SymbolScraping.direct_request)
+    assert cache.coverage('BBB')['end'] == '2020-01-01'
+
+    # BBB is missing from the payload and its single symbol request fails too (429)
+    def rate_limited(symbol, start=None, end=None):
+        raise RuntimeError("429 Too Many Requests")
+
+    monkeypatch.setattr(SymbolScraping, 'yf_history', rate_limited)
+    monkeypatch.setattr(SymbolScraping, '_timed_download', batch_download(full, dropped={'BBB'}))
+    histories = SymbolScraping.download_history_batch(['AAA', 'BBB'], cache=cache, end_date='2024-01-01',
+                                                      request=SymbolScraping.direct_request)
+    assert histories['AAA'].index.max() == pd.Timestamp('2023-12-29')
+    assert cache.coverage('AAA')['end'] == '2024-01-01'
+    # BBB's failed tail is still missing, so the next run downloads it again
+    assert cache.coverage('BBB')['end'] == '2020-01-01'
+    assert cache.missing_segments('BBB', None, '2024-01-01') == [('2020-01-01', '2024-01-01')]
+
+
+def test_batch_records_an_empty_segment(cache, monkeypatch):
+    import SymbolScraping
+
+    full = {symbol: synthetic_history("2010-01-01", "2025-01-01") for symbol in ('AAA', 'BBB')}
+    monkeypatch.setattr(SymbolScraping, '_timed_download', batch_download(full))
+    SymbolScraping.download_history_batch(['AAA', 'BBB'], cache=cache, end_date='2020-01-01',
+                                          request=SymbolScraping.direct_request)
+
+    requested = []
+
+    def history(symbol, start=None, end=None):
+        requested.append((symbol, start, end))
+        return pd.DataFrame()
+
+    # AAA was delisted since: its tail is missing from the payload and its single symbol request comes back empty
+    monkeypatch.setattr(SymbolScraping, 'yf_history', history)
+    monkeypatch.setattr(SymbolScraping, '_timed_download', batch_download(full, dropped={'AAA'}))
+    SymbolScraping.download_history_batch(['AAA', 'BBB'], cache=cache, end_date='2024-01-01',
+                                          request=SymbolScraping.direct_request)
+    assert requested == [('AAA', '2020-01-01', '2024-01-01')]
+    assert cache.coverage('AAA')['end'] == '2024-01-01'
+    assert cache.missing_segments('AAA', None, '2024-01-01') == []
+
+
+def test_symbol_without_any_bars_is_recorded(cache):
+    cache.store('GONE', pd.DataFrame(), None, '2020-01-01')
+    assert cache.coverage('GONE')['end'] == '2020-01-01'
+    assert cache.missing_segments('GONE', None, '2020-01-01') == []
+    assert cache.get_history('GONE', None, '2020-01-01').empty
+
+
+def test_touch_keeps_read_symbols_from_eviction(cache, fetch):
+    for symbol in ('AAA', 'BBB', 'CCC'):
+        cache.get_history(symbol, '2016-01-01', '2017-01-01', fetch=fetch)
+    cache.conn.execute("UPDATE coverage SET accessed_at = 0")
+    cache.load('AAA', touch=False)
+    cache.touch(['AAA', 'BBB'])
+    cache.evict(max_age_days=1)
+    assert cache.coverage('AAA') is not None and cache.coverage('BBB') is not None
+    assert cache.coverage('CCC') is None
+
+
+def test_cache_file_uses_wal(cache):
+    assert cache.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert cache.conn.execute("PRAGMA busy_timeout").fetchone()[0] > 0
+
+
+def test_info_is_refetched_once_older_than_its_ttl(tmp_path, monkeypatch):
+    import price_cache
+
+    now = 1_000_000.0
+    monkeypatch.setattr(price_cache.time, 'time', lambda: now)
+    cache = PriceCache(str(tmp_path / "prices.sqlite"), info_ttl_days=7)
+    calls = []
+
+    def fetch(symbol):
+        calls.append(symbol)
+        return {'sector': f"Sector {len(calls)}"}
+
+    assert cache.get_info('AAA', fetch) == {'sector': "Sector 1"}
+    now += 6 * 86400
+    assert cache.get_info('AAA', fetch) == {'sector': "Sector 1"}
+    now += 2 * 86400
+    assert cache.get_info('AAA', fetch) == {'sector': "Sector 2"}
+    assert calls == ['AAA', 'AAA']
+    # Offline the expired copy is served as is
+    now += 30 * 86400
+    cache.offline = True
+    assert cache.get_info('AAA', fetch) == {'sector': "Sector 2"}
+    assert len(calls) == 2
+    cache.close()
+
+
+class CountingSource:
+    """Wraps a ReplaySource and counts the history / info requests per symbol."""
+
+    def __init__(self):
+        from data_sources import ReplaySource
+        self.source = ReplaySource(seed=3)
+        self.calls = []
+
+    def history(self, symbol, start=None, end=None):
+        self.calls.append(('history', symbol))
+        return self.source.history(symbol, start, end)
+
+    def info(self, symbol):
+        self.calls.append(('info', symbol))
+        return self.source.info(symbol)
+
+
+@pytest.fixture
+def counting_source():
+    from data_sources import set_source
+
+    source = CountingSource()
+    previous = set_source(source)
+    yield source
+    set_source(previous)
+
+
+def test_symbol_takes_one_history_and_one_info_request(counting_source):
+    import SymbolScraping
+
+    payload = SymbolScraping.fetch_symbol_payload('SYN0001', "2018-01-01", "2020-01-01")
+    assert payload is not None
+    assert counting_source.calls == [('history', 'SYN0001'), ('info', 'SYN0001')]
+
+
+def test_cached_symbol_takes_no_request(cache, counting_source):
+    import SymbolScraping
+
+    SymbolScraping.fetch_symbol_payload('SYN0001', "2018-01-01", "2020-01-01", cache=cache)
+    assert counting_source.calls == [('history', 'SYN0001'), ('info', 'SYN0001')]
+    counting_source.calls.clear()
+    hist, info, _, _ = SymbolScraping.fetch_symbol_payload('SYN0001', "2018-06-01", "2020-01-01", cache=cache)
+    assert counting_source.calls == []
+    assert not hist.empty and info['sector'] == 'Synthetic'
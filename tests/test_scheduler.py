@@ -0,0 +1,154 @@
+import logging
+import time
+
+import pandas as pd
+import pytest
+
+import SymbolScraping
+from data_sources import RateLimitError, YFinanceSource
+from scheduler import FetchScheduler, TokenBucket, is_rate_limit_error, is_retryable
+
+
+def test_bucket_allows_a_burst_then_the_rate():
+    bucket = TokenBucket(rate=20, burst=3)
+    started = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.04
+    for _ in range(2):
+        bucket.acquire()
+    assert time.monotonic() - started >= 0.09
+
+
+def test_pause_holds_every_token():
+    bucket = TokenBucket(rate=1000, burst=5)
+    bucket.pause(0.1)
+    started = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - started >= 0.09
+
+
+class Flaky:
+    """Fails the first failures calls with error, then returns 'ok'."""
+
+    def __init__(self, failures, error):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return 'ok'
+
+
+def test_request_retries_rate_limits_with_backoff():
+    scheduler = FetchScheduler(rate=1000, retries=3, backoff=0.01)
+    func = Flaky(2, RateLimitError("429 Too Many Requests"))
+    assert scheduler.request(func) == 'ok'
+    assert func.calls == 3
+    assert scheduler.retry_count == 2
+    assert scheduler.request_count == 3
+
+
+def test_request_gives_up_after_the_retries():
+    scheduler = FetchScheduler(rate=1000, retries=2, backoff=0.01)
+    func = Flaky(5, TimeoutError("timed out"))
+    with pytest.raises(TimeoutError):
+        scheduler.request(func)
+    assert func.calls == 3
+
+
+def test_request_doesnt_retry_other_errors():
+    scheduler = FetchScheduler(rate=1000, retries=3, backoff=0.01)
+    func = Flaky(1, KeyError('Close'))
+    assert not is_retryable(func.error)
+    with pytest.raises(KeyError):
+        scheduler.request(func)
+    assert func.calls == 1
+
+
+def test_request_weight_takes_a_token_per_request():
+    # The weight is above the bucket capacity, taking the tokens at once would never return
+    scheduler = FetchScheduler(rate=100, burst=2)
+    started = time.monotonic()
+    assert scheduler.request(lambda: 'ok', weight=6) == 'ok'
+    assert time.monotonic() - started >= 0.035
+    assert scheduler.request_count == 6
+
+
+class HTTPError(Exception):
+    def __init__(self, message, code=None, status_code=None):
+        super().__init__(message)
+        self.code = code
+        self.response = type('Response', (), {'status_code': status_code})()
+
+
+@pytest.mark.parametrize('error, expected', [
+    (RateLimitError("injected"), True),
+    (HTTPError("HTTP Error", code=429), True),
+    (HTTPError("Client Error", status_code=429), True),
+    (RuntimeError("429 Too Many Requests"), True),
+    (HTTPError("Not Found", code=404, status_code=404), False),
+    (KeyError("4290.HK"), False),
+    (ValueError("Close 1429.5 out of range"), False),
+])
+def test_rate_limit_errors(error, expected):
+    assert is_rate_limit_error(error) is expected
+
+
+def test_run_survives_failing_callbacks():
+    def task(symbol):
+        if symbol == 'BAD':
+            raise KeyError('Close')
+        return symbol.lower()
+
+    def broken(symbol, value):
+        raise OSError("disk full")
+
+    scheduler = FetchScheduler(workers=2, rate=1000)
+    results = scheduler.run(['AAA', 'BAD', 'CCC'], task, on_result=broken, on_error=broken)
+    assert results == {'AAA': 'aaa', 'CCC': 'ccc'}
+    assert list(scheduler.errors) == ['BAD']
+
+
+def history(start="2020-01-01", end="2021-01-01"):
+    dates = pd.bdate_range(start, end, inclusive='left')
+    close = pd.Series(range(1, len(dates) + 1), index=dates, dtype=float)
+    return pd.DataFrame({'Close': close, 'Volume': 1000.0}, index=dates)
+
+
+def test_download_retries_the_tickers_missing_from_the_payload(monkeypatch):
+    calls = []
+
+    def download(symbols, threads=None, **kwargs):
+        calls.append((list(symbols), threads))
+        # BBB fails the first time (all NaN), CCC never comes back
+        frames = {symbol: history() for symbol in symbols if symbol != 'CCC'}
+        if len(calls) == 1:
+            frames['BBB'] = frames['BBB'] * float('nan')
+        return pd.concat(frames, axis=1)
+
+    scheduler = FetchScheduler(rate=1000)
+    monkeypatch.setattr(SymbolScraping, '_timed_download', download)
+    histories, failed, empty = SymbolScraping._download_chunks(['AAA', 'BBB', 'CCC', 'DDD', 'EEE', 'FFF'], chunk_size=6,
+                                                               request=scheduler.request, period="max")
+    assert sorted(histories) == ['AAA', 'BBB', 'DDD', 'EEE', 'FFF']
+    assert failed == []
+    assert empty == ['CCC']
+    assert calls == [(['AAA', 'BBB', 'CCC', 'DDD', 'EEE', 'FFF'], SymbolScraping.download_threads), (['BBB', 'CCC'], 2)]
+    assert scheduler.request_count == 8
+
+
+def test_fully_rate_limited_download_raises(monkeypatch):
+    import yfinance
+
+    def download(symbols, **kwargs):
+        logging.getLogger('yfinance').error("['AAA', 'BBB']: YFRateLimitError('Too Many Requests. Rate limited.')")
+        return pd.DataFrame()
+
+    monkeypatch.setattr(yfinance, 'download', download)
+    with pytest.raises(RateLimitError) as excinfo:
+        YFinanceSource().download(['AAA', 'BBB'])
+    assert is_retryable(excinfo.value)
@@ -0,0 +1,59 @@
+import re
+
+import telemetry
+from telemetry import Telemetry, default_telemetry
+
+# One sample line of the text exposition format: name, optional {labels}, value
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? \S+$')
+
+
+def test_stage_and_count_update_the_default_telemetry():
+    before = default_telemetry.snapshot()
+    with telemetry.stage('range_fetch'):
+        pass
+    telemetry.record('range_fetch', 0.5)
+    telemetry.count('requests', 3)
+    telemetry.cache_result('prices', hit=True)
+    telemetry.cache_result('prices', hit=False)
+
+    summary = default_telemetry.summary(since=before)
+    assert summary['stages']['range_fetch']['calls'] == 2
+    assert summary['stages']['range_fetch']['seconds'] >= 0.5
+    assert summary['counters']['requests'] == 3
+    assert summary['cache_hit_rates'] == {'prices': 0.5}
+
+
+def test_prometheus_exposition():
+    metrics = Telemetry()
+    metrics.record('info_fetch', 0.25)
+    metrics.record('info_fetch', 0.75)
+    metrics.count('requests', 5)
+    metrics.count('retries', reason='429 "Too Many"\nRequests\\')
+    text = metrics.prometheus()
+    lines = text.splitlines()
+
+    assert text.endswith("\n")
+    assert "# TYPE stockscribe_stage_seconds summary" in lines
+    assert 'stockscribe_stage_seconds_sum{stage="info_fetch"} 1.0' in lines
+    assert 'stockscribe_stage_seconds_count{stage="info_fetch"} 2' in lines
+    assert 'stockscribe_stage_seconds_max{stage="info_fetch"} 0.75' in lines
+    assert "# TYPE stockscribe_requests_total counter" in lines
+    assert "stockscribe_requests_total 5" in lines
+    assert "# TYPE stockscribe_retries_total counter" in lines
+    assert 'stockscribe_retries_total{reason="429 \\"Too Many\\"\\nRequests\\\\"} 1' in lines
+    assert "# TYPE stockscribe_uptime_seconds gauge" in lines
+    for line in lines:
+        assert line.startswith("# ") or SAMPLE.match(line), line
+    # Every sample is preceded by the TYPE line of its metric family
+    declared = {line.split()[2] for line in lines if line.startswith("# TYPE")}
+    for line in lines:
+        if not line.startswith("#"):
+            name = re.match(r'[a-zA-Z_:][a-zA-Z0-9_:]*', line).group()
+            assert name in declared or re.sub(r'_(sum|count)$', '', name) in declared, name
+
+
+def test_reset_clears_the_counters():
+    metrics = Telemetry()
+    metrics.count('requests')
+    metrics.reset()
+    assert metrics.summary()['counters'] == {}
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from universe import Universe, normalize_constituents, normalize_tickers
+
+
+def test_share_class_dots_become_dashes():
+    tickers = normalize_tickers(["BRK.B", "BF.B", "AAPL", " MSFT "], "S&P 500")
+    assert list(tickers) == ["BRK-B", "BF-B", "AAPL", "MSFT"]
+
+
+def test_exchange_suffixes_are_kept():
+    assert list(normalize_tickers(["SAP.DE", "BMW3.DE", "VOD.L"], "DAX")) == ["SAP.DE", "BMW3.DE", "VOD.L"]
+    # Only the suffix keeps its dot
+    assert list(normalize_tickers(["BT.A.L"])) == ["BT-A.L"]
+
+
+def test_index_suffix_is_added_once():
+    tickers = normalize_tickers(["VOD", "BT.A", "HSBA.L"], "FTSE 100")
+    assert list(tickers) == ["VOD.L", "BT-A.L", "HSBA.L"]
+
+
+def test_missing_tickers_stay_missing():
+    tickers = normalize_tickers(["AAA", None, "", float('nan')], "FTSE 100")
+    assert tickers.iloc[0] == "AAA.L"
+    assert tickers.iloc[1:].isna().all()
+
+
+def test_normalize_constituents_uses_the_ticker_column():
+    table = pd.DataFrame({'Ticker': ["BRK.B", "VOD"], 'Company': ["Berkshire", "Vodafone"]})
+    normalized = normalize_constituents(table, "FTSE 100")
+    assert list(normalized['Ticker']) == ["BRK-B.L", "VOD.L"]
+    assert list(table['Ticker']) == ["BRK.B", "VOD"]
+    # A table without a ticker column is returned as is
+    assert normalize_constituents(table[['Company']], "FTSE 100").equals(table[['Company']])
+
+
+def test_universe_dedupes_symbols_across_indices():
+    tables = {
+        "S&P 500": normalize_constituents(pd.DataFrame({'Symbol': ["AAPL", "MSFT", "BRK.B", "AAPL"]}), "S&P 500"),
+        "NASDAQ 100": normalize_constituents(pd.DataFrame({'Ticker': ["MSFT", "AAPL", "NVDA", None]}), "NASDAQ 100"),
+        "Dow Jones": normalize_constituents(pd.DataFrame({'Symbol': ["AAPL", "BRK.B"]}), "Dow Jones"),
+    }
+    universe = Universe(tables)
+    assert universe.symbols == ["AAPL", "MSFT", "BRK-B", "NVDA"]
+    assert len(universe.members) == 8
+    assert universe.indices_of("AAPL") == ["S&P 500", "NASDAQ 100", "Dow Jones"]
+    assert universe.membership.loc["BRK-B", 'Indices'] == "S&P 500, Dow Jones"
+    assert list(universe.membership.loc["NVDA", ["S&P 500", "NASDAQ 100", "Dow Jones"]]) == [False, True, False]
+    assert universe.overlap() == {1: 1, 2: 2, 3: 1}
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scheduler import FetchScheduler
+from SymbolScraping import RESULT_COLUMNS, result_dtypes
+from writers import MergedSheetWriter, open_writer
+
+pytest.importorskip('pyarrow')
+
+
+def read(path, file_format):
+    if file_format == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_feather(path)
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+def test_column_null_in_the_first_chunk(tmp_path, file_format):
+    path = str(tmp_path / f"out.{file_format}")
+    with open_writer(path, ['Symbol', 'Note'], file_format=file_format, chunk_size=2) as writer:
+        writer.write_frame(pd.DataFrame({'Symbol': ['A', 'B', 'C', 'D'], 'Note': [None, None, 'late', 'text']}))
+    notes = read(path, file_format)['Note']
+    assert notes.isna().tolist() == [True, True, False, False]
+    assert list(notes[2:]) == ['late', 'text']
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+def test_text_in_a_number_column(tmp_path, file_format):
+    path = str(tmp_path / f"out.{file_format}")
+    with open_writer(path, ['Symbol', 'P/E Ratio'], file_format=file_format, chunk_size=2) as writer:
+        writer.write_frame(pd.DataFrame({'Symbol': ['A', 'B', 'C', 'D'], 'P/E Ratio': [12.5, 8.0, 'Infinity', 'N/A']}))
+    values = read(path, file_format)['P/E Ratio']
+    assert values.dtype == np.float64
+    assert list(values[:3]) == [12.5, 8.0, np.inf] and np.isnan(values[3])
+
+
+def test_merged_sheet_keeps_result_types(tmp_path):
+    path = str(tmp_path / "out.parquet")
+    sheet = pd.DataFrame({'Symbol': ['A', 'B', 'C'], 'Weight': [0.5, 0.3, 0.2]})
+    output = MergedSheetWriter(sheet, RESULT_COLUMNS, path, chunk_size=1, result_dtypes=result_dtypes(RESULT_COLUMNS))
+    output.add_result('A', {'Symbol': 'A', 'P/E Ratio': np.nan, 'Sector/Industry': None, 'Incomplete Data': True})
+    output.add_result('B', {'Symbol': 'B', 'P/E Ratio': 'Infinity', 'Sector/Industry': 'Tech / Software', 'Incomplete Data': False})
+    output.close()
+
+    written = pd.read_parquet(path).set_index('Symbol')
+    assert list(written.index) == ['A', 'B', 'C']
+    assert written.loc['B', 'P/E Ratio'] == np.inf
+    assert written.loc['B', 'Sector/Industry'] == 'Tech / Software'
+    assert written['Incomplete Data'].tolist() == [True, False, None]
+    assert written['Weight'].tolist() == [0.5, 0.3, 0.2]
+
+
+def test_failing_result_callback_doesnt_stop_the_run():
+    reported = []
+
+    def on_result(symbol, result):
+        if symbol == 'B':
+            raise ValueError("writer failed")
+        reported.append(symbol)
+
+    results = FetchScheduler(workers=2, rate=1000).run(['A', 'B', 'C'], lambda symbol: symbol.lower(), on_result=on_result)
+    assert results == {'A': 'a', 'B': 'b', 'C': 'c'}
+    assert sorted(reported) == ['A', 'C']
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'arrow'])
+def test_integer_sheet_columns_stay_integers(tmp_path, file_format):
+    path = str(tmp_path / f"out.{file_format}")
+    sheet = pd.DataFrame({'Symbol': ['A', 'B'], 'ID': [2 ** 60 + 1, 7], 'Weight': [0.5, 0.5]})
+    output = MergedSheetWriter(sheet, RESULT_COLUMNS, path, file_format=file_format, chunk_size=1,
+                               result_dtypes=result_dtypes(RESULT_COLUMNS))
+    output.add_result('A', {'Symbol': 'A', 'Beta': 1.2})
+    output.close()
+    written = read(path, file_format)
+    assert written['ID'].dtype == np.int64
+    assert written['ID'].tolist() == [2 ** 60 + 1, 7]
+    assert written['Weight'].dtype == np.float64
+
+
+@pytest.mark.parametrize('file_format', ['xlsx', 'csv', 'parquet'])
+def test_merged_sheet_keeps_the_sheet_order(tmp_path, file_format):
+    path = str(tmp_path / f"out.{file_format}")
+    sheet = pd.DataFrame({'Symbol': ['A', 'B', None, 'C', 'A', 'D', 'E'], 'Row': range(7)})
+    output = MergedSheetWriter(sheet, RESULT_COLUMNS, path, chunk_size=1, result_dtypes=result_dtypes(RESULT_COLUMNS))
+    output.add_result('C', {'Symbol': 'C', 'Beta': 3.0})
+    output.add_result('E', {'Symbol': 'E', 'Beta': 5.0})
+    assert output.writer.rows_written == 0
+    output.add_result('A', {'Symbol': 'A', 'Beta': 1.0})
+    assert output.writer.rows_written == 1
+    # B failed, the rows below it don't wait for it anymore
+    output.add_failure('B', "No data returned")
+    assert output.writer.rows_written == 5
+    output.close()
+
+    written = {'xlsx': pd.read_excel, 'csv': pd.read_csv, 'parquet': pd.read_parquet}[file_format](path)
+    assert written['Row'].tolist() == list(range(7))
+    assert written['Beta'].fillna(0).tolist() == [1.0, 0, 0, 3.0, 1.0, 0, 5.0]
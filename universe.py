@@ -0,0 +1,120 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+INDEX_INFO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server", "indices.json")
+
+# Suffix YFinance needs on the tickers of an index whose Wikipedia table lists bare exchange codes
+INDEX_SUFFIXES = {"FTSE 100": ".L"}
+
+# Exchange suffixes already on some tables (DAX lists SAP.DE), kept as is when the dots of the ticker become dashes
+EXCHANGE_SUFFIXES = (".L", ".DE")
+
+
+def load_index_info(path=INDEX_INFO_PATH):
+    """The index name -> {"url", "table_index"} dictionary shared by the CLI and the Flask app."""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def symbol_column(constituents):
+    """Name of the ticker column of a constituents table (the Wikipedia tables use either Ticker or Symbol)."""
+    for column in ('Ticker', 'Symbol'):
+        if column in constituents.columns:
+            return column
+    return None
+
+
+def normalize_tickers(tickers, index_name=None):
+    """YFinance tickers from a column of Wikipedia tickers, with vectorized string ops: dots become dashes (BRK.B ->
+    BRK-B) except in an exchange suffix (SAP.DE stays), then the index suffix is added (FTSE 100: VOD -> VOD.L).
+    Missing values stay missing.
+    """
+    tickers = pd.Series(tickers).astype('string').str.strip()
+    suffix_pattern = "|".join(suffix.replace('.', r'\.') for suffix in EXCHANGE_SUFFIXES)
+    parts = tickers.str.extract(rf"^(?P<root>.*?)(?P<suffix>{suffix_pattern})?$")
+    normalized = parts['root'].str.replace('.', '-', regex=False) + parts['suffix'].fillna('')
+
+    index_suffix = INDEX_SUFFIXES.get(index_name)
+    if index_suffix:
+        needs_suffix = ~normalized.str.endswith(index_suffix, na=False) & normalized.notna()
+        normalized = normalized.mask(needs_suffix, normalized + index_suffix)
+    return normalized.where(tickers.notna() & (tickers != ""))
+
+
+def normalize_constituents(constituents, index_name):
+    """Copy of a constituents table with its Ticker / Symbol column normalized (see normalize_tickers)."""
+    constituents = constituents.copy()
+    column = symbol_column(constituents)
+    if column is not None:
+        constituents[column] = normalize_tickers(constituents[column], index_name).astype(object)
+    return constituents
+
+
+class Universe:
+    """Constituents of several indices merged into one set of unique symbols.
+
+    tables: index name -> normalized constituents table
+    members: one row per (Symbol, Index) membership
+    membership: indexed by unique symbol, one boolean column per index plus 'Indices' (e.g. "S&P 500, NASDAQ 100")
+    symbols: every unique symbol once, in the order the indices were listed
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        frames = []
+        for index_name, table in tables.items():
+            column = symbol_column(table)
+            if column is None:
+                print(f"No Ticker / Symbol column in the {index_name} table, skipping it.")
+                continue
+            frames.append(pd.DataFrame({'Symbol': table[column], 'Index': index_name}).dropna())
+        members = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['Symbol', 'Index'])
+        self.members = members.drop_duplicates(ignore_index=True)
+
+        index_order = list(tables)
+        self.membership = pd.crosstab(self.members['Symbol'], self.members['Index']).reindex(columns=index_order, fill_value=0) > 0
+        self.membership = self.membership.reindex(self.members['Symbol'].unique()).rename_axis(index='Symbol', columns=None)
+        self.membership['Indices'] = self.members.groupby('Symbol', sort=False)['Index'].agg(", ".join)
+        self.symbols = list(self.membership.index)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def indices_of(self, symbol):
+        return list(self.members.loc[self.members['Symbol'] == symbol, 'Index'])
+
+    def overlap(self):
+        """Number of symbols per number of indices they belong to, e.g. {1: 540, 2: 70, 3: 20}."""
+        return self.membership.drop(columns='Indices').sum(axis=1).value_counts().sort_index().to_dict()
+
+
+def fetch_universe(index_names=None, index_info=None, block=True, workers=4):
+    """Fetch the constituents of several indices at the same time (workers threads through the shared constituents
+    cache) and merge them into a Universe, so every symbol is fetched and scored once however many indices list it.
+    index_names defaults to every index of index_info (server/indices.json by default). Indices that fail are left out.
+    """
+    from constituents import get_constituents
+
+    index_info = index_info or load_index_info()
+    index_names = list(index_names or index_info)
+    unknown = [index_name for index_name in index_names if index_name not in index_info]
+    if unknown:
+        raise ValueError(f"Unsupported indices: {', '.join(unknown)}")
+
+    def fetch(index_name):
+        index_data = index_info[index_name]
+        table = get_constituents(index_name, index_data["url"], index_data["table_index"], block=block)
+        return normalize_constituents(table, index_name)
+
+    tables = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="universe") as executor:
+        futures = {index_name: executor.submit(fetch, index_name) for index_name in index_names}
+        for index_name, future in futures.items():
+            try:
+                tables[index_name] = future.result()
+            except Exception as e:
+                print(f"Error fetching data for {index_name}: {e}")
+    return Universe(tables)
@@ -0,0 +1,326 @@
+import csv
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from telemetry import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet / Arrow output is optional
+    pa = None
+    pq = None
+
+
+class ResultWriter:
+    """Base class of the chunked output writers. Rows are buffered and flushed every chunk_size rows, so a run never
+    holds more than one chunk of output in memory and results land on disk while the run is still going.
+    dtypes: column -> 'float' / 'int' / 'bool' / 'string' for the typed formats (parquet / arrow), see column_kinds.
+    """
+
+    def __init__(self, path, columns, chunk_size=500, dtypes=None):
+        self.path = path
+        self.columns = list(columns)
+        self.chunk_size = chunk_size
+        self.dtypes = dtypes or {}
+        self.buffer = []
+        self.rows_written = 0
+
+    def write_row(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def write_frame(self, frame):
+        for row in frame.to_dict('records'):
+            self.write_row(row)
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with stage('export'):
+            chunk = pd.DataFrame(self.buffer).reindex(columns=self.columns)
+            self.buffer = []
+            self._write_chunk(chunk)
+        self.rows_written += len(chunk)
+
+    def _write_chunk(self, chunk):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvResultWriter(ResultWriter):
+    def __init__(self, path, columns, chunk_size=500, dtypes=None):
+        super().__init__(path, columns, chunk_size, dtypes)
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        csv.writer(self.file).writerow(self.columns)
+
+    def _write_chunk(self, chunk):
+        chunk.to_csv(self.file, header=False, index=False)
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class ParquetResultWriter(ResultWriter):
+    """Every flushed chunk becomes one Parquet row group, all of them coerced to the schema of the first one."""
+
+    def __init__(self, path, columns, chunk_size=500, dtypes=None):
+        if pq is None:
+            raise ImportError("pyarrow is required for parquet output")
+        super().__init__(path, columns, chunk_size, dtypes)
+        self.kinds = None
+        self.writer = None
+
+    def _write_chunk(self, chunk):
+        if self.kinds is None:
+            self.kinds = column_kinds(chunk, self.dtypes)
+        table = _arrow_table(chunk, self.kinds)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self.writer is None:
+            empty = pd.DataFrame(columns=self.columns)
+            pq.write_table(_arrow_table(empty, column_kinds(empty, self.dtypes)), self.path)
+        else:
+            self.writer.close()
+
+
+class ArrowResultWriter(ResultWriter):
+    """Arrow IPC file, one record batch per flushed chunk, all of them coerced to the schema of the first one."""
+
+    def __init__(self, path, columns, chunk_size=500, dtypes=None):
+        if pa is None:
+            raise ImportError("pyarrow is required for arrow output")
+        super().__init__(path, columns, chunk_size, dtypes)
+        self.kinds = None
+        self.sink = None
+        self.writer = None
+
+    def _write_chunk(self, chunk):
+        if self.kinds is None:
+            self.kinds = column_kinds(chunk, self.dtypes)
+        table = _arrow_table(chunk, self.kinds)
+        if self.writer is None:
+            self.sink = pa.OSFile(self.path, 'wb')
+            self.writer = pa.ipc.new_file(self.sink, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self.writer is None:
+            empty = pd.DataFrame(columns=self.columns)
+            table = _arrow_table(empty, column_kinds(empty, self.dtypes))
+            with pa.OSFile(self.path, 'wb') as sink, pa.ipc.new_file(sink, table.schema):
+                pass
+        else:
+            self.writer.close()
+            self.sink.close()
+
+
+class XlsxResultWriter(ResultWriter):
+    """openpyxl write only workbook, rows are streamed into the sheet instead of building the whole workbook in memory."""
+
+    def __init__(self, path, columns, chunk_size=500, sheet_name="Sheet1", dtypes=None):
+        from openpyxl import Workbook
+        super().__init__(path, columns, chunk_size, dtypes)
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(sheet_name)
+        self.sheet.append(self.columns)
+
+    def _write_chunk(self, chunk):
+        for row in chunk.itertuples(index=False, name=None):
+            self.sheet.append([_cell(value) for value in row])
+
+    def close(self):
+        super().close()
+        with stage('export'):
+            self.workbook.save(self.path)
+
+
+WRITERS = {
+    'csv': CsvResultWriter,
+    'parquet': ParquetResultWriter,
+    'arrow': ArrowResultWriter,
+    'xlsx': XlsxResultWriter,
+}
+
+
+def output_format(path, file_format=None):
+    """Explicit format, or the one matching the file extension (xlsx when the extension is unknown)."""
+    if file_format:
+        return file_format
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    return {'feather': 'arrow', 'ipc': 'arrow', 'pq': 'parquet'}.get(extension, extension if extension in WRITERS else 'xlsx')
+
+
+def open_writer(path, columns, file_format=None, chunk_size=500, **kwargs):
+    """Open the chunked writer for a path, e.g. open_writer("out.parquet", columns) or open_writer(path, columns, "csv")."""
+    file_format = output_format(path, file_format)
+    if file_format not in WRITERS:
+        raise ValueError(f"Unsupported output format '{file_format}', use one of {', '.join(WRITERS)}.")
+    if file_format != 'xlsx':
+        kwargs.pop('sheet_name', None)
+    return WRITERS[file_format](path, columns, chunk_size=chunk_size, **kwargs)
+
+
+class MergedSheetWriter:
+    """Writes the input sheet merged with the fetch_stock_data results (the same left merge on Symbol upload symbol script
+    always did) while results come in, in the sheet's row order: a row is written once its symbol and every one above it
+    got a result or a failure (add_failure), the rows still waiting are written on close. Only the results of the rows
+    not written yet are held. Safe to call from the worker threads.
+    result_dtypes: column -> kind of the result columns (see column_kinds), the sheet columns keep the sheet's types.
+    """
+
+    def __init__(self, sheet_df, result_columns, path, file_format=None, chunk_size=500, sheet_name="Sheet1", result_dtypes=None):
+        self.sheet_df = sheet_df.reset_index(drop=True)
+        self.result_columns = list(result_columns)
+        columns = sheet_df.head(0).merge(pd.DataFrame(columns=self.result_columns), on='Symbol', how='left').columns
+        dtypes = {**column_kinds(sheet_df), **(result_dtypes or {})}
+        self.writer = open_writer(path, columns, file_format=file_format, chunk_size=chunk_size, sheet_name=sheet_name,
+                                  dtypes=dtypes)
+        self.symbols = self.sheet_df['Symbol'].tolist()
+        # Row of each symbol's last sheet row, its result can go once that row is written (rows without a symbol never
+        # get a result, they don't wait for anything)
+        self.last_rows = {symbol: row for row, symbol in enumerate(self.symbols) if not pd.isna(symbol)}
+        self.results = {}
+        self.failed = set()
+        self.next_row = 0
+        self.lock = threading.Lock()
+
+    def add_result(self, symbol, data):
+        with self.lock:
+            if symbol not in self.last_rows or self.last_rows[symbol] < self.next_row:
+                return
+            self.results[symbol] = data
+            self._write_ready()
+
+    def add_failure(self, symbol, error=None):
+        """The symbol won't get a result, its rows are written without one (on_error signature)."""
+        with self.lock:
+            if symbol in self.last_rows and self.last_rows[symbol] >= self.next_row:
+                self.failed.add(symbol)
+                self._write_ready()
+
+    def _ready(self, symbol):
+        return symbol in self.results or symbol in self.failed or symbol not in self.last_rows
+
+    def _write_ready(self):
+        end = self.next_row
+        while end < len(self.symbols) and self._ready(self.symbols[end]):
+            end += 1
+        self._write_rows(end)
+
+    def _write_rows(self, end):
+        """Write the sheet rows up to end (exclusive) merged with their results and forget those results."""
+        if end <= self.next_row:
+            return
+        rows = self.sheet_df.iloc[self.next_row:end]
+        symbols = [symbol for symbol in dict.fromkeys(rows['Symbol']) if symbol in self.results]
+        results = pd.DataFrame([self.results[symbol] for symbol in symbols], columns=self.result_columns)
+        self.writer.write_frame(rows.merge(results, on='Symbol', how='left'))
+        for symbol in symbols:
+            if self.last_rows[symbol] < end:
+                del self.results[symbol]
+        self.failed = {symbol for symbol in self.failed if self.last_rows[symbol] >= end}
+        self.next_row = end
+
+    def close(self):
+        with self.lock:
+            self._write_rows(len(self.symbols))
+            self.writer.close()
+
+
+def write_price_matrix(close, path, file_format=None):
+    """Persist a date x symbol price matrix (PriceStore.frame) next to the metrics output."""
+    with stage('export'):
+        _write_matrix(close, path, output_format(path, file_format))
+
+
+def _write_matrix(close, path, file_format):
+    frame = close.copy()
+    frame.index.name = 'Date'
+    frame.columns = [str(column) for column in frame.columns]
+    if file_format == 'parquet':
+        frame.to_parquet(path)
+    elif file_format == 'arrow':
+        frame.reset_index().to_feather(path)
+    elif file_format == 'csv':
+        frame.to_csv(path)
+    else:
+        with pd.ExcelWriter(path, engine='openpyxl') as writer:
+            frame.to_excel(writer, sheet_name="Close")
+
+
+def column_kinds(frame, dtypes=None):
+    """column -> 'float' / 'int' / 'bool' / 'string', the type a column is written with in the typed formats. dtypes
+    wins, the other columns follow the frame: integer columns without a missing value (IDs, counts) stay integers, the
+    other numbers become floats (so a missing value later on doesn't change the type), booleans stay booleans and
+    everything else, all missing columns included, is written as text.
+    """
+    dtypes = dtypes or {}
+    kinds = {}
+    for column in frame.columns:
+        if column in dtypes:
+            kinds[column] = dtypes[column]
+        elif pd.api.types.is_bool_dtype(frame[column]):
+            kinds[column] = 'bool'
+        elif pd.api.types.is_integer_dtype(frame[column]) and frame[column].notna().all():
+            kinds[column] = 'int'
+        elif pd.api.types.is_numeric_dtype(frame[column]) and frame[column].notna().any():
+            kinds[column] = 'float'
+        else:
+            kinds[column] = 'string'
+    return kinds
+
+
+def _arrow_table(chunk, kinds):
+    """Convert a chunk to the Arrow table of the given column kinds. Every value is coerced rather than cast, so the
+    chunks of one file always share a schema: text in a number column (e.g. a 'N/A' P/E) becomes null, 'Infinity'
+    becomes inf (null in an integer column), anything in a text column is written as its string.
+    """
+    arrays = {}
+    for column, kind in kinds.items():
+        values = chunk[column] if column in chunk.columns else pd.Series([None] * len(chunk), dtype=object)
+        if kind == 'float':
+            arrays[column] = pa.array(pd.to_numeric(values, errors='coerce').astype(float), type=pa.float64(), from_pandas=True)
+        elif kind == 'int':
+            numbers = pd.to_numeric(values, errors='coerce')
+            if not pd.api.types.is_integer_dtype(numbers):
+                numbers = numbers.astype(float).where(numbers % 1 == 0)
+            arrays[column] = pa.array(numbers, type=pa.int64(), from_pandas=True)
+        elif kind == 'bool':
+            arrays[column] = pa.array([bool(value) if isinstance(value, (bool, np.bool_)) else None for value in values],
+                                      type=pa.bool_())
+        else:
+            arrays[column] = pa.array([None if _missing(value) else str(value) for value in values], type=pa.string())
+    return pa.table(arrays)
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value) or value is pd.NaT or value is pd.NA
+
+
+def _cell(value):
+    """openpyxl can't write numpy scalars or NaN."""
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value